@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# benchmark.py
+# usage: benchmark.py save baseline_file [rows ...]
+#        benchmark.py compare baseline_file [rows ...]
+# Times and memory-profiles every evaluator stage on synthetic data (see synthetic_data.py), at
+# each of the given truth table sizes (1000, 10000 and 100000 rows by default):
+#	profiling - parse      reading the truth and submission tables
+#	            sweep      TP/FP/FN of every level and sample at the PRC cutoffs (sample_counts)
+#	            metrics    the precision-recall curves, F1 and AUPRC from those counts (iterate_loop)
+#	            braycurtis Bray-Curtis and Jaccard for every rank and sample, and UniFrac
+#	            annotate   parse_NCBI_ids.py's annotated tables and Krona chart
+#	            output     compare_results.py (counting per sample, by default) and calculate_BC.py
+#	                       writing their files
+#	            exact      compare_results.py's opt-in exact mode writing its files
+#	strains2  - parse      reading the truth and submission matrices
+#	            metrics    TP/FP/TN/FN, the metrics and the adjusted Rand index
+#	            sweep      strains2_evaluator.py's confidence sweep, writing its files
+# Each evaluator and size runs in a fresh process, MOSAIC_BENCH_REPEATS times (3 by default);
+# the fastest time and the largest peak RSS are kept. Peak RSS is the process's high-water mark
+# once the stage is done, so it covers that stage and everything before it.
+#
+# "save" writes the results to baseline_file as JSON. "compare" runs the same benchmarks, prints
+# each stage next to its baseline, and exits with an error if any stage got slower or bigger than
+# MOSAIC_BENCH_TOLERANCE times its baseline (1.5 by default). Stages under MIN_SECONDS in the
+# baseline are too quick to time reliably, so only their memory is checked.
+# Baselines are only comparable on the machine they were saved on.
+
+# imports
+import sys, os, json, time, codecs, shutil, tempfile, subprocess
+import numpy as np
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, os.pardir, "strains1", "evaluation_assets", "profiling"))
+sys.path.insert(0, os.path.join(here, os.pardir, "strains2", "evaluation_assets"))
+import synthetic_data, stage_timer
+
+DEFAULT_ROWS = [1000, 10000, 100000]
+EVALUATORS = ["profiling", "strains2"]
+MIN_SECONDS = 0.05
+
+def profiling_stages(truth_file, submission_file):
+	# (stage, function) in the order they run; each function gets the dict the earlier ones filled in
+	import lineage, braycurtis, compare_results, calculate_BC, parse_NCBI_ids, ncbi_taxonomy, result_writer
+
+	def parse(state):
+		state["truth"] = lineage.read_lineage_table(truth_file)
+		state["submission"] = lineage.read_lineage_table(submission_file)
+		state["unique_truth"] = lineage.drop_duplicate_rows(state["truth"])
+		state["unique_submission"] = lineage.drop_duplicate_rows(state["submission"])
+
+	def sweep(state):
+		# compare_results' default counting, as score_submission does it
+		state["cutoffs"] = [0] + compare_results.iterate_cutoffs()
+		state["counts"] = compare_results.sample_counts(state["unique_truth"], state["unique_submission"], state["cutoffs"])
+
+	def metrics(state):
+		stats = compare_results.counted_stats(state["counts"][:, :, -1], state["cutoffs"])
+		for level in compare_results.LEVELS:
+			prc_table = result_writer.ResultTable(os.devnull, compare_results.PRC_COLUMNS)
+			compare_results.iterate_loop(state["unique_submission"], state["unique_truth"], level, prc_table, stats)
+
+	def bray_curtis(state):
+		one, two = state["truth"], state["submission"]
+		positions, bounds = braycurtis.taxon_index([one, two], braycurtis.CLADES)
+		profile_one, counts_one = braycurtis.rank_profiles(one, positions[0], bounds[-1])
+		profile_two, counts_two = braycurtis.rank_profiles(two, positions[1], bounds[-1])
+		braycurtis.similarity(profile_one, profile_two, bounds)
+		braycurtis.similarity(counts_one, counts_two, bounds)
+		braycurtis.jaccard(counts_one, counts_two, bounds)
+		braycurtis.unifrac(profile_one, profile_two, braycurtis.tree_nodes([one, two], positions, bounds[-1]), bounds)
+
+	def annotate(state):
+		resolver = ncbi_taxonomy.TaxonomyResolver(ncbi_taxonomy.TaxonomySnapshot(truth_file + ".snapshot"))
+		parse_NCBI_ids.annotate_tables("sim_low", state["truth"], state["submission"], resolver)
+
+	def output(state):
+		compare_results.score_submission("sim_low", state["unique_truth"], state["unique_submission"])
+		calculate_BC.compare_tables("sim_low", state["truth"], state["submission"])
+
+	def exact(state):
+		compare_results.score_submission("sim_low", state["unique_truth"], state["unique_submission"], exact_mode=True)
+
+	return [("parse", parse), ("sweep", sweep), ("metrics", metrics), ("braycurtis", bray_curtis), ("annotate", annotate), ("output", output),
+		("exact", exact)]
+
+def strains2_stages(truth_file, submission_file):
+	import strains2_evaluator
+
+	def parse(state):
+		state["truth"] = strains2_evaluator.read_answer_key(truth_file)[0]
+		state["submission"] = strains2_evaluator.read_submission(submission_file, state["truth"])
+
+	def metrics(state):
+		strains2_evaluator.compute_metrics(strains2_evaluator.get_stats(state["truth"], state["submission"]))
+		strains2_evaluator.adjusted_rand(state["truth"], state["submission"])
+
+	def sweep(state):
+		strains2_evaluator.score_submission(state["truth"], state["submission"])
+
+	return [("parse", parse), ("metrics", metrics), ("sweep", sweep)]
+
+STAGES = {"profiling": profiling_stages, "strains2": strains2_stages}
+
+def run_stages(evaluator, data_dir):
+	# runs in its own process: every stage in order, inside data_dir, with the evaluators' printed
+	# output thrown away. Returns {stage: {"seconds": ..., "peak_rss_mb": ...}}.
+	truth_file = os.path.join(data_dir, "truth.tsv")
+	submission_file = os.path.join(data_dir, "submission.tsv")
+	os.environ.pop("MOSAIC_TABLE_CACHE", None)			# every run parses the files itself
+	stage_timer.enable(False)							# the harness does its own timing
+	os.chdir(data_dir)
+	stdout = sys.stdout
+	sys.stdout = codecs.open(os.devnull, "w", "utf-8")
+	results = {}
+	state = {}
+	try:
+		for stage, function in STAGES[evaluator](truth_file, submission_file):
+			started = time.time()
+			function(state)
+			results[stage] = {"seconds": time.time() - started, "peak_rss_mb": stage_timer.peak_rss_mb()}
+	finally:
+		sys.stdout.close()
+		sys.stdout = stdout
+	return results
+
+def benchmark(evaluator, rows, repeats):
+	# {stage: best result} for one evaluator and size, over repeated runs on the same data
+	data_dir = tempfile.mkdtemp(prefix="benchmark_")
+	try:
+		synthetic_data.write_tables(evaluator, rows, os.path.join(data_dir, "truth.tsv"), os.path.join(data_dir, "submission.tsv"))
+		best = {}
+		for repeat in range(repeats):
+			output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "run", evaluator, data_dir])
+			for stage, result in json.loads(output).items():
+				if stage not in best:
+					best[stage] = result
+				else:
+					best[stage] = {"seconds": min(best[stage]["seconds"], result["seconds"]),
+						"peak_rss_mb": max(best[stage]["peak_rss_mb"], result["peak_rss_mb"])}
+		return best
+	finally:
+		shutil.rmtree(data_dir)
+
+def run_benchmarks(sizes, repeats):
+	# {"evaluator/rows/stage": result}, for every evaluator and size
+	results = {}
+	for evaluator in EVALUATORS:
+		for rows in sizes:
+			print "Benchmarking %s with %d rows" % (evaluator, rows)
+			sys.stdout.flush()
+			for stage, result in benchmark(evaluator, rows, repeats).items():
+				results["%s/%d/%s" % (evaluator, rows, stage)] = result
+	return results
+
+def stage_order(key):
+	# evaluator, then size, then the order the stages run in
+	evaluator, rows, stage = key.split("/")
+	names = [name for name, function in STAGES[evaluator](None, None)]
+	return EVALUATORS.index(evaluator), int(rows), names.index(stage) if stage in names else len(names)
+
+def compare(results, baseline, tolerance):
+	# prints every stage against its baseline; returns the keys of the ones that regressed
+	regressions = []
+	print "stage\tseconds\tbaseline\tpeak_rss_mb\tbaseline"
+	for key in sorted(results, key=stage_order):
+		now = results[key]
+		if key not in baseline:
+			print "%s\t%.4f\t-\t%.1f\t-" % (key, now["seconds"], now["peak_rss_mb"])
+			continue
+		then = baseline[key]
+		slower = then["seconds"] >= MIN_SECONDS and now["seconds"] > tolerance * then["seconds"]
+		bigger = now["peak_rss_mb"] > tolerance * then["peak_rss_mb"]
+		flag = "\tREGRESSION" if slower or bigger else ""
+		print "%s\t%.4f\t%.4f\t%.1f\t%.1f%s" % (key, now["seconds"], then["seconds"], now["peak_rss_mb"], then["peak_rss_mb"], flag)
+		if flag:
+			regressions.append(key)
+	return regressions
+
+if __name__ == "__main__":
+	if len(sys.argv) == 4 and sys.argv[1] == "run":
+		# internal: one evaluator on one data directory, results as JSON on stdout
+		print json.dumps(run_stages(sys.argv[2], sys.argv[3]))
+		sys.exit()
+	if len(sys.argv) < 3 or sys.argv[1] not in ["save", "compare"]:
+		sys.exit("usage: benchmark.py save|compare baseline_file [rows ...]")
+	mode = sys.argv[1]
+	baseline_file = sys.argv[2]
+	sizes = [int(float(rows)) for rows in sys.argv[3:]] or DEFAULT_ROWS
+	repeats = int(os.environ.get("MOSAIC_BENCH_REPEATS", 3))
+	tolerance = float(os.environ.get("MOSAIC_BENCH_TOLERANCE", 1.5))
+
+	if mode == "compare":
+		with open(baseline_file, 'r') as infile:
+			baseline = json.load(infile)["stages"]
+	results = run_benchmarks(sizes, repeats)
+
+	if mode == "save":
+		with open(baseline_file, 'w') as outfile:
+			json.dump({"python": sys.version.split()[0], "numpy": np.__version__, "repeats": repeats, "stages": results}, outfile, indent=1, sort_keys=True)
+		compare(results, {}, tolerance)
+		print "Baseline written to %s" % baseline_file
+	else:
+		regressions = compare(results, baseline, tolerance)
+		if regressions:
+			sys.exit("%d stages regressed beyond %.2f times their baseline: %s" % (len(regressions), tolerance, ", ".join(regressions)))
+		print "No regressions against %s" % baseline_file
@@ -0,0 +1,129 @@
+# bootstrap.py
+# Bootstrap confidence intervals for the evaluators' scores. A score is computed from units (the
+# strains, species or genera called or missed, the taxa in a Bray-Curtis profile, the strains2
+# rows), and each replicate is the same score over a resample of those units. Resamples are drawn
+# as one weight matrix, replicates x units (how many times each unit was drawn), so a replicate's
+# confusion counts, precision-recall curve, contingency table or profile sums are all matrix
+# operations over its row of weights.
+#
+# Every score here is built from weighted sums over the units, so units that contribute exactly
+# the same (say, two true positive strains above the same cutoffs) are interchangeable. collapse
+# groups them into categories, and the weights are drawn per category instead: a resample of n
+# units from categories of sizes m is multinomial(n, m / n) over the categories, the same
+# distribution at a fraction of the draws.
+#
+# Replicates are run a chunk at a time, each chunk small enough that its weight matrix (and the
+# per-entry copy of it) stays within BLOCK_BYTES. Each chunk gets its own seed, so the results are
+# the same however the chunks are spread over processes. With MOSAIC_PROCESSES above 1, chunks go
+# to a pool of that many worker processes.
+#
+# The scripts turn the bootstrap on with --bootstrap=N on the command line (or MOSAIC_BOOTSTRAP=N),
+# and write the estimate with its 95% percentile interval next to their scores.
+
+# imports
+import sys, os, warnings, multiprocessing
+import numpy as np
+
+BLOCK_BYTES = 64 * 1024 * 1024
+CI_LEVEL = 0.95
+
+def replicates_from_argv():
+	# takes --bootstrap=N out of sys.argv (so positional arguments stay where the scripts expect
+	# them); returns N, or MOSAIC_BOOTSTRAP, or 0 for no bootstrap
+	replicates = int(os.environ.get("MOSAIC_BOOTSTRAP", 0))
+	for arg in list(sys.argv):
+		if arg.startswith("--bootstrap="):
+			sys.argv.remove(arg)
+			replicates = int(arg.split("=", 1)[1])
+	return replicates
+
+def collapse(keys):
+	# keys is a (units, columns) integer matrix describing what each unit contributes; returns
+	# (first, inverse, counts): one unit standing for each category, the category of every unit,
+	# and the number of units in each category
+	keys = np.asarray(keys, dtype=np.int64).reshape(len(keys), -1)
+	if len(keys) == 0:
+		return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+	categories, first, inverse, counts = np.unique(keys, axis=0, return_index=True, return_inverse=True, return_counts=True)
+	return first, inverse, counts
+
+def draws_units(counts):
+	# with categories about as many as the units, drawing the units themselves and counting them up
+	# is faster than a multinomial over the categories
+	return len(counts) * 4 > counts.sum()
+
+def resample_weights(counts, replicates, random):
+	# (replicates, categories): how many of each category's units were drawn, in resamples of as
+	# many units as there are
+	units = counts.sum()
+	if units == 0:
+		return np.zeros((replicates, len(counts)))
+	if draws_units(counts):
+		drawn = np.repeat(np.arange(len(counts)), counts)[random.randint(0, units, size=(replicates, units))]
+		drawn += np.arange(replicates)[:, None] * len(counts)
+		return np.bincount(drawn.ravel(), minlength=replicates * len(counts)).reshape(replicates, len(counts)).astype(float)
+	return random.multinomial(units, counts / float(units), size=replicates).astype(float)
+
+def bin_sums(weights, columns, bins, size):
+	# (replicates, size): for each replicate, the weight of every entry in each bin, where entry i
+	# takes its weight from column columns[i] and falls in bin bins[i]
+	sums = np.zeros((len(weights), size))
+	if len(bins) == 0:
+		return sums
+	if weights.shape[1] * size * 8 <= BLOCK_BYTES:
+		# small enough to count every column's entries per bin once, and multiply
+		table = np.bincount(columns * size + bins, minlength=weights.shape[1] * size).reshape(weights.shape[1], size)
+		return np.dot(weights, table)
+	order = np.argsort(bins, kind='mergesort')
+	sorted_bins = bins[order]
+	starts = np.flatnonzero(np.concatenate(([True], sorted_bins[1:] != sorted_bins[:-1])))
+	sums[:, sorted_bins[starts]] = np.add.reduceat(weights[:, columns[order]], starts, axis=1)
+	return sums
+
+def count_above(weights, columns, bins, size):
+	# (replicates, size - 1): for each cutoff k, the weight of the entries above it, where bins[i]
+	# is the number of cutoffs entry i is above
+	sums = bin_sums(weights, columns, bins, size)
+	return sums[:, ::-1].cumsum(axis=1)[:, ::-1][:, 1:]
+
+# the problem each worker runs chunks of: (statistic, category counts, data)
+worker_problem = []
+
+def set_problem(statistic, counts, data):
+	worker_problem[:] = [statistic, counts, data]
+
+def run_chunk(task):
+	# one chunk of replicates: (seed, chunk index, replicates) -> statistic rows
+	seed, index, replicates = task
+	statistic, counts, data = worker_problem
+	random = np.random.RandomState([seed, index])
+	return statistic(resample_weights(counts, replicates, random), *data)
+
+def replicate(statistic, counts, data, replicates, entries=0, seed=0, processes=None):
+	# (replicates, ...) stacked results of statistic(weights, *data) for every replicate, where
+	# counts are the sizes of the categories (see collapse) and weights is (replicates, categories).
+	# entries is the largest number of columns the statistic works on per replicate, for sizing chunks.
+	if processes is None:
+		processes = int(os.environ.get("MOSAIC_PROCESSES", 1))
+	counts = np.asarray(counts)
+	columns = max(len(counts), entries, counts.sum() if draws_units(counts) else 0, 1)
+	chunk = max(1, BLOCK_BYTES // (8 * columns))
+	tasks = [(seed, index, min(chunk, replicates - start)) for index, start in enumerate(range(0, replicates, chunk))]
+	set_problem(statistic, counts, data)
+	# (pool workers, e.g. leaderboard.py's, can't start pools of their own)
+	if processes > 1 and len(tasks) > 1 and not multiprocessing.current_process().daemon:
+		pool = multiprocessing.Pool(min(processes, len(tasks)), initializer=set_problem, initargs=(statistic, counts, data))
+		results = pool.map(run_chunk, tasks)
+		pool.close()
+		pool.join()
+	else:
+		results = [run_chunk(task) for task in tasks]
+	return np.concatenate(results)
+
+def interval(samples, level=CI_LEVEL):
+	# percentile interval over the replicates (the first axis); replicates where a score is not
+	# defined (NaN) are left out
+	tail = 100 * (1 - level) / 2
+	with warnings.catch_warnings():
+		warnings.simplefilter("ignore", RuntimeWarning)
+		return np.nanpercentile(samples, [tail, 100 - tail], axis=0)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# evaluation_server.py
+# usage: evaluation_server.py port dataset=truth_file [dataset=truth_file ...]
+# A long-running evaluator for busy submission periods. The truth tables (and the NCBI taxonomy)
+# are loaded once at startup, and each submission is then scored in-process, instead of starting
+# compare_results.py, calculate_BC.py, parse_NCBI_ids.py or strains2_evaluator.py from scratch.
+# Datasets are the profiling dataset names (sim_low, sim_medium, sim_high, bio, ...), plus
+# "strains2" for the Strains #2 truth file.
+#
+# The server listens on 127.0.0.1:port. POST a JSON request to /<tool>, where tool is one of
+# compare_results, calculate_BC, parse_NCBI_ids or strains2:
+#	{"dataset": "sim_low", "submission": "/path/to/submission.tsv", "output_dir": "/path/to/outputs", "exact": false}
+# ("exact" is only used by compare_results, and strains2 needs no dataset). The files the script
+# would have written go to output_dir, and the reply lists them:
+#	{"outputs": ["/path/to/outputs/profiling_sim_low_scores.tsv", ...], "seconds": 0.01}
+# A submission the script would have rejected gets a 400 reply with {"error": "..."}.
+# GET /status lists the loaded datasets.
+# e.g. curl -d '{"dataset": "sim_low", "submission": "sub.tsv", "output_dir": "out"}' localhost:8800/compare_results
+#
+# With --profile (or MOSAIC_PROFILE=1), each reply also lists a .profile.json file of per-stage
+# timings, written next to the scores.
+# With --format=parquet or --format=arrow (or MOSAIC_RESULT_FORMAT), the replies also list a copy of
+# every scores and PRC file in that format (see result_writer.py).
+#
+# Relative paths are taken from the directory the server was started in. Requests are handled
+# one at a time, each one inside its output directory, as the scripts themselves run.
+
+# imports
+import sys, os, json, time, traceback
+import BaseHTTPServer
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, os.pardir, "strains1", "evaluation_assets", "profiling"))
+sys.path.insert(0, os.path.join(here, os.pardir, "strains2", "evaluation_assets"))
+import lineage, compare_results, calculate_BC, parse_NCBI_ids, strains2_evaluator, stage_timer, result_writer
+
+class Evaluator(object):
+	def __init__(self, truth_files):
+		self.truth = {}					# dataset -> truth table (a LineageTable, or the strains2 matrix)
+		self.unique_truth = {}			# profiling truth tables with repeated lineages dropped, for compare_results
+		for dataset, truth_file in sorted(truth_files.items()):
+			print "Loading %s truth file %s" % (dataset, truth_file)
+			if dataset == "strains2":
+				self.truth[dataset] = strains2_evaluator.read_answer_key(truth_file)[0]
+			else:
+				self.truth[dataset] = lineage.read_lineage_table(truth_file)
+				self.unique_truth[dataset] = lineage.drop_duplicate_rows(self.truth[dataset])
+		self.resolver = None
+		if any(dataset in parse_NCBI_ids.dsets for dataset in self.truth):
+			try:
+				self.resolver = parse_NCBI_ids.open_resolver()
+			except ImportError:
+				print "Warning: no ete3 and no NCBI_TAXONOMY_SNAPSHOT, parse_NCBI_ids is not available."
+		self.tools = {"compare_results": self.compare_results, "calculate_BC": self.calculate_BC,
+			"parse_NCBI_ids": self.parse_NCBI_ids, "strains2": self.strains2}
+
+	def profiling_truth(self, dataset):
+		if dataset not in self.unique_truth:
+			raise ValueError('no profiling truth file loaded for dataset "%s"' % dataset)
+		return self.truth[dataset]
+
+	def compare_results(self, request, submission_file):
+		dataset = request.get("dataset")
+		self.profiling_truth(dataset)
+		submission_tab = compare_results.read_submission(submission_file)
+		return lambda: compare_results.score_submission(dataset, self.unique_truth[dataset], submission_tab, bool(request.get("exact")))
+
+	def calculate_BC(self, request, submission_file):
+		dataset = request.get("dataset")
+		truth_tab = self.profiling_truth(dataset)
+		submission_tab = lineage.read_lineage_table(submission_file)
+		return lambda: calculate_BC.compare_tables(dataset, truth_tab, submission_tab)
+
+	def parse_NCBI_ids(self, request, submission_file):
+		dataset = request.get("dataset")
+		truth_tab = self.profiling_truth(dataset)
+		if dataset not in parse_NCBI_ids.dsets:
+			raise ValueError('Dataset name "%s" is not valid' % dataset)
+		if self.resolver is None:
+			raise ValueError("the taxonomy is not loaded")
+		submission_tab = lineage.read_lineage_table(submission_file)
+		return lambda: parse_NCBI_ids.annotate_tables(dataset, truth_tab, submission_tab, self.resolver)
+
+	def strains2(self, request, submission_file):
+		if "strains2" not in self.truth:
+			raise ValueError("no strains2 truth file loaded")
+		truth_matrix = self.truth["strains2"]
+		submission_matrix = strains2_evaluator.read_submission(submission_file, truth_matrix)
+		return lambda: strains2_evaluator.score_submission(truth_matrix, submission_matrix)
+
+	def run(self, tool, request):
+		# reads and checks the submission, then writes the tool's outputs into the output directory
+		if tool not in self.tools:
+			raise ValueError('unknown tool "%s"' % tool)
+		if "submission" not in request:
+			raise ValueError("no submission file given")
+		output_dir = os.path.abspath(request.get("output_dir", "."))
+		stage_timer.reset()
+		result_writer.submission = os.path.basename(request["submission"])
+		with stage_timer.stage("parse"):
+			score = self.tools[tool](request, os.path.abspath(request["submission"]))
+		if not os.path.isdir(output_dir):
+			os.makedirs(output_dir)
+		cwd = os.getcwd()
+		os.chdir(output_dir)
+		try:
+			outputs = score()
+		finally:
+			os.chdir(cwd)
+		return [os.path.join(output_dir, output) for output in outputs]
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+	def reply(self, code, body):
+		body = json.dumps(body)
+		self.send_response(code)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_GET(self):
+		if self.path.rstrip("/") != "/status":
+			return self.reply(404, {"error": "unknown path %s" % self.path})
+		evaluator = self.server.evaluator
+		self.reply(200, {"datasets": sorted(evaluator.truth), "tools": sorted(evaluator.tools), "taxonomy": evaluator.resolver is not None})
+
+	def do_POST(self):
+		started = time.time()
+		try:
+			request = json.loads(self.rfile.read(int(self.headers.getheader("Content-Length", 0))))
+			outputs = self.server.evaluator.run(self.path.strip("/"), request)
+		except SystemExit as error:
+			# the scripts' own sanity checks exit with a message
+			return self.reply(400, {"error": str(error.code)})
+		except (ValueError, KeyError, IOError, OSError) as error:
+			return self.reply(400, {"error": str(error)})
+		except Exception as error:
+			traceback.print_exc()
+			return self.reply(500, {"error": repr(error)})
+		self.reply(200, {"outputs": outputs, "seconds": time.time() - started})
+
+if __name__ == "__main__":
+	stage_timer.enable_from_argv()
+	result_writer.format_from_argv()
+	if len(sys.argv) < 3 or any("=" not in arg for arg in sys.argv[2:]):
+		sys.exit("usage: evaluation_server.py port dataset=truth_file [dataset=truth_file ...]")
+	port = int(sys.argv[1])
+	server = BaseHTTPServer.HTTPServer(("127.0.0.1", port), Handler)
+	server.evaluator = Evaluator(dict(arg.split("=", 1) for arg in sys.argv[2:]))
+	print "Serving on 127.0.0.1:%d" % port
+	sys.stdout.flush()
+	server.serve_forever()
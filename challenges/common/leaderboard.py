@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# leaderboard.py
+# usage: leaderboard.py submissions_dir output_dir dataset=truth_file [dataset=truth_file ...]
+# Rescores a whole leaderboard in one go, e.g. after a truth file has been corrected. Submissions
+# are found under submissions_dir/<dataset>/, one file per submission, and every dataset needs its
+# truth file on the command line ("strains2" for Strains #2; any other name is a profiling dataset).
+# Profiling submissions go through compare_results.py and calculate_BC.py, Strains #2 ones through
+# strains2_evaluator.py, and each script's usual outputs land in output_dir/<dataset>/<submission>/.
+# All the scores are merged into output_dir/leaderboard_scores.tsv, one value per line:
+#	dataset, submission, tax_ranking, sample ("all" unless the score is per sample), metric, value
+# (tax_ranking is "all" for the UniFrac distances, which span every rank)
+# and any submission a script rejected is listed in output_dir/leaderboard_errors.tsv.
+# With --profile (or MOSAIC_PROFILE=1), each script's per-stage timings are written next to its scores.
+# With --bootstrap=N (or MOSAIC_BOOTSTRAP=N), every score the scripts can bootstrap also gets
+# <metric>_lower and <metric>_upper lines, its 95% interval from N resamples, to tell near-ties apart.
+# With --format=parquet or --format=arrow (or MOSAIC_RESULT_FORMAT), every scores and PRC file, and
+# the merged table, is also written in that format, so a whole board reads as one columnar scan
+# (see result_writer.py).
+#
+# Submissions are spread over a pool of worker processes, one per CPU unless MOSAIC_PROCESSES says
+# otherwise. The truth tables are parsed once, written out as array files (in /dev/shm where there
+# is one) and memory-mapped by every worker, so all the workers share one copy of them instead of
+# each being sent its own.
+
+# imports
+import sys, os, codecs, shutil, tempfile, multiprocessing
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, os.pardir, "strains1", "evaluation_assets", "profiling"))
+sys.path.insert(0, os.path.join(here, os.pardir, "strains2", "evaluation_assets"))
+import table_loader, lineage, compare_results, calculate_BC, strains2_evaluator, stage_timer, bootstrap, result_writer
+
+def share_truth(truth_files, shared_dir):
+	# parses each truth file once, and writes its arrays out for the workers to map
+	shared = {}
+	for dataset, truth_file in sorted(truth_files.items()):
+		print "Loading %s truth file %s" % (dataset, truth_file)
+		if dataset == "strains2":
+			arrays = [("values", strains2_evaluator.read_answer_key(truth_file)[0])]
+		else:
+			truth_tab = lineage.read_lineage_table(truth_file)
+			unique_tab = lineage.drop_duplicate_rows(truth_tab)
+			arrays = [("taxids", truth_tab.taxids), ("values", truth_tab.abundances), ("depths", truth_tab.depths),
+				("unique_taxids", unique_tab.taxids), ("unique_values", unique_tab.abundances), ("unique_depths", unique_tab.depths)]
+		shared[dataset] = os.path.join(shared_dir, dataset + table_loader.CACHE_SUFFIX)
+		table_loader.write_arrays(shared[dataset], table_loader.CACHE_MAGIC, arrays, {"source": os.path.basename(truth_file)})
+	return shared
+
+# the truth tables in each worker, mapped from the shared files by open_truth
+worker_truth = {}
+
+def open_truth(shared):
+	for dataset, shared_file in shared.items():
+		arrays = table_loader.map_arrays(shared_file, table_loader.CACHE_MAGIC)[1]
+		if dataset == "strains2":
+			worker_truth[dataset] = arrays["values"]
+		else:
+			worker_truth[dataset] = (lineage.LineageTable(arrays["taxids"], arrays["values"], arrays["depths"]),
+				lineage.LineageTable(arrays["unique_taxids"], arrays["unique_values"], arrays["unique_depths"]))
+
+def read_rows(file):
+	# a scores file as one dict per line, keyed by its header
+	with open(file, 'r') as infile:
+		lines = [line.rstrip("\n").split("\t") for line in infile if line.strip()]
+	return [dict(zip(lines[0], line)) for line in lines[1:]]
+
+# bootstrap replicates per submission (0 for none), set from the command line
+replicates = 0
+
+def interval_rows(ci_file, metric_column=None):
+	# the _lower and _upper lines for every score in a bootstrap file
+	rows = []
+	for row in read_rows(ci_file):
+		metric = row["metric"] if metric_column is None else metric_column
+		for bound in ["lower", "upper"]:
+			rows.append((row["tax_ranking"] if "tax_ranking" in row else "strain", row.get("sample", "all"), metric + "_" + bound, row[bound]))
+	return rows
+
+def profiling_scores(dataset, submission_file):
+	truth_tab, unique_tab = worker_truth[dataset]
+	# parsed once: calculate_BC scores the table as written, compare_results without repeated lineages
+	full_submission_tab = compare_results.read_submission(submission_file, drop_duplicates=False)
+	submission_tab = lineage.drop_duplicate_rows(full_submission_tab)
+	outputs = compare_results.score_submission(dataset, unique_tab, submission_tab)
+	rows = []
+	for row in read_rows(outputs[3]):
+		for metric in ["TP", "FN", "FP", "Precision", "Recall", "F1", "improved_F1", "cutoff", "AUC"]:
+			rows.append((row["tax_ranking"], "all", metric, row[metric]))
+	# and each sample's own
+	for row in read_rows(outputs[5]):
+		for metric in ["TP", "FN", "FP", "Precision", "Recall", "F1", "improved_F1", "cutoff", "AUC"]:
+			rows.append((row["tax_ranking"], row["sample"], metric, row[metric]))
+	if replicates:
+		rows.extend(interval_rows(compare_results.bootstrap_scores(dataset, unique_tab, submission_tab, replicates)[0]))
+	braycurtis_file, unifrac_file = calculate_BC.compare_tables(dataset, truth_tab, full_submission_tab)[:2]
+	for row in read_rows(braycurtis_file):
+		rows.append((row["tax_ranking"], row["sample"], "braycurtis", row["braycurtis"]))
+	for row in read_rows(unifrac_file):
+		for metric in ["weighted_unifrac", "unweighted_unifrac"]:
+			rows.append(("all", row["sample"], metric, row[metric]))
+	if replicates:
+		rows.extend(interval_rows(calculate_BC.bootstrap_tables(dataset, truth_tab, full_submission_tab, replicates)[0], "braycurtis"))
+	return rows
+
+def strains2_scores(dataset, submission_file):
+	truth_matrix = worker_truth[dataset]
+	submission_matrix = strains2_evaluator.read_submission(submission_file, truth_matrix)
+	scores_file = strains2_evaluator.score_submission(truth_matrix, submission_matrix)[0]
+	row = read_rows(scores_file)[0]
+	rows = [("strain", "all", metric, row[metric]) for metric in ["TP", "FP", "TN", "FN", "Accuracy", "Precision",
+		"Recall", "F1", "misclassification_rate", "adjusted_rand_index"]]
+	if replicates:
+		rows.extend(interval_rows(strains2_evaluator.bootstrap_scores(truth_matrix, submission_matrix, replicates)[0]))
+	return rows
+
+def score(task):
+	# runs in a worker: scores one submission inside its own output directory, with the scripts'
+	# printed output going to stdout.txt there. Returns (dataset, submission, rows, error).
+	dataset, submission_file, submission_dir = task
+	submission = os.path.basename(submission_file)
+	cwd = os.getcwd()
+	stdout = sys.stdout
+	try:
+		if not os.path.isdir(submission_dir):
+			os.makedirs(submission_dir)
+		os.chdir(submission_dir)
+		sys.stdout = codecs.open("stdout.txt", "w", "utf-8")
+		stage_timer.reset()
+		result_writer.submission = submission
+		if dataset == "strains2":
+			rows = strains2_scores(dataset, submission_file)
+		else:
+			rows = profiling_scores(dataset, submission_file)
+		return dataset, submission, rows, None
+	except SystemExit as error:
+		# the scripts' own sanity checks exit with a message
+		return dataset, submission, [], str(error.code)
+	except Exception as error:
+		return dataset, submission, [], "%s: %s" % (type(error).__name__, error)
+	finally:
+		if sys.stdout is not stdout:
+			sys.stdout.close()
+			sys.stdout = stdout
+		os.chdir(cwd)
+
+def find_submissions(submissions_dir, output_dir, datasets):
+	tasks = []
+	for dataset in sorted(datasets):
+		dataset_dir = os.path.join(submissions_dir, dataset)
+		if not os.path.isdir(dataset_dir):
+			print "Warning: no submissions directory for %s." % dataset
+			continue
+		for name in sorted(os.listdir(dataset_dir)):
+			if os.path.isfile(os.path.join(dataset_dir, name)):
+				tasks.append((dataset, os.path.abspath(os.path.join(dataset_dir, name)), os.path.abspath(os.path.join(output_dir, dataset, name))))
+	return tasks
+
+if __name__ == "__main__":
+	stage_timer.enable_from_argv()
+	replicates = bootstrap.replicates_from_argv()
+	result_writer.format_from_argv()
+	if len(sys.argv) < 4 or any("=" not in arg for arg in sys.argv[3:]):
+		sys.exit("usage: leaderboard.py submissions_dir output_dir dataset=truth_file [dataset=truth_file ...]")
+	submissions_dir = sys.argv[1]
+	output_dir = sys.argv[2]
+	truth_files = dict(arg.split("=", 1) for arg in sys.argv[3:])
+	processes = int(os.environ.get("MOSAIC_PROCESSES", multiprocessing.cpu_count()))
+
+	tasks = find_submissions(submissions_dir, output_dir, truth_files)
+	shared_dir = tempfile.mkdtemp(prefix="leaderboard_", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+	try:
+		shared = share_truth(truth_files, shared_dir)
+		pool = multiprocessing.Pool(processes, initializer=open_truth, initargs=(shared,))
+		results = sorted(pool.imap_unordered(score, tasks))
+		pool.close()
+		pool.join()
+	finally:
+		shutil.rmtree(shared_dir)
+
+	# one merged table for the whole board, and one for whatever was rejected
+	if not os.path.isdir(output_dir):
+		os.makedirs(output_dir)
+	scores_table = result_writer.ResultTable(os.path.join(output_dir, "leaderboard_scores.tsv"), ["dataset", "submission", "tax_ranking", "sample", "metric", "value"],
+		keys={"dataset": "dataset", "submission": "submission", "rank": "tax_ranking", "sample": "sample", "metric": "metric", "value": "value"})
+	errors_outfile = open(os.path.join(output_dir, "leaderboard_errors.tsv"), "w")
+	errors_outfile.write("dataset\tsubmission\terror\n")
+	rejected = 0
+	for dataset, submission, rows, error in results:
+		if error is not None:
+			errors_outfile.write("%s\t%s\t%s\n" % (dataset, submission, error.replace("\t", " ").replace("\n", " ")))
+			rejected += 1
+		if rows:
+			scores_table.add_columns([dataset] * len(rows), [submission] * len(rows), *zip(*rows))
+	scores_table.write()
+	errors_outfile.close()
+	print "Scored %d submissions (%d rejected) with %d processes." % (len(results), rejected, processes)
@@ -0,0 +1,132 @@
+# metric_kernels.py
+# The scoring metrics the evaluators need, in plain NumPy, so that none of them has to import
+# sklearn or scipy (which take longer to import than a typical submission takes to score):
+#	auc					trapezoidal area under a curve, as sklearn.metrics.auc
+#	average_precision	step-wise area under a precision-recall curve
+#	adjusted_rand_score	as sklearn.metrics.adjusted_rand_score, also straight from a contingency table,
+#						or from a stack of (weighted) contingency tables at once
+# (Bray-Curtis and Jaccard are computed for every rank at once in braycurtis.py.)
+#
+# sklearn is only imported for cross-checking: test_metric_kernels.py compares every kernel (and
+# braycurtis.py's scores, against scipy) on random and edge-case inputs, and with
+# MOSAIC_METRICS_CHECK=1 set every call made by the evaluators is checked as it happens (raising
+# AssertionError on a mismatch). A contingency table is checked by scoring a labelling that has it;
+# of a stack of them, CHECKED_TABLES picked at random are.
+
+from __future__ import division
+
+# imports
+import sys, os
+import numpy as np
+
+CHECKED_TABLES = 5
+
+def cross_check(name, result, *args):
+	# with MOSAIC_METRICS_CHECK set, compares a result with the sklearn/scipy function it replaces
+	if os.environ.get("MOSAIC_METRICS_CHECK"):
+		expected = REFERENCES[name]()(*args)
+		if not np.allclose(result, expected, rtol=1e-9, atol=1e-12, equal_nan=True):
+			raise AssertionError("%s gave %r, the reference gives %r" % (name, result, expected))
+	return result
+
+def auc(x, y):
+	# x has to be monotonic, in either direction
+	x = np.asarray(x, dtype=float).ravel()
+	y = np.asarray(y, dtype=float).ravel()
+	if len(x) < 2:
+		raise ValueError("At least 2 points are needed to compute area under curve, but x.shape = %d" % len(x))
+	direction = 1
+	dx = np.diff(x)
+	if np.any(dx < 0):
+		if np.all(dx <= 0):
+			direction = -1
+		else:
+			raise ValueError("x is neither increasing nor decreasing : %s." % x)
+	return cross_check("auc", direction * np.trapz(y, x), x, y)
+
+def average_precision(precision, recall):
+	# step-wise area under the PR curve: each gain in recall is weighted by the precision at that point.
+	# points come in order of increasing cutoff, so recall only goes down; walk them the other way.
+	precision = np.asarray(precision, dtype=float)[::-1]
+	recall = np.asarray(recall, dtype=float)[::-1]
+	return float(np.sum(np.diff(np.concatenate(([0.0], recall))) * precision))
+
+def contingency_table(labels_true, labels_pred):
+	# counts of every (true label, predicted label) pair: (true labels, predicted labels)
+	true_labels, true_index = np.unique(labels_true, return_inverse=True)
+	pred_labels, pred_index = np.unique(labels_pred, return_inverse=True)
+	table = np.bincount(true_index * len(pred_labels) + pred_index, minlength=len(true_labels) * len(pred_labels))
+	return table.reshape(len(true_labels), len(pred_labels))
+
+def comb2(n):
+	return n * (n - 1) // 2
+
+def adjusted_rand_from_contingency(contingency):
+	# the same arithmetic as sklearn's adjusted_rand_score, in exact integers up to the last divisions
+	contingency = np.asarray(contingency).tolist()
+	n_samples = sum(sum(row) for row in contingency)
+	class_sizes = [sum(row) for row in contingency]
+	cluster_sizes = [sum(column) for column in zip(*contingency)]
+	n_classes = len([size for size in class_sizes if size])
+	n_clusters = len([size for size in cluster_sizes if size])
+	# no clustering, or every entry on its own: these are perfect matches
+	if (n_classes == n_clusters == 1 or n_classes == n_clusters == 0 or n_classes == n_clusters == n_samples):
+		return cross_check("adjusted_rand_from_contingency", 1.0, contingency)
+	sum_comb_c = sum(comb2(size) for size in class_sizes)
+	sum_comb_k = sum(comb2(size) for size in cluster_sizes)
+	sum_comb = sum(comb2(count) for row in contingency for count in row)
+	prod_comb = (sum_comb_c * sum_comb_k) / comb2(n_samples)
+	mean_comb = (sum_comb_k + sum_comb_c) / 2.
+	return cross_check("adjusted_rand_from_contingency", (sum_comb - prod_comb) / (mean_comb - prod_comb), contingency)
+
+def adjusted_rand_from_contingencies(contingencies):
+	# adjusted_rand_from_contingency over a (tables, classes, clusters) stack, in floats, so the
+	# counts can be bootstrap weights
+	contingencies = np.asarray(contingencies, dtype=float)
+	n_samples = contingencies.sum(axis=(1, 2))
+	class_sizes = contingencies.sum(axis=2)
+	cluster_sizes = contingencies.sum(axis=1)
+	n_classes = np.count_nonzero(class_sizes, axis=1)
+	n_clusters = np.count_nonzero(cluster_sizes, axis=1)
+	perfect = (n_classes == n_clusters) & ((n_classes <= 1) | (n_classes == n_samples))
+	sum_comb_c = (class_sizes * (class_sizes - 1) / 2).sum(axis=1)
+	sum_comb_k = (cluster_sizes * (cluster_sizes - 1) / 2).sum(axis=1)
+	sum_comb = (contingencies * (contingencies - 1) / 2).sum(axis=(1, 2))
+	with np.errstate(divide='ignore', invalid='ignore'):
+		prod_comb = (sum_comb_c * sum_comb_k) / (n_samples * (n_samples - 1) / 2)
+		mean_comb = (sum_comb_k + sum_comb_c) / 2.
+		result = np.where(perfect, 1.0, (sum_comb - prod_comb) / (mean_comb - prod_comb))
+	if os.environ.get("MOSAIC_METRICS_CHECK") and len(contingencies):
+		# checking every bootstrap replicate would take far longer than scoring them, so a few are
+		random = np.random.RandomState(0)
+		for table in random.choice(len(contingencies), min(CHECKED_TABLES, len(contingencies)), replace=False):
+			if np.all(contingencies[table] == np.round(contingencies[table])):
+				cross_check("adjusted_rand_from_contingency", result[table], contingencies[table])
+	return result
+
+def adjusted_rand_score(labels_true, labels_pred):
+	labels_true = np.ravel(labels_true)
+	labels_pred = np.ravel(labels_pred)
+	return cross_check("adjusted_rand_score", adjusted_rand_from_contingency(contingency_table(labels_true, labels_pred)), labels_true, labels_pred)
+
+# the functions these replace, imported only when they are asked for
+def _sklearn_auc():
+	from sklearn.metrics import auc as reference
+	return reference
+
+def _sklearn_adjusted_rand_score():
+	from sklearn.metrics.cluster import adjusted_rand_score as reference
+	return reference
+
+def labelling(contingency):
+	# (true labels, predicted labels) of a labelling with the given contingency table
+	contingency = np.atleast_2d(contingency)
+	cells = np.repeat(np.arange(contingency.size), np.round(contingency).astype(np.int64).ravel())
+	return cells // contingency.shape[1], cells % contingency.shape[1]
+
+def _sklearn_adjusted_rand_from_contingency():
+	reference = _sklearn_adjusted_rand_score()
+	return lambda contingency: reference(*labelling(contingency))
+
+REFERENCES = {"auc": _sklearn_auc, "adjusted_rand_score": _sklearn_adjusted_rand_score,
+	"adjusted_rand_from_contingency": _sklearn_adjusted_rand_from_contingency}
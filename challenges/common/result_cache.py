@@ -0,0 +1,131 @@
+# result_cache.py
+# A cache of the files the evaluators write, so scoring the same submission against the same truth
+# file again costs a hash of the two files rather than a full run. Set MOSAIC_RESULT_CACHE to a
+# directory to turn it on; it is trimmed back to MOSAIC_RESULT_CACHE_MB (1024 by default) after each
+# write, least recently used entries first, along with any .latest pointers (below) left pointing at them.
+#
+# An entry is keyed by a hash of the evaluator's source code, its options (dataset, exact mode,
+# bootstrap replicates, ...) and the contents of the truth and submission files, so a change to any
+# of them is a miss. Entries are array files (see table_loader.py): the text of the output files
+# goes in the header, and an evaluator can keep arrays alongside it. The newest entry for each
+# submission file name is also remembered, so a resubmission under the same name can be scored
+# from the changes since the last one (compare_results.py keeps the submission's rows and its
+# per-cutoff counts for that). Binary outputs (the .parquet and .arrow copies result_writer.py can
+# write) are kept as byte arrays.
+
+# imports
+import os, json, hashlib
+import numpy as np
+import table_loader
+
+RESULT_MAGIC = b"MOSAICRS"
+RESULT_SUFFIX = ".result"
+LATEST_SUFFIX = ".latest"
+BINARY_SUFFIXES = (".parquet", ".arrow")
+RESULT_LIMIT_MB = 1024
+
+def source_hash(modules):
+	# of the source files of the given modules, standing in for the evaluator's version
+	digest = hashlib.sha1()
+	for module in modules:
+		source = os.path.splitext(module.__file__)[0] + ".py"
+		with open(source if os.path.exists(source) else module.__file__, 'rb') as infile:
+			digest.update(infile.read())
+	return digest.hexdigest()
+
+def hash_of(*parts):
+	return hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()
+
+class ResultCache(object):
+	def __init__(self, directory, evaluator, options, truth_file, submission_file, modules):
+		self.directory = directory
+		settings = [evaluator, source_hash(modules), options, table_loader.content_hash(truth_file, "input")]
+		self.key = hash_of(*(settings + [table_loader.content_hash(submission_file, "input")]))
+		self.name_key = hash_of(*(settings + [os.path.basename(submission_file)]))
+		self.submission = os.path.basename(submission_file)
+
+	def entry_file(self, key):
+		return os.path.join(self.directory, key + RESULT_SUFFIX)
+
+	def read_entry(self, key):
+		# (header, arrays) of an entry, or None if there isn't one (or it can't be read)
+		file = self.entry_file(key)
+		if not os.path.exists(file):
+			return None
+		try:
+			header, arrays = table_loader.map_arrays(file, RESULT_MAGIC)
+			os.utime(file, None)			# marks it as recently used
+			return header, arrays
+		except (IOError, OSError, ValueError):
+			return None
+
+	def restore(self):
+		# writes this submission's cached outputs to the working directory and returns their names,
+		# or returns None if they aren't cached
+		entry = self.read_entry(self.key)
+		if entry is None:
+			return None
+		header, arrays = entry
+		for name, text in header["outputs"]:
+			with open(name, 'w') as outfile:
+				outfile.write(text.encode('utf-8'))
+		for name, array in header.get("binary_outputs", []):
+			with open(name, 'wb') as outfile:
+				outfile.write(np.asarray(arrays[array]).tobytes())
+		return [str(name) for name, text in header["outputs"]] + [str(name) for name, array in header.get("binary_outputs", [])]
+
+	def previous(self):
+		# (header, arrays) of the newest entry for a submission of the same name, or None
+		try:
+			with open(os.path.join(self.directory, self.name_key + LATEST_SUFFIX), 'r') as infile:
+				return self.read_entry(infile.read().strip())
+		except IOError:
+			return None
+
+	def store(self, outputs, arrays=(), header=None):
+		# keeps the output files (timing reports aside) and any arrays under this submission's key
+		header = dict(header or {})
+		header["submission"] = self.submission
+		header["outputs"] = []
+		header["binary_outputs"] = []
+		arrays = list(arrays)
+		for name in outputs:
+			if name.endswith(BINARY_SUFFIXES):
+				with open(name, 'rb') as infile:
+					arrays.append(("output:" + name, np.frombuffer(infile.read(), dtype=np.uint8)))
+				header["binary_outputs"].append([name, "output:" + name])
+			elif not name.endswith(".profile.json"):
+				with open(name, 'r') as infile:
+					header["outputs"].append([name, infile.read().decode('utf-8')])
+		if not os.path.isdir(self.directory):
+			os.makedirs(self.directory)
+		# written next to the target and renamed over it, so readers never see a half-written file
+		file = self.entry_file(self.key)
+		temp_file = "%s.%d.tmp" % (file, os.getpid())
+		table_loader.write_arrays(temp_file, RESULT_MAGIC, arrays, header)
+		os.rename(temp_file, file)
+		latest_file = os.path.join(self.directory, self.name_key + LATEST_SUFFIX)
+		with open(latest_file + ".%d.tmp" % os.getpid(), 'w') as outfile:
+			outfile.write(self.key + "\n")
+		os.rename(latest_file + ".%d.tmp" % os.getpid(), latest_file)
+		table_loader.trim_cache(self.directory, float(os.environ.get("MOSAIC_RESULT_CACHE_MB", RESULT_LIMIT_MB)), RESULT_SUFFIX)
+		trim_latest(self.directory)
+
+def trim_latest(directory):
+	# drops the pointers to newest entries that have been trimmed (or are otherwise gone)
+	for name in os.listdir(directory):
+		if name.endswith(LATEST_SUFFIX):
+			try:
+				with open(os.path.join(directory, name), 'r') as infile:
+					key = infile.read().strip()
+				if not os.path.exists(os.path.join(directory, key + RESULT_SUFFIX)):
+					os.remove(os.path.join(directory, name))
+			except (IOError, OSError):
+				pass
+
+def open_cache(evaluator, options, truth_file, submission_file, modules):
+	# the cache for one run of an evaluator, or None if MOSAIC_RESULT_CACHE isn't set
+	directory = os.environ.get("MOSAIC_RESULT_CACHE")
+	if not directory:
+		return None
+	return ResultCache(directory, evaluator, options, truth_file, submission_file, modules)
@@ -0,0 +1,137 @@
+# result_writer.py
+# One way for the evaluators to write their result tables (the PRC and scores files, Bray-Curtis and
+# UniFrac, Strains #2's, the leaderboard's). A table is collected as columns, e.g.
+#	table = result_writer.ResultTable("profiling_sim_low_PRC_strain.tsv", ["cutoff", "TP", ...],
+#		keys={"cutoff": "cutoff"}, fixed={"dataset": "sim_low", "rank": "strain", "sample": "all"})
+#	table.add_row(0.001, 12, ...)			# or table.add_columns(cutoffs, TPs, ...) for many rows at once
+#	table.write()
+# and written out in one buffered write, as tab-separated text under a header line, every value
+# formatted with str() as the scripts always have.
+#
+# With MOSAIC_RESULT_FORMAT set to parquet or arrow (or --format=parquet / --format=arrow on the
+# command line of a script that calls format_from_argv), each table is also written next to its .tsv
+# as a .parquet file or an Arrow IPC .arrow file, in long form, with one schema for every table:
+#	dataset, submission, rank, sample, metric (strings), cutoff, value (float64)
+# one row per value. keys says which of the table's columns give the dataset, submission, rank,
+# sample and cutoff (and metric and value, for a table that is long already), fixed gives constants
+# for the ones it has no column for, and every other column is a metric, named by its header. Fields
+# given neither way are "" (or NaN for the cutoff), and the submission defaults to the file name the
+# script is scoring, set in submission. So a whole batch of results reads as one columnar scan.
+# These need pyarrow, which is only imported when one of them is asked for.
+
+# imports
+import sys, os
+import numpy as np
+
+FORMATS = ["tsv", "parquet", "arrow"]
+SCHEMA = ["dataset", "submission", "rank", "sample", "cutoff", "metric", "value"]
+STRING_FIELDS = ["dataset", "submission", "rank", "sample", "metric"]
+
+columnar = os.environ.get("MOSAIC_RESULT_FORMAT", "tsv")
+submission = ""					# the submission file being scored, for the columnar files
+
+def set_format(name):
+	# checks the format, and that pyarrow is there for it, before anything is scored
+	global columnar
+	if name not in FORMATS:
+		sys.exit("Warning: unknown result format %s (one of %s)." % (name, ", ".join(FORMATS)))
+	if name != "tsv":
+		try:
+			import pyarrow
+		except ImportError:
+			sys.exit("Warning: --format=%s needs pyarrow." % name)
+	columnar = name
+
+def format_from_argv():
+	# takes --format=NAME out of sys.argv (so positional arguments stay where the scripts expect them);
+	# returns the format in use, from there or MOSAIC_RESULT_FORMAT
+	name = columnar
+	for arg in list(sys.argv):
+		if arg.startswith("--format="):
+			sys.argv.remove(arg)
+			name = arg.split("=", 1)[1]
+	set_format(name)
+	return columnar
+
+def column_list(values):
+	# arrays go in as Python numbers, so they print as the scripts' own str() calls always have
+	return values.tolist() if isinstance(values, np.ndarray) else list(values)
+
+class ResultTable(object):
+	def __init__(self, file, columns, keys=None, fixed=None):
+		self.file = file
+		self.columns = list(columns)
+		self.data = [[] for column in self.columns]
+		self.keys = dict(keys or {})			# schema field -> column
+		self.fixed = dict(fixed or {})			# schema field -> constant
+
+	def __len__(self):
+		return len(self.data[0]) if self.data else 0
+
+	def add_row(self, *values):
+		for column, value in zip(self.data, values):
+			column.append(value)
+
+	def add_columns(self, *values):
+		for column, added in zip(self.data, values):
+			column.extend(column_list(added))
+
+	def column(self, name):
+		return self.data[self.columns.index(name)]
+
+	def text(self):
+		lines = ["\t".join(self.columns)] + ["\t".join(str(value) for value in row) for row in zip(*self.data)]
+		return "\n".join(lines) + "\n"
+
+	def records(self):
+		# {field: array} in SCHEMA's long form: every metric column's values, one after the other
+		rows = len(self)
+		if "metric" in self.keys:
+			metrics = [self.keys.get("value")]
+		else:
+			used = set(self.keys.values())
+			metrics = [column for column in self.columns if column not in used]
+		def field(name, default):
+			if name in self.keys:
+				values = self.column(self.keys[name])
+			else:
+				values = [self.fixed.get(name, default)] * rows
+			return values * len(metrics)
+		records = {}
+		for name in ["dataset", "submission", "rank", "sample"]:
+			records[name] = np.array([str(value) for value in field(name, submission if name == "submission" else "")], dtype=object)
+		records["cutoff"] = np.array([number(value) for value in field("cutoff", np.nan)], dtype=np.float64)
+		if "metric" in self.keys:
+			records["metric"] = np.array([str(value) for value in self.column(self.keys["metric"])], dtype=object)
+		else:
+			records["metric"] = np.repeat(np.array(metrics, dtype=object), rows)
+		records["value"] = np.array([number(value) for metric in metrics for value in self.column(metric)], dtype=np.float64)
+		return records
+
+	def write(self):
+		# writes the table (and its columnar copy, if asked for); returns the names of the files written
+		with open(self.file, 'w') as outfile:
+			outfile.write(self.text())
+		if columnar == "tsv":
+			return [self.file]
+		return [self.file, write_columnar(os.path.splitext(self.file)[0] + "." + columnar, self.records(), columnar)]
+
+def number(value):
+	# a value as a float64, or NaN if it isn't a number
+	try:
+		return float(value)
+	except (TypeError, ValueError):
+		return np.nan
+
+def write_columnar(file, records, name):
+	import pyarrow
+	arrays = [pyarrow.array(records[field].tolist(), type=pyarrow.string() if field in STRING_FIELDS else pyarrow.float64()) for field in SCHEMA]
+	table = pyarrow.Table.from_arrays(arrays, names=SCHEMA)
+	if name == "parquet":
+		import pyarrow.parquet
+		pyarrow.parquet.write_table(table, file)
+	else:
+		writer = pyarrow.RecordBatchFileWriter(file, table.schema)
+		writer.write_table(table)
+		writer.close()
+	return file
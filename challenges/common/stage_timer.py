@@ -0,0 +1,83 @@
+# stage_timer.py
+# Per-stage timing for the evaluators, off unless asked for. With MOSAIC_PROFILE set (or --profile
+# on the command line of a script that calls enable_from_argv), every named stage records its wall
+# time, CPU time, the process's peak RSS once it is done, and the number of rows it handled, e.g.
+#	with stage_timer.stage("sweep:strain", rows=len(submission_tab)):
+#		...
+# and write_report saves them as a JSON sidecar next to the scores (the scores file's name with
+# .profile.json in place of its extension), then starts afresh for the next one:
+#	{"script": "compare_results.py", "scores": "profiling_sim_low_scores.tsv", "stages": [{"name": "parse", "wall_seconds": 0.12,
+#		"cpu_seconds": 0.11, "peak_rss_mb": 41.5, "rows": 20000}, ...]}
+# Stages can nest; each one is recorded when it finishes. When profiling is off, stage() hands back
+# one shared do-nothing object, so the scripts pay a function call per stage and nothing more.
+
+# imports
+import sys, os, json, time, resource
+
+enabled = bool(os.environ.get("MOSAIC_PROFILE"))
+stages = []						# finished stages, in the order they finished
+
+def peak_rss_mb():
+	# ru_maxrss is in kilobytes on Linux (and bytes on macOS)
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return peak / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0)
+
+def cpu_seconds():
+	times = os.times()
+	return times[0] + times[1]
+
+class Stage(object):
+	def __init__(self, name, rows=None):
+		self.name = name
+		self.rows = rows				# can also be set inside the block, once the count is known
+
+	def __enter__(self):
+		self.started = time.time()
+		self.cpu_started = cpu_seconds()
+		return self
+
+	def __exit__(self, *exc_info):
+		stages.append({"name": self.name, "wall_seconds": time.time() - self.started,
+			"cpu_seconds": cpu_seconds() - self.cpu_started, "peak_rss_mb": peak_rss_mb(), "rows": self.rows})
+		return False
+
+class NullStage(object):
+	rows = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		return False
+
+NULL_STAGE = NullStage()
+
+def stage(name, rows=None):
+	if not enabled:
+		return NULL_STAGE
+	return Stage(name, rows)
+
+def enable(on=True):
+	global enabled
+	enabled = on
+
+def enable_from_argv():
+	# takes --profile out of sys.argv (so positional arguments stay where the scripts expect them)
+	if "--profile" in sys.argv:
+		sys.argv.remove("--profile")
+		enable()
+
+def reset():
+	del stages[:]
+
+def write_report(scores_file):
+	# writes the stages recorded since the last report next to scores_file, and returns the sidecar's
+	# name (or None, if profiling is off)
+	if not enabled:
+		return None
+	file = os.path.splitext(scores_file)[0] + ".profile.json"
+	with open(file, 'w') as outfile:
+		json.dump({"script": os.path.basename(sys.argv[0]), "scores": os.path.basename(scores_file), "stages": stages}, outfile, indent=1, sort_keys=True)
+		outfile.write("\n")
+	reset()
+	return file
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# synthetic_data.py
+# usage: synthetic_data.py kind rows truth_file submission_file [seed [sparsity [error_rate [samples]]]]
+# Writes a made-up truth file and a submission scored against it, in the formats the evaluators read:
+#	profiling - comma-joined 8-level taxid lineages (kingdom ... strain) and one abundance per
+#	            sample, as read by compare_results.py, calculate_BC.py and parse_NCBI_ids.py
+#	strains2  - a strain name and one value per sample, at most one sample per strain, with
+#	            confidences (0 < c <= 1) in the submission, as read by strains2_evaluator.py
+# rows is the number of truth rows (strains). sparsity is the chance a strain is absent from a
+# sample (0.5 by default), error_rate the share of calls the submission gets wrong (0.2 by
+# default), and samples the number of sample columns (4 by default).
+# For profiling, truth_file + ".snapshot" is also written: a taxonomy snapshot naming every taxid
+# in the made-up tree, for running parse_NCBI_ids.py with NCBI_TAXONOMY_SNAPSHOT.
+
+# imports
+import sys, os
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "strains1", "evaluation_assets", "profiling"))
+
+RANKS = ["superkingdom", "phylum", "class", "order", "family", "genus", "species"]
+STRAINS_PER_SPECIES = 3
+WRITE_ROWS = 50000				# rows formatted per write
+
+def taxonomy_tree(species, random):
+	# taxids for each rank from superkingdom down to species, with every node's parent one rank up.
+	# Rank r has about species ** ((r + 1) / 7) nodes, so the tree widens towards the species.
+	sizes = [max(1, int(round(species ** ((rank + 1) / float(len(RANKS)))))) for rank in range(len(RANKS))]
+	sizes[-1] = species
+	taxids = []
+	parents = []
+	start = 2
+	for rank, size in enumerate(sizes):
+		taxids.append(np.arange(start, start + size, dtype=np.int64))
+		if rank == 0:
+			parents.append(np.ones(size, dtype=np.int64))
+		else:
+			parents.append(taxids[rank - 1][random.randint(0, sizes[rank - 1], size=size)])
+		start += size
+	return taxids, parents
+
+def species_lineages(taxids, parents):
+	# (species, 7) lineage of every species, superkingdom first. Each rank's taxids are consecutive,
+	# so a taxid's position within its rank is just its offset from the first one.
+	lineages = np.empty((len(taxids[-1]), len(RANKS)), dtype=np.int64)
+	lineages[:, -1] = taxids[-1]
+	for rank in range(len(RANKS) - 1, 0, -1):
+		lineages[:, rank - 1] = parents[rank][lineages[:, rank] - taxids[rank][0]]
+	return lineages
+
+def abundances(rows, samples, sparsity, random):
+	# relative abundances: log-normal, absent with chance sparsity, each sample summing to 1
+	values = random.lognormal(0.0, 1.5, size=(rows, samples)) * (random.rand(rows, samples) >= sparsity)
+	totals = values.sum(axis=0)
+	return values / np.where(totals > 0, totals, 1.0)
+
+def profiling_tables(rows, random, sparsity=0.5, error_rate=0.2, samples=4):
+	# returns (truth taxids, truth abundances, submission taxids, submission abundances, tree)
+	species = max(1, rows // STRAINS_PER_SPECIES)
+	tree = taxonomy_tree(species, random)
+	lineages = species_lineages(*tree)
+	strain_base = int(tree[0][-1][-1]) + 1
+	truth_taxids = np.hstack([lineages[random.randint(0, species, size=rows)], strain_base + np.arange(rows)[:, None]])
+	truth_values = abundances(rows, samples, sparsity, random)
+
+	# the submission keeps most truth rows (some only down to species), misses the rest, and adds
+	# false calls: new strains of real species, each with a small abundance
+	kept = random.rand(rows) >= error_rate
+	submission_taxids = truth_taxids[kept].copy()
+	submission_taxids[random.rand(len(submission_taxids)) < error_rate / 2, -1] = 0
+	submission_values = truth_values[kept] * random.lognormal(0.0, 0.3, size=(np.count_nonzero(kept), samples))
+	false_calls = int(rows * error_rate)
+	false_taxids = np.hstack([lineages[random.randint(0, species, size=false_calls)], strain_base + rows + np.arange(false_calls)[:, None]])
+	false_values = abundances(false_calls, samples, sparsity, random) * error_rate
+	submission_taxids = np.vstack([submission_taxids, false_taxids])
+	submission_values = np.vstack([submission_values, false_values])
+	order = random.permutation(len(submission_taxids))
+	return truth_taxids, truth_values, submission_taxids[order], submission_values[order], tree
+
+def strains2_tables(rows, random, sparsity=0.5, error_rate=0.2, samples=4):
+	# returns (truth matrix, submission matrix): each strain is in at most one sample
+	present = random.rand(rows) >= sparsity
+	truth_sample = random.randint(0, samples, size=rows)
+	truth = np.zeros((rows, samples))
+	truth[np.flatnonzero(present), truth_sample[present]] = 1.0
+	# right calls for most present strains, wrong samples or missed calls for the rest, and a few
+	# calls for absent strains; right calls tend to come with higher confidence
+	wrong = random.rand(rows) < error_rate
+	called = np.where(present, random.rand(rows) >= error_rate / 2, random.rand(rows) < error_rate)
+	called_sample = np.where(present & ~wrong, truth_sample, random.randint(0, samples, size=rows))
+	confidence = np.where(present & ~wrong, random.beta(5, 2, size=rows), random.beta(2, 5, size=rows))
+	confidence = np.maximum(np.round(confidence, 4), 0.0001)
+	confidence[random.rand(rows) < 0.2] = 1.0
+	submission = np.zeros((rows, samples))
+	submission[np.flatnonzero(called), called_sample[called]] = confidence[called]
+	return truth, submission
+
+def write_profiling(file, taxids, values):
+	row_format = ",".join(["%d"] * taxids.shape[1]) + "".join(["\t%.6g"] * values.shape[1]) + "\n"
+	with open(file, 'w') as outfile:
+		for start in range(0, len(taxids), WRITE_ROWS):
+			block = np.hstack([taxids[start:start + WRITE_ROWS].astype(object), values[start:start + WRITE_ROWS].astype(object)])
+			outfile.write((row_format * len(block)) % tuple(block.ravel().tolist()))
+
+def write_strains2(file, matrix):
+	row_format = "strain%d" + "".join(["\t%.6g"] * matrix.shape[1]) + "\n"
+	with open(file, 'w') as outfile:
+		for start in range(0, len(matrix), WRITE_ROWS):
+			block = np.hstack([np.arange(start, start + len(matrix[start:start + WRITE_ROWS]))[:, None].astype(object), matrix[start:start + WRITE_ROWS].astype(object)])
+			outfile.write((row_format * len(block)) % tuple(block.ravel().tolist()))
+
+def write_tree_snapshot(file, tree):
+	# names are made up from the taxids; strains are left out, as parse_NCBI_ids never looks them up
+	import ncbi_taxonomy
+	taxids = np.concatenate(tree[0])
+	ranks = [rank for rank, level in zip(RANKS, tree[0]) for taxid in level]
+	names = ["%s %d" % (rank, taxid) for rank, taxid in zip(ranks, taxids.tolist())]
+	ncbi_taxonomy.write_snapshot(file, taxids, np.concatenate(tree[1]), names, ranks, source="synthetic_data.py")
+
+def write_tables(kind, rows, truth_file, submission_file, seed=0, sparsity=0.5, error_rate=0.2, samples=4):
+	random = np.random.RandomState(seed)
+	if kind == "profiling":
+		truth_taxids, truth_values, submission_taxids, submission_values, tree = profiling_tables(rows, random, sparsity, error_rate, samples)
+		write_profiling(truth_file, truth_taxids, truth_values)
+		write_profiling(submission_file, submission_taxids, submission_values)
+		write_tree_snapshot(truth_file + ".snapshot", tree)
+	elif kind == "strains2":
+		truth, submission = strains2_tables(rows, random, sparsity, error_rate, samples)
+		write_strains2(truth_file, truth)
+		write_strains2(submission_file, submission)
+	else:
+		sys.exit('Kind "%s" is not valid, use "profiling" or "strains2".' % kind)
+
+if __name__ == "__main__":
+	if len(sys.argv) < 5:
+		sys.exit("usage: synthetic_data.py kind rows truth_file submission_file [seed [sparsity [error_rate [samples]]]]")
+	options = sys.argv[5:]
+	write_tables(sys.argv[1], int(float(sys.argv[2])), sys.argv[3], sys.argv[4],
+		seed=int(options[0]) if len(options) > 0 else 0,
+		sparsity=float(options[1]) if len(options) > 1 else 0.5,
+		error_rate=float(options[2]) if len(options) > 2 else 0.2,
+		samples=int(options[3]) if len(options) > 3 else 4)
@@ -0,0 +1,289 @@
+# table_loader.py
+# Shared reader for the tab-separated tables the challenge evaluators take in: a key in the first
+# column and one value per sample after it. Two kinds of table are read:
+#	"lineage" - profiling tables, keyed by a comma-joined taxid lineage (kingdom ... strain)
+#	"matrix"  - strains2 tables, keyed by a strain name
+# Files are parsed a chunk of lines at a time straight into NumPy arrays, and returned as a dict
+# of arrays ("taxids"/"depths" or "keys", plus "values").
+#
+# gzip, bzip2 and zstd files are read too, whatever they are named: the format is told from the
+# first bytes of the file, and the file is decompressed as a stream into the parser, with no
+# temporary files. Decompression runs in a separate process (pigz or gzip, lbzip2, pbzip2 or bzip2,
+# and zstd, whichever is installed first), so it overlaps with the parsing; without one of those,
+# gzip and bzip2 are decompressed in-process instead.
+#
+# Set MOSAIC_TABLE_CACHE to a directory to keep every parsed table there as a binary file named
+# after the hash of the table's contents. Loading the same truth set again is then one memory map,
+# with every array a read-only view into it. The directory is trimmed back to MOSAIC_TABLE_CACHE_MB
+# (1024 by default) after each write, least recently used files first.
+
+# imports
+import os, zlib, bz2, json, hashlib, itertools, subprocess, contextlib
+from distutils.spawn import find_executable
+import numpy as np
+
+CHUNK_LINES = 65536				# lines parsed per chunk
+LINEAGE_DEPTH = 8				# kingdom ... strain
+CACHE_MAGIC = b"MOSAICTB"
+CACHE_SUFFIX = ".table"
+CACHE_VERSION = 1				# bump whenever a parsed layout changes, so old cache files are never read
+CACHE_LIMIT_MB = 1024
+READ_BYTES = 1 << 20			# compressed bytes read at a time, when decompressing in-process
+
+# compression format -> (magic bytes, decompressor commands in order of preference)
+COMPRESSION = {
+	"gzip": (b"\x1f\x8b", [["pigz", "-dc"], ["gzip", "-dc"]]),
+	"bzip2": (b"BZh", [["lbzip2", "-dc"], ["pbzip2", "-dc"], ["bzip2", "-dc"]]),
+	"zstd": (b"\x28\xb5\x2f\xfd", [["zstd", "-dcq"]]),
+}
+
+# Array files: an 8-byte magic, an 8-byte header length, a JSON header giving the dtype, offset and
+# shape of every array, then the arrays themselves, each 8-byte aligned. Also used for the taxonomy
+# snapshots written by ncbi_taxonomy.py.
+
+def write_arrays(file, magic, arrays, header=None):
+	# arrays is a list of (name, array); anything else in header is stored alongside them
+	arrays = [(name, np.ascontiguousarray(array)) for name, array in arrays]
+	header = dict(header or {})
+	header["arrays"] = {}
+	offset = 0
+	for name, array in arrays:
+		shape = len(array) if array.ndim == 1 else list(array.shape)
+		header["arrays"][name] = [array.dtype.str, offset, shape]
+		offset += array.nbytes
+		offset += -offset % 8			# keeps every array 8-byte aligned
+	header_bytes = json.dumps(header).encode('utf-8')
+	header_bytes += b" " * (-len(header_bytes) % 8)
+	with open(file, 'wb') as outfile:
+		outfile.write(magic)
+		outfile.write(np.array([len(header_bytes)], dtype='<u8').tobytes())
+		outfile.write(header_bytes)
+		for name, array in arrays:
+			outfile.write(array.tobytes())
+			outfile.write(b"\0" * (-array.nbytes % 8))
+
+def map_arrays(file, magic):
+	# returns (header, {name: array}); the whole file is mapped once and each array is a view into it
+	with open(file, 'rb') as infile:
+		if infile.read(8) != magic:
+			raise ValueError("%s is not a %s file" % (file, magic.decode('ascii')))
+		header_length = int(np.frombuffer(infile.read(8), dtype='<u8')[0])
+		header = json.loads(infile.read(header_length).decode('utf-8'))
+	start = 16 + header_length
+	raw = np.memmap(file, dtype=np.uint8, mode='r')
+	arrays = {}
+	for name, (dtype, offset, shape) in header["arrays"].items():
+		dtype = np.dtype(dtype)
+		shape = tuple(shape) if isinstance(shape, list) else (shape,)
+		size = int(np.prod(shape)) * dtype.itemsize
+		arrays[str(name)] = raw[start + offset:start + offset + size].view(dtype).reshape(shape)
+	return header, arrays
+
+# Compressed input
+
+def compression(file):
+	# the file's compression format, from its first bytes, or None for a plain file
+	with open(file, 'rb') as infile:
+		start = infile.read(4)
+	for kind, (magic, commands) in COMPRESSION.items():
+		if start.startswith(magic):
+			return kind
+	return None
+
+def decompressor_command(kind):
+	for command in COMPRESSION[kind][1]:
+		if find_executable(command[0]):
+			return command
+	return None
+
+def new_decompressor(kind):
+	if kind == "gzip":
+		return zlib.decompressobj(16 + zlib.MAX_WBITS)
+	if kind == "bzip2":
+		return bz2.BZ2Decompressor()
+	raise IOError("no %s command installed to decompress with" % kind)
+
+def decompressed_blocks(infile, kind):
+	# the decompressed contents of an open file, a block at a time. Files can be several compressed
+	# streams one after another (as pigz, pbzip2 and bgzip write them); each one ends with the rest
+	# of the input in unused_data, which starts the next.
+	decompressor = new_decompressor(kind)
+	for block in iter(lambda: infile.read(READ_BYTES), b""):
+		while block:
+			try:
+				yield decompressor.decompress(block)
+			except EOFError:
+				# bz2 only: the last stream ended right at the end of the previous block
+				decompressor = new_decompressor(kind)
+				continue
+			block = decompressor.unused_data
+			if block:
+				decompressor = new_decompressor(kind)
+
+def block_lines(blocks):
+	rest = b""
+	for block in blocks:
+		lines = (rest + block).split(b"\n")
+		rest = lines.pop()
+		for line in lines:
+			yield line + b"\n"
+	if rest:
+		yield rest
+
+@contextlib.contextmanager
+def open_table(file):
+	# the lines of a table file, decompressed on the way in if it is compressed
+	kind = compression(file)
+	if kind is None:
+		with open(file, 'r') as infile:
+			yield infile
+		return
+	command = decompressor_command(kind)
+	if command is None:
+		with open(file, 'rb') as infile:
+			yield block_lines(decompressed_blocks(infile, kind))
+		return
+	process = subprocess.Popen(command + [file], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	try:
+		yield process.stdout
+	except:
+		# the reader gave up part way through, so the rest of the output is never wanted
+		process.kill()
+		process.wait()
+		raise
+	error = process.stderr.read()
+	if process.wait() != 0:
+		raise IOError("could not decompress %s: %s" % (file, error.strip()))
+
+# Parsing
+
+def read_chunks(file):
+	# the non-blank lines of a file split into (key, values text), a chunk at a time
+	with open_table(file) as infile:
+		while True:
+			chunk = list(itertools.islice(infile, CHUNK_LINES))
+			if not chunk:
+				return
+			entries = [line.strip().split("\t", 1) for line in chunk if line.strip()]
+			if not entries:
+				continue
+			if min(len(entry) for entry in entries) < 2:
+				raise ValueError("wrong number of columns")
+			yield [entry[0] for entry in entries], [entry[1] for entry in entries]
+
+def parse_values(values, columns, dtype):
+	# one row per line; every line needs the same number of columns
+	if columns is None:
+		columns = values[0].count("\t") + 1
+	if any(value.count("\t") != columns - 1 for value in values):
+		raise ValueError("wrong number of columns")
+	parsed = np.fromstring("\t".join(values), dtype=dtype, sep="\t")
+	if len(parsed) != len(values) * columns:
+		raise ValueError("could not read the values")
+	return parsed.reshape(len(values), columns)
+
+def parse_lineages(keys):
+	# lineages shorter than LINEAGE_DEPTH ranks are padded out with 0 (no call), longer ones are cut
+	depths = np.minimum([key.count(",") + 1 for key in keys], LINEAGE_DEPTH)
+	padded = ",".join(key + ",0" * (LINEAGE_DEPTH - depth) if key.count(",") < LINEAGE_DEPTH else ",".join(key.split(",")[:LINEAGE_DEPTH])
+		for key, depth in zip(keys, depths.tolist()))
+	taxids = np.fromstring(padded, dtype=np.int64, sep=",")
+	if len(taxids) != len(keys) * LINEAGE_DEPTH:
+		raise ValueError("could not read the lineages")
+	return taxids.reshape(len(keys), LINEAGE_DEPTH), depths.astype(np.uint8)
+
+def append_rows(array, rows, block):
+	# copies block in after the first rows of array, doubling the array first if it is full
+	if array is None:
+		array = np.empty((max(CHUNK_LINES, len(block)),) + block.shape[1:], dtype=block.dtype)
+	elif rows + len(block) > len(array):
+		grown = np.empty((max(2 * len(array), rows + len(block)),) + array.shape[1:], dtype=array.dtype)
+		grown[:rows] = array[:rows]
+		array = grown
+	array[rows:rows + len(block)] = block
+	return array
+
+def parse_lineage_table(file):
+	taxids = depths = values = None
+	rows = 0
+	for keys, chunk_values in read_chunks(file):
+		chunk_values = parse_values(chunk_values, None if values is None else values.shape[1], np.float64)
+		chunk_taxids, chunk_depths = parse_lineages(keys)
+		taxids = append_rows(taxids, rows, chunk_taxids)
+		depths = append_rows(depths, rows, chunk_depths)
+		values = append_rows(values, rows, chunk_values)
+		rows += len(keys)
+	if values is None:
+		return {"taxids": np.zeros((0, LINEAGE_DEPTH), dtype=np.int64), "depths": np.zeros(0, dtype=np.uint8), "values": np.zeros((0, 0))}
+	taxids = taxids[:rows]
+	if rows and taxids.max() <= np.iinfo(np.int32).max and taxids.min() >= 0:
+		taxids = taxids.astype(np.int32)
+	return {"taxids": taxids, "depths": depths[:rows], "values": values[:rows]}
+
+def parse_matrix_table(file):
+	names = []
+	values = None
+	for keys, chunk_values in read_chunks(file):
+		values = append_rows(values, len(names), parse_values(chunk_values, None if values is None else values.shape[1], np.float32))
+		names.extend(keys)
+	if values is None:
+		return {"keys": np.zeros(0, dtype='S1'), "values": np.zeros((0, 0), dtype=np.float32)}
+	return {"keys": np.array(names, dtype='S'), "values": values[:len(names)]}
+
+PARSERS = {"lineage": parse_lineage_table, "matrix": parse_matrix_table}
+
+# Cache
+
+def content_hash(file, kind):
+	# of the file as stored, so a compressed table is never decompressed just to look it up
+	digest = hashlib.sha1(("%s %d\n" % (kind, CACHE_VERSION)).encode('ascii'))
+	with open(file, 'rb') as infile:
+		for block in iter(lambda: infile.read(1 << 20), b""):
+			digest.update(block)
+	return digest.hexdigest()
+
+def trim_cache(cache_dir, limit_mb=None, suffix=CACHE_SUFFIX):
+	# drops the least recently used cache files (those ending in suffix) until they fit within limit_mb
+	if limit_mb is None:
+		limit_mb = float(os.environ.get("MOSAIC_TABLE_CACHE_MB", CACHE_LIMIT_MB))
+	entries = []
+	for name in os.listdir(cache_dir):
+		if name.endswith(suffix):
+			try:
+				info = os.stat(os.path.join(cache_dir, name))
+			except OSError:
+				continue
+			entries.append((info.st_mtime, info.st_size, name))
+	total = 0
+	for mtime, size, name in sorted(entries, reverse=True):
+		total += size
+		if total > limit_mb * 1024 * 1024:
+			try:
+				os.remove(os.path.join(cache_dir, name))
+			except OSError:
+				pass
+
+def load(file, kind, cache_dir=None):
+	if kind not in PARSERS:
+		raise ValueError('unknown table kind "%s"' % kind)
+	if cache_dir is None:
+		cache_dir = os.environ.get("MOSAIC_TABLE_CACHE")
+	if not cache_dir:
+		return PARSERS[kind](file)
+	cache_file = os.path.join(cache_dir, content_hash(file, kind) + CACHE_SUFFIX)
+	if os.path.exists(cache_file):
+		try:
+			arrays = map_arrays(cache_file, CACHE_MAGIC)[1]
+			os.utime(cache_file, None)			# marks it as recently used
+			return arrays
+		except (IOError, OSError, ValueError):
+			pass								# an unreadable cache file is just parsed again
+	arrays = PARSERS[kind](file)
+	if not os.path.isdir(cache_dir):
+		os.makedirs(cache_dir)
+	# written next to the target and renamed over it, so readers never see a half-written file
+	temp_file = "%s.%d.tmp" % (cache_file, os.getpid())
+	write_arrays(temp_file, CACHE_MAGIC, sorted(arrays.items()), {"kind": kind, "source": os.path.basename(file)})
+	os.rename(temp_file, cache_file)
+	trim_cache(cache_dir)
+	return arrays
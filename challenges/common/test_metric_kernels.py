@@ -0,0 +1,106 @@
+# test_metric_kernels.py
+# Checks metric_kernels.py against the sklearn functions it replaces, and braycurtis.py's per-rank
+# Bray-Curtis and Jaccard against scipy's, on random inputs and the edge cases the evaluators hit.
+# Run with python -m unittest discover -s challenges/common (or python test_metric_kernels.py);
+# skipped without sklearn and scipy.
+
+# imports
+import sys, os, unittest
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "strains1", "evaluation_assets", "profiling"))
+import metric_kernels, braycurtis
+
+try:
+	from sklearn.metrics import auc as sklearn_auc
+	from sklearn.metrics.cluster import adjusted_rand_score as sklearn_adjusted_rand_score
+	from scipy.spatial import distance
+	have_references = True
+except ImportError:
+	have_references = False
+
+TRIALS = 200
+
+@unittest.skipIf(not have_references, "needs sklearn and scipy")
+class MetricKernelsTest(unittest.TestCase):
+	def setUp(self):
+		self.random = np.random.RandomState(0)
+		# every kernel call below is also cross-checked as the evaluators' calls would be
+		self.check = os.environ.get("MOSAIC_METRICS_CHECK")
+		os.environ["MOSAIC_METRICS_CHECK"] = "1"
+
+	def tearDown(self):
+		if self.check is None:
+			del os.environ["MOSAIC_METRICS_CHECK"]
+		else:
+			os.environ["MOSAIC_METRICS_CHECK"] = self.check
+
+	def random_labels(self, size):
+		return self.random.randint(0, self.random.randint(1, 6), size=(2, size))
+
+	def test_auc(self):
+		for trial in range(TRIALS):
+			size = self.random.randint(2, 60)
+			x = np.sort(self.random.rand(size))
+			y = self.random.rand(size)
+			self.assertAlmostEqual(metric_kernels.auc(x, y), sklearn_auc(x, y), places=12)
+			self.assertAlmostEqual(metric_kernels.auc(x[::-1], y), sklearn_auc(x[::-1], y), places=12)
+
+	def test_auc_errors(self):
+		self.assertRaises(ValueError, metric_kernels.auc, [0.5], [1.0])
+		self.assertRaises(ValueError, metric_kernels.auc, [0.1, 0.3, 0.2], [1.0, 1.0, 1.0])
+
+	def test_average_precision(self):
+		# recall going down as the cutoff goes up: each gain in recall weighted by its precision
+		self.assertAlmostEqual(metric_kernels.average_precision([0.5, 0.8, 1.0], [1.0, 0.5, 0.25]), 0.25 + 0.25 * 0.8 + 0.5 * 0.5)
+
+	def test_adjusted_rand_score(self):
+		for trial in range(TRIALS):
+			labels = self.random_labels(self.random.randint(2, 60))
+			self.assertAlmostEqual(metric_kernels.adjusted_rand_score(labels[0], labels[1]), sklearn_adjusted_rand_score(labels[0], labels[1]), places=12)
+			self.assertEqual(metric_kernels.adjusted_rand_score(labels[0], labels[0]), 1.0)
+
+	def test_adjusted_rand_edge_cases(self):
+		for labels_true, labels_pred in [([0, 0, 1, 1], [0, 0, 0, 0]), (np.arange(10), np.arange(10)),
+				(np.arange(10), np.zeros(10)), ([3], [7])]:
+			self.assertAlmostEqual(metric_kernels.adjusted_rand_score(labels_true, labels_pred), sklearn_adjusted_rand_score(labels_true, labels_pred), places=12)
+
+	def test_adjusted_rand_from_contingency(self):
+		for trial in range(TRIALS):
+			labels = self.random_labels(self.random.randint(2, 60))
+			table = metric_kernels.contingency_table(labels[0], labels[1])
+			self.assertAlmostEqual(metric_kernels.adjusted_rand_from_contingency(table), sklearn_adjusted_rand_score(labels[0], labels[1]), places=12)
+			# a labelling rebuilt from the table has the same table
+			self.assertTrue(np.array_equal(metric_kernels.contingency_table(*metric_kernels.labelling(table)), table))
+
+	def test_adjusted_rand_from_contingencies(self):
+		# a stack of tables, as the bootstrap weights them, against each one on its own
+		# (every label is used at least once, so the tables all come out 4 x 4)
+		tables = np.array([metric_kernels.contingency_table(*np.hstack((self.random.randint(0, 4, size=(2, 40)), [np.arange(4)] * 2)))
+			for trial in range(20)], dtype=float)
+		scores = metric_kernels.adjusted_rand_from_contingencies(tables)
+		for table, score in zip(tables, scores):
+			self.assertAlmostEqual(score, metric_kernels.adjusted_rand_from_contingency(table.astype(int)), places=12)
+		self.assertEqual(metric_kernels.adjusted_rand_from_contingencies(np.zeros((0, 2, 2))).shape, (0,))
+
+	def test_cross_check_catches_mismatches(self):
+		self.assertRaises(AssertionError, metric_kernels.cross_check, "adjusted_rand_from_contingency", 0.5, [[2, 0], [0, 2]])
+
+	def test_braycurtis(self):
+		# similarity and jaccard per rank stretch, against scipy on each stretch of the profiles
+		for trial in range(TRIALS // 10):
+			bounds = np.concatenate(([0], np.cumsum(self.random.randint(1, 20, size=7))))
+			one = self.random.rand(bounds[-1], 4) * (self.random.rand(bounds[-1], 4) < 0.6)
+			two = self.random.rand(bounds[-1], 4) * (self.random.rand(bounds[-1], 4) < 0.6)
+			similarity = braycurtis.similarity(one, two, bounds)
+			jaccard = braycurtis.jaccard(one[:, 0], two[:, 0], bounds)
+			for rank in range(len(bounds) - 1):
+				stretch = slice(bounds[rank], bounds[rank + 1])
+				for sample in range(4):
+					if (one[stretch, sample] + two[stretch, sample]).any():
+						self.assertAlmostEqual(similarity[rank, sample], 1 - distance.braycurtis(one[stretch, sample], two[stretch, sample]), places=12)
+				if (one[stretch, 0] + two[stretch, 0]).any():
+					self.assertAlmostEqual(jaccard[rank], 1 - distance.jaccard(one[stretch, 0] > 0, two[stretch, 0] > 0), places=12)
+
+if __name__ == "__main__":
+	unittest.main()
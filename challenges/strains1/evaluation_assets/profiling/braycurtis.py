@@ -0,0 +1,162 @@
+# braycurtis.py
+# Bray-Curtis and Jaccard similarity between profiling tables, for every rank and every sample at once,
+# and UniFrac distances over the tree the lineages make.
+# All ranks share one taxon index: each rank gets its own stretch of positions, so a single grouped
+# sum per sample builds the per-taxon profile for the whole lineage, and the per-rank scores are
+# segment sums over that profile.
+
+# imports
+import numpy as np
+
+CLADES = ["kingdom", "phylum", "class", "order", "family", "genus", "species"]
+
+def taxon_index(tables, clades=CLADES):
+	# every taxid seen at each rank across all the tables gets a position; bounds[r]:bounds[r+1]
+	# holds the positions for clades[r]. Returns a (rows, ranks) position matrix for each table.
+	sizes = [len(table) for table in tables]
+	positions = [np.empty((size, len(clades)), dtype=np.int64) for size in sizes]
+	bounds = [0]
+	for rank, clade in enumerate(clades):
+		keys, inverse = np.unique(np.concatenate([table.column(clade) for table in tables]), return_inverse=True)
+		start = 0
+		for table_positions, size in zip(positions, sizes):
+			table_positions[:, rank] = inverse[start:start + size] + bounds[-1]
+			start += size
+		bounds.append(bounds[-1] + len(keys))
+	return positions, np.array(bounds)
+
+def rank_profiles(table, positions, size):
+	# per-taxon abundance (taxa x samples) and per-taxon row count (OTUs) over all ranks
+	flat = positions.ravel()
+	ranks = positions.shape[1]
+	samples = table.abundances.shape[1]
+	profile = np.empty((size, samples))
+	for sample in range(samples):
+		weights = np.repeat(table.abundances[:, sample], ranks)
+		profile[:, sample] = np.bincount(flat, weights=weights, minlength=size)
+	counts = np.bincount(flat, minlength=size).astype(float)
+	return profile, counts
+
+def similarity(one, two, bounds):
+	# 1 - Bray-Curtis dissimilarity, sum|u-v| / sum|u+v|, within each rank's stretch of the profiles
+	with np.errstate(divide='ignore', invalid='ignore'):
+		difference = np.add.reduceat(np.abs(one - two), bounds[:-1], axis=0)
+		total = np.add.reduceat(np.abs(one + two), bounds[:-1], axis=0)
+		return 1 - difference / total
+
+def jaccard(one_counts, two_counts, bounds):
+	# taxa present in both tables over taxa present in either, per rank
+	one_present = one_counts > 0
+	two_present = two_counts > 0
+	shared = np.add.reduceat((one_present & two_present).astype(float), bounds[:-1])
+	either = np.add.reduceat((one_present | two_present).astype(float), bounds[:-1])
+	with np.errstate(divide='ignore', invalid='ignore'):
+		return shared / either
+
+# Many tables at once: every table is profiled against the same taxon index, stacked into a
+# (tables, taxa, samples) array, and compared pairwise a block of tables at a time so the
+# intermediate |u - v| array stays within BLOCK_BYTES.
+
+BLOCK_BYTES = 64 * 1024 * 1024
+
+def stack_profiles(tables, clades=CLADES):
+	# returns (profiles, counts, bounds, UniFrac tree nodes) for the tables
+	positions, bounds = taxon_index(tables, clades)
+	profiles = []
+	counts = []
+	for table, table_positions in zip(tables, positions):
+		profile, count = rank_profiles(table, table_positions, bounds[-1])
+		profiles.append(profile)
+		counts.append(count)
+	return np.array(profiles), np.array(counts), bounds, tree_nodes(tables, positions, bounds[-1], clades)
+
+def pairwise_similarity(profiles, bounds, others=None, block_bytes=BLOCK_BYTES):
+	# 1 - Bray-Curtis for every pair of (profiles[i], others[j]), per rank and sample: (n, m, ranks, samples).
+	# abundances are never negative, so the sum|u+v| denominator is just the two per-rank totals added.
+	if others is None:
+		others = profiles
+	n, taxa, samples = profiles.shape
+	m = others.shape[0]
+	totals = np.add.reduceat(profiles, bounds[:-1], axis=1)
+	other_totals = np.add.reduceat(others, bounds[:-1], axis=1)
+	result = np.empty((n, m, len(bounds) - 1, samples))
+	block = max(1, block_bytes // max(1, m * taxa * samples * 8))
+	for start in range(0, n, block):
+		chunk = profiles[start:start + block]
+		difference = np.add.reduceat(np.abs(chunk[:, None] - others[None]), bounds[:-1], axis=2)
+		total = totals[start:start + block, None] + other_totals[None]
+		with np.errstate(divide='ignore', invalid='ignore'):
+			result[start:start + block] = 1 - difference / total
+	return result
+
+def pairwise_jaccard(counts, bounds, others=None):
+	# shared over combined taxa for every pair of tables, per rank: (n, m, ranks)
+	if others is None:
+		others = counts
+	present = (counts > 0).astype(float)
+	other_present = (others > 0).astype(float)
+	result = np.empty((counts.shape[0], others.shape[0], len(bounds) - 1))
+	for rank in range(len(bounds) - 1):
+		one = present[:, bounds[rank]:bounds[rank + 1]]
+		two = other_present[:, bounds[rank]:bounds[rank + 1]]
+		shared = one.dot(two.T)
+		either = one.sum(axis=1)[:, None] + two.sum(axis=1)[None] - shared
+		with np.errstate(divide='ignore', invalid='ignore'):
+			result[:, :, rank] = shared / either
+	return result
+
+def similarity_replicates(weights, difference, total):
+	# 1 - Bray-Curtis within one rank for bootstrap resamples of its taxa: weights is (replicates,
+	# taxa), difference and total the per-taxon |u-v| and |u+v| (taxa, samples) -> (replicates, samples)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		return 1 - np.dot(weights, difference) / np.dot(weights, total)
+
+# UniFrac: every taxon the tables call at every rank (kingdom ... species) is a node of the tree the
+# lineages make, hanging off the rank above by a branch of length 1; ranks with no call (taxid 0)
+# are not nodes. A row's abundance is under every node of its lineage, so the per-taxon sums from
+# rank_profiles are already the per-node abundances a Fast-UniFrac post-order pass collects, and
+# both distances are sums over those nodes for every sample (and every pair of tables) at once:
+#	weighted   - sum |a - b| / sum (a + b), a and b each node's share of its sample's total
+#				 abundance (normalized weighted UniFrac, with every leaf's depth its called ranks)
+#	unweighted - branches under only one of the two samples over branches under either
+
+def tree_nodes(tables, positions, size, clades=CLADES):
+	# which positions of the shared taxon index (see taxon_index) are called taxa
+	nodes = np.zeros(size, dtype=bool)
+	for table, table_positions in zip(tables, positions):
+		nodes[table_positions[table.taxids[:, :len(clades)] != 0]] = True
+	return nodes
+
+def node_shares(profiles, nodes, bounds):
+	# (tables, nodes, samples) share of each sample's total abundance under each node; every row is
+	# under exactly one position of the first rank, so that rank sums to the total
+	totals = profiles[:, bounds[0]:bounds[1]].sum(axis=1)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		return profiles[:, nodes] / totals[:, None]
+
+def pairwise_unifrac(profiles, nodes, bounds, others=None, block_bytes=BLOCK_BYTES):
+	# weighted and unweighted UniFrac for every pair of (profiles[i], others[j]) and every sample:
+	# (n, m, 2, samples), from stacked profiles as stack_profiles makes them
+	shares = node_shares(profiles, nodes, bounds)
+	other_shares = shares if others is None else node_shares(others, nodes, bounds)
+	n, taxa, samples = shares.shape
+	m = other_shares.shape[0]
+	present = (shares > 0).astype(float)
+	other_present = (other_shares > 0).astype(float)
+	totals = shares.sum(axis=1)
+	other_totals = other_shares.sum(axis=1)
+	result = np.empty((n, m, 2, samples))
+	block = max(1, block_bytes // max(1, m * taxa * samples * 8))
+	for start in range(0, n, block):
+		chunk = shares[start:start + block]
+		difference = np.abs(chunk[:, None] - other_shares[None]).sum(axis=2)
+		shared = np.einsum('ats,bts->abs', present[start:start + block], other_present)
+		either = present[start:start + block].sum(axis=1)[:, None] + other_present.sum(axis=1)[None] - shared
+		with np.errstate(divide='ignore', invalid='ignore'):
+			result[start:start + block, :, 0] = difference / (totals[start:start + block, None] + other_totals[None])
+			result[start:start + block, :, 1] = (either - shared) / either
+	return result
+
+def unifrac(one_profile, two_profile, nodes, bounds):
+	# weighted and unweighted UniFrac between two tables' profiles, per sample: (2, samples)
+	return pairwise_unifrac(one_profile[None], nodes, bounds, others=two_profile[None])[0, 0]
@@ -1,123 +1,117 @@
 #!/usr/env Python
 # calculate_BC.py
-# usage: compare.py one_in two_in col_index
+# usage: calculate_BC.py dataset one_in two_in
 # where one_in and two_in are the abundance tables in terms of the standardized format
-# col_index refers to the column number of the sample to be compared in case there are
-# multiple samples
-
-import sys, os, scipy
+# every sample column in the tables is compared, one Bray-Curtis score per sample and rank
+# and weighted and unweighted UniFrac distances per sample, over the tree of the lineages, go to profiling_<dataset>_unifrac.tsv
+# --profile (or MOSAIC_PROFILE=1) also writes per-stage timings to profiling_<dataset>_braycurtis.profile.json
+# --bootstrap=N (or MOSAIC_BOOTSTRAP=N) also writes each score with a 95% interval from N resamples of the
+# taxa at its rank to profiling_<dataset>_braycurtis_ci.tsv
+# with MOSAIC_RESULT_CACHE set to a directory, results are cached there (see challenges/common/result_cache.py)
+# --format=parquet or --format=arrow (or MOSAIC_RESULT_FORMAT) also writes each file in that format (see challenges/common/result_writer.py)
+
+import sys, os
 import numpy as np
-from scipy import spatial
-from collections import defaultdict
 from tabulate import tabulate
-
-def compute_jaccard_index(set_1, set_2):
- 	n = len(set_1.intersection(set_2))
-	return n / float(len(set_1) + len(set_2) - n)
-
-def reformat_infile(infilename,outfilename,col_index):
-	infile=open(infilename,'r')
-	outfile=open(outfilename,'w')
-
-	for line in infile:
-		tmp=line.split("\t")
-		tax=['0'] * 7
-
-		index=0
-		for i in tmp[0].split(",")[0:-1]:
-			tax[index]=i
-			index+=1
-
-		taxids=",".join(tax)
-		str=",".join([taxids, tmp[col_index]])
-		outfile.write(str+"\n")
-
-dataset=sys.argv[1]
-one_in=sys.argv[2]
-two_in=sys.argv[3]
-
-output=open("profiling_"+dataset+"_braycurtis.tsv", 'wt')
-headers=['dataset','sample','tax_ranking','braycurtis']
-output.write("\t".join(headers))
-output.write("\n")
-scores={}
-scores["family"]=[]
-scores["genus"]=[]
-scores["species"]=[]
-for col_index in range(0,4):
-	print "Processing Sample %s" % str(col_index+1)
-	reformat_infile(one_in, one_in+".csv", col_index)
-	reformat_infile(two_in, two_in+".csv", col_index)
-
-	one=one_in+".csv"
-	two=two_in+".csv"
-	clades = [ "kingdom", "phylum", "class", "order" , "family" ,"genus" ,"species"]
-	table = []
-
-	for ranking, clade in enumerate(clades):
-		taxa = {}
-		taxa["one"]= {}
-		taxa["two"]= {}
-		taxa_n = {}
-		taxa_n["one"]= {}
-		taxa_n["two"]= {}
-
-		list_of_clades_one = []
-		with open(one, 'rt') as f:
-			for line in f:
-				line = line.rstrip()
-				line = line.split(",")
-				list_of_clades_one.append(line[ranking])
-
-				if line[ranking] in taxa["one"]:
-					taxa["one"][line[ranking]] += float(line[7])
-					taxa_n["one"][line[ranking]] += 1
-				else:
-					taxa["one"][line[ranking]] = float(line[7])
-					taxa_n["one"][line[ranking]] = 1
-					taxa["two"][line[ranking]] = 0.0
-					taxa_n["two"][line[ranking]] = 0
-
-		list_of_clades_two = []
-		with open(two, 'rt') as f:
-			for line in f:
-				line = line.rstrip()
-				line = line.split(",")
-				list_of_clades_two.append(line[ranking])
-				if line[ranking] in taxa["two"]:
-					taxa["two"][line[ranking]] += float(line[7])
-					taxa_n["two"][line[ranking]] += 1
-				else:
-					taxa["one"][line[ranking]] = 0.0
-					taxa["two"][line[ranking]] = float(line[7])
-					taxa_n["one"][line[ranking]] = 0
-					taxa_n["two"][line[ranking]] = 1
-		list_one = []
-		list_two = []
-		list_one_n = []
-		list_two_n = []
-		for key in taxa["one"]:
-			list_one.append(taxa["one"][key])
-			list_two.append(taxa["two"][key])
-			list_one_n.append(taxa_n["one"][key])
-			list_two_n.append(taxa_n["two"][key])
-
-		set_one = set(list_of_clades_one)
-		set_two = set(list_of_clades_two)
-		jaccard= compute_jaccard_index(set_one,set_two)
-
-		sim = 1 - scipy.spatial.distance.braycurtis(list_one,list_two)
-		sim_n = 1 - scipy.spatial.distance.braycurtis(list_one_n,list_two_n)
-		table.append([clade,sim,sim_n,sim*sim_n,jaccard])
-
-	print tabulate(table, headers=["Clade","Bray Curtis Abundance", "Bray Curtis OTU", "BC Ab * BC OTU", "Jaccard Similarity"], tablefmt="fancy_grid")
-
-	for i in range(4,7):
-		scores[table[i][0]].append(table[i][1])
-		print [dataset, str(col_index+1),table[i][0],table[i][1]]
-		output.write("\t".join([dataset, str(col_index+1), table[i][0], str(table[i][1])] ))
-		output.write("\n")
-
-	os.remove(one)
-	os.remove(two)
-output.close()
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, os.pardir, "common"))
+import lineage, braycurtis, stage_timer, bootstrap, table_loader, result_cache, result_writer
+
+def compare_tables(dataset, one, two):
+	# writes the Bray-Curtis and UniFrac files for two parsed tables to the working directory, and returns their names
+	if one.abundances.shape[1] != two.abundances.shape[1]:
+		sys.exit("Warning: the two tables have a different number of samples.")
+	output=result_writer.ResultTable("profiling_"+dataset+"_braycurtis.tsv", ['dataset','sample','tax_ranking','braycurtis'],
+		keys={"dataset": "dataset", "sample": "sample", "rank": "tax_ranking"})
+	scores={}
+	scores["family"]=[]
+	scores["genus"]=[]
+	scores["species"]=[]
+	clades = braycurtis.CLADES
+
+	# every rank and every sample is scored in one go, from per-taxon profiles over a shared taxon index
+	with stage_timer.stage("braycurtis", rows=len(one) + len(two)):
+		positions, bounds = braycurtis.taxon_index([one, two], clades)
+		profile_one, counts_one = braycurtis.rank_profiles(one, positions[0], bounds[-1])
+		profile_two, counts_two = braycurtis.rank_profiles(two, positions[1], bounds[-1])
+		sims = braycurtis.similarity(profile_one, profile_two, bounds)		# ranks x samples
+		sims_n = braycurtis.similarity(counts_one, counts_two, bounds)		# ranks, same for every sample
+		jaccards = braycurtis.jaccard(counts_one, counts_two, bounds)
+
+	with stage_timer.stage("unifrac", rows=len(one) + len(two)):
+		unifracs = braycurtis.unifrac(profile_one, profile_two, braycurtis.tree_nodes([one, two], positions, bounds[-1]), bounds)
+		unifrac_output = result_writer.ResultTable("profiling_"+dataset+"_unifrac.tsv", ['dataset','sample','weighted_unifrac','unweighted_unifrac'],
+			keys={"dataset": "dataset", "sample": "sample"}, fixed={"rank": "all"})
+		for col_index in range(one.abundances.shape[1]):
+			unifrac_output.add_row(dataset, str(col_index+1), unifracs[0, col_index], unifracs[1, col_index])
+		unifrac_written = unifrac_output.write()
+
+	with stage_timer.stage("report", rows=one.abundances.shape[1]):
+		for col_index in range(one.abundances.shape[1]):
+			print "Processing Sample %s" % str(col_index+1)
+			table = []
+			for ranking, clade in enumerate(clades):
+				sim = sims[ranking, col_index]
+				sim_n = sims_n[ranking]
+				table.append([clade,sim,sim_n,sim*sim_n,jaccards[ranking]])
+
+			print tabulate(table, headers=["Clade","Bray Curtis Abundance", "Bray Curtis OTU", "BC Ab * BC OTU", "Jaccard Similarity"], tablefmt="fancy_grid")
+
+			for i in range(4,7):
+				scores[table[i][0]].append(table[i][1])
+				print [dataset, str(col_index+1),table[i][0],table[i][1]]
+				output.add_row(dataset, str(col_index+1), table[i][0], table[i][1])
+	written = [output.write(), unifrac_written]
+	# with profiling on, the stage timings go next to the scores; any columnar copies come after the text files
+	return [files[0] for files in written] + [file for files in written for file in files[1:]] + filter(None, [stage_timer.write_report("profiling_"+dataset+"_braycurtis.tsv")])
+
+def bootstrap_tables(dataset, one, two, replicates, seed=0):
+	# writes the Bray-Curtis scores with bootstrap intervals to the working directory, and returns its name
+	if one.abundances.shape[1] != two.abundances.shape[1]:
+		sys.exit("Warning: the two tables have a different number of samples.")
+	clades = braycurtis.CLADES
+	positions, bounds = braycurtis.taxon_index([one, two], clades)
+	profile_one = braycurtis.rank_profiles(one, positions[0], bounds[-1])[0]
+	profile_two = braycurtis.rank_profiles(two, positions[1], bounds[-1])[0]
+	output=open("profiling_"+dataset+"_braycurtis_ci.tsv", 'wt')
+	output.write("\t".join(['dataset','sample','tax_ranking','braycurtis','lower','upper','replicates'])+"\n")
+	rows=[]
+	for ranking in range(4,7):
+		difference = np.abs(profile_one - profile_two)[bounds[ranking]:bounds[ranking+1]]
+		total = np.abs(profile_one + profile_two)[bounds[ranking]:bounds[ranking+1]]
+		# taxa with the same profiles in both tables are interchangeable
+		first, inverse, sizes = bootstrap.collapse(np.column_stack((difference, total)).view(np.int64))
+		data = (difference[first], total[first])
+		estimate = braycurtis.similarity_replicates(sizes[None].astype(float), *data)[0]
+		samples = bootstrap.replicate(braycurtis.similarity_replicates, sizes, data, replicates, seed=seed)
+		lower, upper = bootstrap.interval(samples)
+		for col_index in range(one.abundances.shape[1]):
+			rows.append((col_index, ranking, [estimate[col_index], lower[col_index], upper[col_index]]))
+	# the same order as the scores file: sample by sample
+	for col_index, ranking, values in sorted(rows):
+		output.write("\t".join([dataset, str(col_index+1), clades[ranking]] + [str(value) for value in values] + [str(replicates)])+"\n")
+	output.close()
+	return ["profiling_"+dataset+"_braycurtis_ci.tsv"]
+
+if __name__ == "__main__":
+	stage_timer.enable_from_argv()
+	replicates=bootstrap.replicates_from_argv()
+	result_format=result_writer.format_from_argv()
+	dataset=sys.argv[1]
+	one_in=sys.argv[2]
+	two_in=sys.argv[3]
+	result_writer.submission=os.path.basename(two_in)
+	cache=result_cache.open_cache("calculate_BC", [dataset, replicates, result_format], one_in, two_in, [sys.modules[__name__], lineage, braycurtis, bootstrap, table_loader, result_writer])
+	if cache and cache.restore() is not None:
+		print "Scores taken from the result cache."
+	else:
+		with stage_timer.stage("parse") as parse:
+			one=lineage.read_lineage_table(one_in)
+			two=lineage.read_lineage_table(two_in)
+			parse.rows=len(one)+len(two)
+		outputs=[]
+		if replicates:
+			with stage_timer.stage("bootstrap", rows=replicates):
+				outputs=bootstrap_tables(dataset, one, two, replicates)
+		outputs+=compare_tables(dataset, one, two)
+		if cache:
+			cache.store(outputs)
@@ -0,0 +1,61 @@
+#!/usr/env Python
+# calculate_BC_matrix.py
+# usage: calculate_BC_matrix.py dataset mode table [table ...]
+# Bray-Curtis and Jaccard similarity between many abundance tables in the standardized format.
+# mode "truth" compares every table after the first against the first one (the truth file);
+# mode "pairs" compares every table against every other table.
+# All tables are parsed once and profiled on one shared taxon index, so adding a table costs
+# one more row of comparisons instead of a separate calculate_BC.py run.
+# Weighted and unweighted UniFrac distances per sample, over the tree of the lineages, go to
+# profiling_<dataset>_unifrac_matrix.tsv, every pair from the same stacked profiles.
+
+import sys, os
+import lineage, braycurtis
+
+dataset=sys.argv[1]
+mode=sys.argv[2]
+infiles=sys.argv[3:]
+if mode not in ["truth", "pairs"]:
+	sys.exit('Mode "%s" is not valid, use "truth" or "pairs".' % mode)
+if len(infiles) < 2:
+	sys.exit("Warning: at least two tables are needed.")
+
+tables=[lineage.read_lineage_table(infile) for infile in infiles]
+if len(set(table.abundances.shape[1] for table in tables)) > 1:
+	sys.exit("Warning: the tables have a different number of samples.")
+names=[os.path.basename(infile) for infile in infiles]
+
+profiles, counts, bounds, nodes = braycurtis.stack_profiles(tables)
+if mode == "truth":
+	rows, columns = range(1, len(tables)), [0]
+	sims = braycurtis.pairwise_similarity(profiles[1:], bounds, others=profiles[:1])
+	sims_n = braycurtis.pairwise_similarity(counts[1:, :, None], bounds, others=counts[:1, :, None])
+	jaccards = braycurtis.pairwise_jaccard(counts[1:], bounds, others=counts[:1])
+	unifracs = braycurtis.pairwise_unifrac(profiles[1:], nodes, bounds, others=profiles[:1])
+else:
+	rows, columns = range(len(tables)), range(len(tables))
+	sims = braycurtis.pairwise_similarity(profiles, bounds)
+	sims_n = braycurtis.pairwise_similarity(counts[:, :, None], bounds)
+	jaccards = braycurtis.pairwise_jaccard(counts, bounds)
+	unifracs = braycurtis.pairwise_unifrac(profiles, nodes, bounds)
+
+lines=["\t".join(['dataset','sample','tax_ranking','table_one','table_two','braycurtis','braycurtis_otu','jaccard'])]
+for sample in range(profiles.shape[2]):
+	for ranking, clade in enumerate(braycurtis.CLADES):
+		for i, row in enumerate(rows):
+			for j, column in enumerate(columns):
+				lines.append("\t".join([dataset, str(sample+1), clade, names[row], names[column],
+					str(sims[i, j, ranking, sample]), str(sims_n[i, j, ranking, 0]), str(jaccards[i, j, ranking])]))
+output=open("profiling_"+dataset+"_braycurtis_matrix.tsv", 'wt')
+output.write("\n".join(lines) + "\n")
+output.close()
+
+lines=["\t".join(['dataset','sample','table_one','table_two','weighted_unifrac','unweighted_unifrac'])]
+for sample in range(profiles.shape[2]):
+	for i, row in enumerate(rows):
+		for j, column in enumerate(columns):
+			lines.append("\t".join([dataset, str(sample+1), names[row], names[column], str(unifracs[i, j, 0, sample]), str(unifracs[i, j, 1, sample])]))
+output=open("profiling_"+dataset+"_unifrac_matrix.tsv", 'wt')
+output.write("\n".join(lines) + "\n")
+output.close()
+print "Compared %d tables, %d taxa across %d ranks." % (len(tables), bounds[-1], len(bounds) - 1)
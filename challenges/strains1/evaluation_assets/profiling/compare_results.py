@@ -4,122 +4,200 @@
 # This script now sets defined thresholds for cutoff values, to increase overall speed and better allow comparisons between different submission results.
 
 # imports
-import sys, math
+import sys, os, math, shutil, tempfile
 import numpy as np
-from sklearn import metrics as skmetrics
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, os.pardir, "common"))
+import lineage, metric_kernels, stage_timer, bootstrap, external_sort, table_loader, result_cache, result_writer
 
-# starting files
-print "profiling input type should be ARGV1 (sim_low, sim_med, sim_high, or biological), truth file should be ARGV2, submission file should be ARGV3."
-truth_file = sys.argv[2]
-results_file = sys.argv[3]
+LEVELS = ["strain", "species", "genus"]
+PRC_COLUMNS = ["cutoff", "TP", "FN", "FP", "Precision", "Recall", "F1"]
+MAX_CHANGED = 0.5				# a resubmission with more of its rows changed than this is scored afresh
+ROW_HASH = np.random.RandomState(0).randint(1, 1 << 62, size=16).astype(np.int64) * 2 + 1		# odd multipliers, for delta_counts
 
 def read_answer_key(file):
-	truth_dictionary = {}
-	with open(file, 'r') as infile:
-		for line in infile:
-			line = line.strip().split("\t", 1)
-			truth_dictionary[line[0]] = map(float, line[1].split("\t"))
-	return truth_dictionary
-
-def read_submission(file):
-	submission_dictionary = {}
-	line_count = 0
-	with open(file, 'r') as infile:
-		for line in infile:
-			line_count += 1
-			line = line.strip().split("\t", 1)
-			entry_matrix = map(float, line[1].split("\t"))
-			# some sanity checking
-			if len(entry_matrix) != 4:
-				sys.exit("Warning: wrong number of columns in submission file.")
-			submission_dictionary[line[0]] = entry_matrix
-	return submission_dictionary
-
-def get_stats_strain(truth_dictionary, submission_dictionary, cutoff):
-	submission_strains = submission_dictionary.keys()
-	for entry in submission_strains:
-		if entry.rsplit(',',1)[1] == "0":
-			submission_strains.remove(entry)
-	truth_strain = truth_dictionary.keys()
-	for entry in truth_strain:
-		if entry.rsplit(',',1)[1] == "0":
-			truth_strain.remove(entry)
-	TP = 0
-	removed_count = 0
-	for tax_entry in submission_strains:
-		# thresholding
-		cut = True
-		for value in submission_dictionary[tax_entry]:
-			if value > cutoff:
-				cut = False
-		if cut == True:
-			removed_count += 1
-			continue						# skipping rows below cutoff
-		# if we've made it here, we're above the cutoff threshold
-		if tax_entry in truth_strain:
-			TP += 1
-	FP = len(submission_strains) - TP - removed_count 	# every strain called incorrectly in submission
-	FN = len(truth_strain) - TP 						# every strain missed in submission
+	return lineage.read_lineage_table(file, drop_duplicates=True)
+
+def read_submission(file, drop_duplicates=True):
+	# drop_duplicates=False keeps repeated lineages, for a caller that also wants the table as written
+	try:
+		submission_table = lineage.read_lineage_table(file, drop_duplicates)
+	except ValueError:
+		sys.exit("Warning: wrong number of columns in submission file.")
+	# some sanity checking
+	if len(submission_table) and submission_table.abundances.shape[1] != 4:
+		sys.exit("Warning: wrong number of columns in submission file.")
+	return submission_table
+
+def count_above(values, cutoffs):
+	# (columns, cutoffs): the number of values in each column of a (rows, columns) matrix strictly
+	# above each cutoff, from one histogram of how many of the (sorted) cutoffs each value is above
+	values = np.asarray(values, dtype=float)
+	cutoffs = np.asarray(cutoffs, dtype=float)
+	order = np.argsort(cutoffs, kind='mergesort')
+	size = len(cutoffs) + 1
+	bins = np.searchsorted(cutoffs[order], values, side='left') + np.arange(values.shape[1]) * size
+	histogram = np.bincount(bins.ravel(), minlength=values.shape[1] * size).reshape(values.shape[1], size)
+	above = np.zeros((values.shape[1], len(cutoffs)), dtype=np.int64)
+	above[:, order] = histogram[:, ::-1].cumsum(axis=1)[:, ::-1][:, 1:]
+	return above
+
+def sample_columns(truth_table, submission_table, per_sample=False):
+	# the columns everything is counted over: each sample's abundances (if per_sample, and the truth
+	# has as many samples), then every entry's largest abundance, pooling the samples. Returns the
+	# submission's values in them, and which truth entries are present in each (a nonzero abundance
+	# in that sample; every truth entry counts in the pooled column, as it always has).
+	maxima = submission_table.abundances.max(axis=1)
+	if per_sample and truth_table.abundances.shape[1] == submission_table.abundances.shape[1]:
+		values = np.column_stack((submission_table.abundances, maxima))
+		present = np.column_stack((truth_table.abundances > 0, np.ones(len(truth_table), dtype=bool)))
+		return values, present
+	return maxima[:, None], np.ones((len(truth_table), 1), dtype=bool)
+
+def get_stats_strain(truth_table, submission_table, cutoffs, values, present):
+	# entries without a strain call are left out at this level
+	called = submission_table.column("strain") != 0
+	truth_called = truth_table.column("strain") != 0
+	# an entry survives a cutoff if its value is above it; it is a true positive in the columns the truth has it in
+	values = values[called]
+	present = present[truth_called]
+	match = lineage.row_index(submission_table.taxids[called], truth_table.taxids[truth_called])
+	in_truth = np.zeros(values.shape, dtype=bool)
+	in_truth[match >= 0] = present[match[match >= 0]]
+	kept = count_above(values, cutoffs)
+	TP = count_above(np.where(in_truth, values, -np.inf), cutoffs)
+	FP = kept - TP 						# every strain called incorrectly in submission
+	FN = present.sum(axis=0)[:, None] - TP 		# every strain missed in submission
 	return TP, FP, FN
 
-def get_stats_species(truth_dictionary, submission_dictionary, cutoff):
-	# thresholding
-	filtered_list = []
-	removed_count = 0
-	truth_removed_count = 0
-	for tax_entry in submission_dictionary.keys():
-		cut = True
-		for value in submission_dictionary[tax_entry]:
-			if value > cutoff:
-				cut = False
-		if cut == True:
-			removed_count += 1
-			filtered_list.append(tax_entry.rsplit(',',1)[0])	# this removes the last entry (strain)
-		# removing entries with no species info
-		elif tax_entry.rsplit(',',1)[1] == "0":
-			removed_count += 1
-			filtered_list.append(tax_entry.rsplit(',',1)[0])
-	# now with the thresholded entries:
-	submission_species = set(entry.rsplit(',',1)[0] for entry in submission_dictionary.keys())
-	truth_species = set(entry.rsplit(',',1)[0] for entry in truth_dictionary.keys())
-	for entry in set(truth_species):
-		if entry.rsplit(',',1)[1] == "0":
-			truth_removed_count += 1
-	TP = 0
-	for tax_entry in submission_species:
-		if tax_entry not in filtered_list and tax_entry in truth_species:
-			TP += 1
-	FP = len(submission_species) - TP - removed_count 		# every strain called incorrectly in submission
-	if FP < 0:
-		FP = 0
-	FN = len(truth_species) - TP - truth_removed_count			# every strain missed in submission
+def get_stats_grouped(truth_table, submission_table, level, cutoffs, values, present, strain_required=False):
+	# a group (species or genus) is only counted as called if none of its entries are cut, so it
+	# survives exactly the cutoffs below the smallest value among its entries.
+	# removed_count keeps counting entries rather than groups, as it always has, so FP can come out
+	# below zero here; get_stats clamps it once the counts are complete.
+	# The truth and submission groups are collapsed together, so each group is known by one index in
+	# both; returns TP and FP, the groups, and which of them the truth has in each column.
+	entry_values = values
+	if strain_required:
+		entry_values = np.where((submission_table.column("strain") == 0)[:, None], -np.inf, values)		# entries with no strain info are always removed
+	groups, inverse = lineage.unique_rows(np.vstack((truth_table.prefix(level), submission_table.prefix(level))))
+	truth_inverse, entry_inverse = inverse[:len(truth_table)], inverse[len(truth_table):]
+	called = np.bincount(entry_inverse, minlength=len(groups)) > 0
+	group_values = lineage.group_min(entry_values, entry_inverse, len(groups))
+	truth_present = lineage.group_max(present, truth_inverse, len(groups)) > 0
+	removed_count = len(entry_values) - count_above(entry_values, cutoffs)
+	TP = count_above(np.where(truth_present & called[:, None], group_values, -np.inf), cutoffs)
+	FP = np.count_nonzero(called) - TP - removed_count 		# every group called incorrectly in submission
+	return TP, FP, groups, truth_present
+
+def get_stats_species(truth_table, submission_table, cutoffs, values, present):
+	TP, FP, species, truth_present = get_stats_grouped(truth_table, submission_table, "species", cutoffs, values, present, strain_required=True)
+	truth_removed_count = np.count_nonzero(truth_present & (species[:, -1] == 0)[:, None], axis=0)
+	FN = (np.count_nonzero(truth_present, axis=0) - truth_removed_count)[:, None] - TP			# every species missed in submission
 	return TP, FP, FN
 
-def get_stats_genus(truth_dictionary, submission_dictionary, cutoff):
-	# thresholding
-	filtered_list = []
-	removed_count = 0
-	for tax_entry in submission_dictionary.keys():
-		cut = True
-		for value in submission_dictionary[tax_entry]:
-			if value > cutoff:
-				cut = False
-		if cut == True:
-			removed_count += 1
-			filtered_list.append(tax_entry.rsplit(',',2)[0])	# removes the last two entries (species & strain)
-	# now with the thresholded entries:
-	submission_genus = set(entry.rsplit(',',2)[0] for entry in submission_dictionary.keys())
-	truth_genus = set(entry.rsplit(',',2)[0] for entry in truth_dictionary.keys())
-	TP = 0
-	for tax_entry in submission_genus:
-		if tax_entry not in filtered_list and tax_entry in truth_genus:
-			TP += 1
-	FP = len(submission_genus) - TP - removed_count 		# every strain called incorrectly in submission
-	if FP < 0:
-		FP = 0
-	FN = len(truth_genus) - TP 			# every strain missed in submission
+def get_stats_genus(truth_table, submission_table, cutoffs, values, present):
+	TP, FP, genus, truth_present = get_stats_grouped(truth_table, submission_table, "genus", cutoffs, values, present)
+	FN = np.count_nonzero(truth_present, axis=0)[:, None] - TP 			# every genus missed in submission
 	return TP, FP, FN
 
+def level_counts(truth_table, submission_table, level, cutoffs, per_sample=False):
+	# (3, columns, cutoffs) TP, FP and FN over sample_columns' columns, before FP is clamped at zero:
+	# these add up over tables split by genus
+	values, present = sample_columns(truth_table, submission_table, per_sample)
+	if level == "strain":
+		counts = get_stats_strain(truth_table, submission_table, cutoffs, values, present)
+	elif level == "species":
+		counts = get_stats_species(truth_table, submission_table, cutoffs, values, present)
+	elif level == "genus":
+		counts = get_stats_genus(truth_table, submission_table, cutoffs, values, present)
+	else:
+		sys.exit("Level not properly provided.")
+	return np.array(counts, dtype=np.int64)
+
+def level_stats(truth_table, submission_table, level, cutoffs):
+	# TP, FP and FN with the samples pooled, before FP is clamped at zero
+	return tuple(level_counts(truth_table, submission_table, level, cutoffs)[:, 0])
+
+def get_stats(truth_table, submission_table, level, cutoffs):
+	TP, FP, FN = level_stats(truth_table, submission_table, level, cutoffs)
+	return TP, np.maximum(FP, 0), FN
+
+def table_counts(truth_table, submission_table, cutoffs):
+	# level_stats for every level, as a (levels, 3, cutoffs) array
+	return np.array([level_stats(truth_table, submission_table, level, cutoffs) for level in LEVELS], dtype=np.int64).reshape(len(LEVELS), 3, len(cutoffs))
+
+def sample_counts(truth_table, submission_table, cutoffs):
+	# the TP, FP and FN counts of every level, for each sample and then pooled, as one
+	# (levels, 3, samples + 1, cutoffs) array (just the pooled column if the truth's samples don't match)
+	return np.array([level_counts(truth_table, submission_table, level, cutoffs, per_sample=True) for level in LEVELS])
+
+def counted_stats(counts, cutoffs):
+	# a function to use in get_stats' place, from table_counts-style counts at the given cutoffs
+	# (it only answers for those)
+	def stats(truth_table, submission_table, level, wanted):
+		index = [cutoffs.index(cutoff) for cutoff in wanted]
+		TP, FP, FN = counts[LEVELS.index(level)][:, index]
+		return TP, np.maximum(FP, 0), FN
+	return stats
+
+def streamed_stats(truth_file, submission_file, cutoffs, budget_mb):
+	# the counts get_stats gives at the given cutoffs, for every level, from one merged pass over the
+	# two files sorted out of core (see external_sort.py). Returns a function to use in get_stats'
+	# place, answering for those cutoffs only, and the number of submission rows read.
+	counts = np.zeros((len(LEVELS), 3, len(cutoffs)), dtype=np.int64)
+	submission_rows = 0
+	temp_dir = tempfile.mkdtemp(prefix="compare_results_")
+	try:
+		truth_runs = external_sort.sort_runs(truth_file, temp_dir, budget_mb)
+		try:
+			submission_runs = external_sort.sort_runs(submission_file, temp_dir, budget_mb, columns=4)
+		except ValueError:
+			sys.exit("Warning: wrong number of columns in submission file.")
+		for truth_block, submission_block in external_sort.joined_blocks(truth_runs, submission_runs, budget_mb):
+			submission_rows += len(submission_block)
+			counts += table_counts(truth_block, submission_block, cutoffs)
+	finally:
+		shutil.rmtree(temp_dir)
+	return counted_stats(counts, cutoffs), submission_rows
+
+def genus_rows(table, genera):
+	# the rows of a table in any of the given genera (as kingdom..genus lineages); the genus taxids
+	# narrow it down first, so only those rows are compared whole
+	rows = np.flatnonzero(np.in1d(table.column("genus"), genera[:, -1]))
+	rows = rows[lineage.isin_rows(table.prefix("genus")[rows], genera)]
+	return lineage.LineageTable(table.taxids[rows], table.abundances[rows])
+
+def delta_counts(previous, truth_table, submission_table, cutoffs):
+	# sample_counts for a resubmission, from those of an earlier submission under the same name (see
+	# score_cached): only the genera with a row added, dropped or changed are counted again, before
+	# and after, as level_counts adds up over tables split by genus. None if too much has changed
+	# (or the earlier counts were kept in another form).
+	header, arrays = previous
+	old_values = np.asarray(arrays["values"])
+	if header.get("cutoffs") != list(cutoffs) or np.ndim(arrays["counts"]) != 4 or old_values.shape[1:] != submission_table.abundances.shape[1:]:
+		return None
+	old_table = lineage.LineageTable(np.asarray(arrays["taxids"]), old_values)
+	# rows are compared whole (lineage, and the bits of the abundances), with the two tables sorted
+	# together by a hash of the row: a lineage is only in each table once, so an unchanged row sits
+	# next to its copy. (Rows that happen to share a hash can come apart; they are just counted again.)
+	rows = np.vstack([np.column_stack((table.taxids.astype(np.int64), np.ascontiguousarray(table.abundances, dtype=np.float64).view(np.int64)))
+		for table in (old_table, submission_table)])
+	rows = rows[np.argsort((rows * ROW_HASH[:rows.shape[1]]).sum(axis=1))]
+	same = np.all(rows[1:] == rows[:-1], axis=1)
+	unchanged = np.concatenate(([False], same)) | np.concatenate((same, [False]))
+	changed = rows[~unchanged]
+	if len(changed) > MAX_CHANGED * max(len(submission_table), 1):
+		return None
+	genera = lineage.unique_rows(changed[:, :lineage.RANKS.index("genus") + 1])[0]
+	truth_part = genus_rows(truth_table, genera)
+	before = sample_counts(truth_part, genus_rows(old_table, genera), cutoffs)
+	after = sample_counts(truth_part, genus_rows(submission_table, genera), cutoffs)
+	return np.asarray(arrays["counts"]) - before + after
+
+def stats_at(counts, index):
+	# the (TP, FP, FN) tuple at one cutoff
+	return tuple(int(count[index]) for count in counts)
+
 def compute_metrics(metrics_list):
 	TP = float(metrics_list[0])			# true positives
 	FP = float(metrics_list[1])			# false positive - in submission but NOT in truth file
@@ -136,7 +214,16 @@ def compute_metrics(metrics_list):
 	misclass=(FP+FN)/(TP+FP+FN)
 	return precision, recall, F1_score
 
-def iterate_loop(submission_dictionary, truth_dictionary, level, iter_outfile):
+def curve_metrics(TP, FP, FN):
+	# precision, recall and F1 of count arrays, as compute_metrics works them out one cutoff at a time
+	TP, FP, FN = [np.asarray(count, dtype=float) for count in (TP, FP, FN)]
+	with np.errstate(divide='ignore', invalid='ignore'):
+		precision = np.where(TP + FP > 0, TP / (TP + FP), 1.0)
+		recall = TP / (TP + FN)
+		F1 = np.where(precision + recall > 0, 2 * (precision * recall) / (precision + recall), 0.0)
+	return precision, recall, F1
+
+def iterate_cutoffs():
 	# set up all the different confidence thresholds
 	iterate_values = []
 	iterate_starting_values = [0.000001, 0.000002, 0.000003, 0.000004, 0.000005, 0.000006, 0.000007, 0.000008, 0.000009]
@@ -147,36 +234,23 @@ def iterate_loop(submission_dictionary, truth_dictionary, level, iter_outfile):
 		iterate_values.append(val*1000.0)
 		iterate_values.append(val*10000.0)
 		iterate_values.append(val*100000.0)
-	iterate_values = sorted(iterate_values, key=float)
+	return sorted(iterate_values, key=float)
+
+def iterate_loop(submission_table, truth_table, level, iter_table, stats=get_stats):
+	# adds the curve to iter_table, a result_writer.ResultTable of PRC_COLUMNS
+	iterate_values = iterate_cutoffs()
 	precision_list = []
 	recall_list = []
 	max_f1_score = 0							# used for tracking the highest F1 score and cutoff to get that score
 	max_f1_cutoff = 0
-	iter_outfile.write("cutoff\tTP\tFN\tFP\tPrecision\tRecall\tF1\n")
-	for val in iterate_values:
-		if level == "strain":
-			stats = get_stats_strain(truth_dictionary, submission_dictionary, val)
-			if stats[0] == 0:			# no more true positives
-				break
-			iter_outfile.write(str(val) + "\t" + str(stats[0]) + "\t" + str(stats[2]) + "\t" + str(stats[1]) + "\t")
-			metrics = compute_metrics(stats)
-			iter_outfile.write(str(metrics[0]) + "\t" + str(metrics[1]) + "\t" + str(metrics[2]) + "\n")
-		elif level == "species":
-			stats = get_stats_species(truth_dictionary, submission_dictionary, val)
-			if stats[0] == 0:			# no more true positives
-				break
-			iter_outfile.write(str(val) + "\t" + str(stats[0]) + "\t" + str(stats[2]) + "\t" + str(stats[1]) + "\t")
-			metrics = compute_metrics(stats)
-			iter_outfile.write(str(metrics[0]) + "\t" + str(metrics[1]) + "\t" + str(metrics[2]) + "\n")
-		elif level == "genus":
-			stats = get_stats_genus(truth_dictionary, submission_dictionary, val)
-			if stats[0] == 0:			# no more true positives
-				break
-			iter_outfile.write(str(val) + "\t" + str(stats[0]) + "\t" + str(stats[2]) + "\t" + str(stats[1]) + "\t")
-			metrics = compute_metrics(stats)
-			iter_outfile.write(str(metrics[0]) + "\t" + str(metrics[1]) + "\t" + str(metrics[2]) + "\n")
-		else:
-			print "Level not properly provided."
+	# all cutoffs are scored from one sorted pass over the submission
+	counts = stats(truth_table, submission_table, level, iterate_values)
+	for index, val in enumerate(iterate_values):
+		stats = stats_at(counts, index)
+		if stats[0] == 0:			# no more true positives
+			break
+		metrics = compute_metrics(stats)
+		iter_table.add_row(val, stats[0], stats[2], stats[1], metrics[0], metrics[1], metrics[2])
 		if metrics[0] > 0.0:
 			precision_list.append(metrics[0])
 			recall_list.append(metrics[1])
@@ -184,56 +258,283 @@ def iterate_loop(submission_dictionary, truth_dictionary, level, iter_outfile):
 		if metrics[2] > max_f1_score:
 			max_f1_score = metrics[2]
 			max_f1_cutoff = val
-	auprc = skmetrics.auc(recall_list, precision_list)		# area under precision/recall curve
+	auprc = metric_kernels.auc(recall_list, precision_list)		# area under precision/recall curve
 	return max_f1_score, max_f1_cutoff, auprc
 
-# reading in the input files
-truth_dic = read_answer_key(truth_file)
-submission_dic = read_submission(results_file)
-dataset = sys.argv[1]
-
-# creating the precision-recall curve results for STRAIN at each cutoff threshold
-strains_outfile = open("profiling_" + dataset + "_PRC_strain.tsv", 'w')
-strains_iteration = iterate_loop(submission_dic, truth_dic, "strain", strains_outfile)
-strains_outfile.close()
-
-# creating the precision-recall curve results for SPECIES at each cutoff threshold
-species_outfile = open("profiling_" + dataset + "_PRC_species.tsv", 'w')
-species_iteration = iterate_loop(submission_dic, truth_dic, "species", species_outfile)
-species_outfile.close()
-
-# creating the precision-recall curve results for GENUS at each cutoff threshold
-genus_outfile = open("profiling_" + dataset + "_PRC_genus.tsv", 'w')
-genus_iteration = iterate_loop(submission_dic, truth_dic, "genus", genus_outfile)
-genus_outfile.close()
-
-# writing the final scores outfile
-score_outfile = open("profiling_" + dataset + "_scores.tsv", "w")
-headers = ["tax_ranking", "dataset", "TP", "FN", "FP", "Precision", "Recall", "F1", "improved_F1", "cutoff", "AUC"]
-score_outfile.write("\t".join(headers) + "\nstrain\t" + dataset + "\t")
-# writing the row for strains...
-strain_stats = get_stats_strain(truth_dic, submission_dic, 0)
-score_outfile.write(str(strain_stats[0])+"\t"+str(strain_stats[2])+"\t"+str(strain_stats[1]) + "\t")				# TP, FN, FP
-print strain_stats
-strain_metrics = compute_metrics(strain_stats)
-score_outfile.write("\t".join(str(x) for x in strain_metrics) + "\t")			# precision, recall, F1
-score_outfile.write("\t".join(str(x) for x in strains_iteration) + "\n")		# improved_F1, cutoff, AUC
-# ...for species...
-score_outfile.write("species\t" + dataset + "\t")
-species_stats = get_stats_species(truth_dic, submission_dic, 0)
-score_outfile.write(str(species_stats[0])+"\t"+str(species_stats[2])+"\t"+str(species_stats[1]) + "\t")				# TP, FN, FP
-print species_stats
-species_metrics = compute_metrics(species_stats)
-score_outfile.write("\t".join(str(x) for x in species_metrics) + "\t")			# precision, recall, F1
-score_outfile.write("\t".join(str(x) for x in species_iteration) + "\n")		# improved_F1, cutoff, AUC
-# ...and for genus...
-score_outfile.write("genus\t" + dataset + "\t")
-genus_stats = get_stats_genus(truth_dic, submission_dic, 0)
-score_outfile.write(str(genus_stats[0])+"\t"+str(genus_stats[2])+"\t"+str(genus_stats[1]) + "\t")				# TP, FN, FP
-print genus_stats
-genus_metrics = compute_metrics(genus_stats)
-score_outfile.write("\t".join(str(x) for x in genus_metrics) + "\t")			# precision, recall, F1
-score_outfile.write("\t".join(str(x) for x in genus_iteration) + "\n")		# improved_F1, cutoff, AUC
-score_outfile.close()
-
-print "Run successful."		# success!
+def exact_loop(submission_table, truth_table, level, iter_table, stats=get_stats):
+	# every distinct abundance in the submission is its own cutoff, so the curve is exact rather than sampled
+	iterate_values = np.unique(np.concatenate(([0.0], submission_table.abundances.max(axis=1))))
+	counts = stats(truth_table, submission_table, level, iterate_values)
+	TP, FP, FN = [np.asarray(count, dtype=float) for count in counts]
+	# we stop at the first cutoff with no more true positives, as iterate_loop does
+	stop = np.flatnonzero(TP == 0)
+	if len(stop):
+		iterate_values, TP, FP, FN = iterate_values[:stop[0]], TP[:stop[0]], FP[:stop[0]], FN[:stop[0]]
+	precision, recall, F1 = curve_metrics(TP, FP, FN)
+	iter_table.add_columns(iterate_values, TP.astype(np.int64), FN.astype(np.int64), FP.astype(np.int64), precision, recall, F1)
+	max_f1_score = 0
+	max_f1_cutoff = 0
+	if len(F1) and F1.max() > 0:
+		max_f1_score = float(F1.max())
+		max_f1_cutoff = float(iterate_values[np.argmax(F1)])
+	positive = precision > 0.0
+	auprc = metric_kernels.auc(recall[positive], precision[positive]) if np.count_nonzero(positive) > 1 else 0.0
+	return max_f1_score, max_f1_cutoff, auprc, metric_kernels.average_precision(precision, recall)
+
+def sample_curves(dataset, counts, cutoffs):
+	# writes the precision-recall curve and the scores of every level and sample from sample_counts'
+	# counts at cutoffs (0 first, where the scores are taken, then the sweep), and returns the files
+	# written for each (see result_writer.py). Each curve stops where the true positives run out, as iterate_loop's do; AUC is NaN for
+	# a curve of fewer than 2 points. The pooled column is left out: that is the usual files' job.
+	samples = counts.shape[2] - 1
+	TP, FP, FN = [count[:, :samples].reshape(-1, len(cutoffs)) for count in np.rollaxis(counts, 1)]
+	FP = np.maximum(FP, 0)
+	precision, recall, F1 = curve_metrics(TP, FP, FN)
+	scores = curve_scores(TP.astype(float), FP.astype(float), FN.astype(float), 1)
+	on_curve = np.cumprod(TP[:, 1:] > 0, axis=1).astype(bool)
+	# the cutoff with the best F1 (the first, if tied), or 0 if there isn't one
+	best = np.where(on_curve, F1[:, 1:], 0.0)
+	best_cutoff = [cutoffs[index + 1] if score > 0 else 0 for index, score in zip(np.argmax(best, axis=1).tolist(), best.max(axis=1).tolist())]
+	labels = [(level, str(sample + 1)) for level in LEVELS for sample in range(samples)]
+	prc_table = result_writer.ResultTable("profiling_" + dataset + "_PRC_samples.tsv", ["tax_ranking", "sample"] + PRC_COLUMNS,
+		keys={"rank": "tax_ranking", "sample": "sample", "cutoff": "cutoff"}, fixed={"dataset": dataset})
+	for curve, (level, sample) in enumerate(labels):
+		points = np.flatnonzero(on_curve[curve]) + 1
+		prc_table.add_columns([level] * len(points), [sample] * len(points), np.asarray(cutoffs)[points], TP[curve, points], FN[curve, points], FP[curve, points],
+			precision[curve, points], recall[curve, points], F1[curve, points])
+	score_table = result_writer.ResultTable("profiling_" + dataset + "_sample_scores.tsv", ["tax_ranking", "dataset", "sample", "TP", "FN", "FP", "Precision", "Recall", "F1", "improved_F1", "cutoff", "AUC"],
+		keys={"rank": "tax_ranking", "dataset": "dataset", "sample": "sample"})
+	for curve, (level, sample) in enumerate(labels):
+		score_table.add_row(*[level, dataset, sample] + [int(count[curve, 0]) for count in (TP, FN, FP)] + scores[curve].tolist()[:4] + [best_cutoff[curve], scores[curve].tolist()[4]])
+	return [prc_table.write(), score_table.write()]
+
+def score_submission(dataset, truth_tab, submission_tab, exact_mode=False, stats=None, submission_rows=None, counts=None):
+	# writes the PRC and scores files for one submission to the working directory, pooled and per
+	# sample, and returns their names. The counts come from sample_counts at [0] + iterate_cutoffs()
+	# (worked out here unless given), or from stats standing in for get_stats, e.g. with counts
+	# worked out by streamed_stats (the tables are then None, and only the pooled files are written).
+	prc_loop = exact_loop if exact_mode else iterate_loop
+	if submission_rows is None:
+		submission_rows = len(submission_tab)
+	cutoffs = [0] + iterate_cutoffs()
+	if stats is None:
+		if counts is None:
+			with stage_timer.stage("counts", rows=submission_rows):
+				counts = sample_counts(truth_tab, submission_tab, cutoffs)
+		# exact mode sweeps its own cutoffs
+		stats = get_stats if exact_mode else counted_stats(counts[:, :, -1], cutoffs)
+
+	# creating the precision-recall curve results for each level at each cutoff threshold
+	written = []
+	iterations = []
+	for level in LEVELS:
+		with stage_timer.stage("sweep:" + level, rows=submission_rows):
+			prc_table = result_writer.ResultTable("profiling_" + dataset + "_PRC_" + level + ".tsv", PRC_COLUMNS,
+				keys={"cutoff": "cutoff"}, fixed={"dataset": dataset, "rank": level, "sample": "all"})
+			iterations.append(prc_loop(submission_tab, truth_tab, level, prc_table, stats))
+			written.append(prc_table.write())
+
+	# writing the final scores outfile
+	headers = ["tax_ranking", "dataset", "TP", "FN", "FP", "Precision", "Recall", "F1", "improved_F1", "cutoff", "AUC"]
+	if exact_mode:
+		headers.append("average_precision")
+	score_table = result_writer.ResultTable("profiling_" + dataset + "_scores.tsv", headers, keys={"rank": "tax_ranking", "dataset": "dataset"}, fixed={"sample": "all"})
+	# a row for strains, species and genus
+	for level, iteration in zip(LEVELS, iterations):
+		cutoff_stats = stats_at(stats(truth_tab, submission_tab, level, [0]), 0)
+		print cutoff_stats
+		# TP, FN, FP, then precision, recall, F1, then improved_F1, cutoff, AUC (and average precision)
+		score_table.add_row(*[level, dataset, cutoff_stats[0], cutoff_stats[2], cutoff_stats[1]] + list(compute_metrics(cutoff_stats)) + list(iteration))
+	written.append(score_table.write())
+	if counts is not None:
+		with stage_timer.stage("sweep:samples", rows=submission_rows):
+			written += sample_curves(dataset, counts, cutoffs)
+	# the text files come first (the PRC files, then the scores), then any columnar copies of them
+	outputs = [files[0] for files in written] + [file for files in written for file in files[1:]]
+	# with profiling on, the stage timings go next to the scores
+	return outputs + filter(None, [stage_timer.write_report(outputs[3])])
+
+def score_cached(cache, dataset, truth_tab, submission_tab, exact_mode=False, outputs=()):
+	# score_submission, keeping its files (and any others already written, e.g. the bootstrap
+	# intervals) in the result cache. Outside exact mode the submission's rows and counts are kept
+	# too, and a resubmission under the name of one already cached is counted from the rows that
+	# changed since (see delta_counts).
+	if exact_mode:
+		outputs = list(outputs) + score_submission(dataset, truth_tab, submission_tab, exact_mode)
+		cache.store(outputs)
+		return outputs
+	cutoffs = [0] + iterate_cutoffs()
+	with stage_timer.stage("counts", rows=len(submission_tab)):
+		previous = cache.previous()
+		counts = delta_counts(previous, truth_tab, submission_tab, cutoffs) if previous else None
+		if counts is None:
+			counts = sample_counts(truth_tab, submission_tab, cutoffs)
+		else:
+			print "Counted from the rows changed since the last submission of " + cache.submission
+	outputs = list(outputs) + score_submission(dataset, truth_tab, submission_tab, counts=counts)
+	cache.store(outputs, [("taxids", submission_tab.taxids), ("values", submission_tab.abundances), ("counts", counts)], {"cutoffs": cutoffs})
+	return outputs
+
+# Bootstrap: every distinct strain (or species, or genus) called in the submission or present in the
+# truth is a unit, and the TP/FP/FN counts at each cutoff are weighted sums over the units resampled
+# (see challenges/common/bootstrap.py). With every weight at 1 they are exactly get_stats' counts.
+
+def bootstrap_units(truth_table, submission_table, level, cutoffs):
+	# returns (category sizes, data) for confusion_replicates. A unit's bin is the number of cutoffs
+	# it is above; units only in the truth are above none.
+	if level == "strain":
+		called = submission_table.column("strain") != 0
+		values = submission_table.abundances[called].max(axis=1)
+		in_truth = lineage.isin_rows(submission_table.taxids[called], truth_table.taxids[truth_table.column("strain") != 0])
+		truth_only = np.count_nonzero(truth_table.column("strain") != 0) - np.count_nonzero(in_truth)
+		units = len(values) + truth_only
+		bins = np.concatenate((np.searchsorted(cutoffs, values, side='left'), np.zeros(truth_only, dtype=np.int64)))
+		true_units = np.concatenate((in_truth, np.zeros(truth_only, dtype=bool)))
+		false_units = np.concatenate((~in_truth, np.zeros(truth_only, dtype=bool)))
+		submitted = np.zeros(units, dtype=bool)
+		counted = np.concatenate((in_truth, np.ones(truth_only, dtype=bool)))
+		entry_units = entry_bins = np.zeros(0, dtype=np.int64)
+		profiles = np.zeros(units, dtype=np.int64)
+	else:
+		# species and genus, following get_stats_grouped: a group's value is the smallest max value
+		# among its entries, and the entries (not groups) removed at a cutoff come off the false positives
+		entry_values = submission_table.abundances.max(axis=1)
+		if level == "species":
+			entry_values[submission_table.column("strain") == 0] = -np.inf
+		groups, entry_units = submission_table.collapse(level)
+		truth_groups = truth_table.collapse(level)[0]
+		truth_only = truth_groups[~lineage.isin_rows(truth_groups, groups)]
+		units = len(groups) + len(truth_only)
+		entry_bins = np.searchsorted(cutoffs, entry_values, side='left')
+		# entries sorted by group and then bin: each group's first entry has the group's bin
+		order = np.lexsort((entry_bins, entry_units))
+		bounds = np.searchsorted(entry_units[order], np.arange(len(groups) + 1))
+		bins = np.concatenate((entry_bins[order][bounds[:-1]], np.zeros(len(truth_only), dtype=np.int64)))
+		true_units = np.concatenate((lineage.isin_rows(groups, truth_groups), np.zeros(len(truth_only), dtype=bool)))
+		false_units = np.zeros(units, dtype=bool)
+		submitted = np.arange(units) < len(groups)
+		counted = true_units | ~submitted
+		if level == "species":
+			# truth species without a species taxid are never counted as missed
+			counted &= np.concatenate((groups[:, -1] != 0, truth_only[:, -1] != 0))
+		# groups with the same entry bins take off the same false positives at every cutoff
+		bounds = bounds.tolist()
+		sorted_bins = entry_bins[order].tolist()
+		seen = {}
+		profiles = np.array([seen.setdefault(tuple(sorted_bins[bounds[group]:bounds[group + 1]]), len(seen)) for group in range(len(groups))] + [-1] * len(truth_only), dtype=np.int64)
+
+	# units that add the same to every count are interchangeable, so each category is resampled as one
+	first, inverse, sizes = bootstrap.collapse(np.column_stack((bins, true_units, false_units, submitted, counted, profiles)) if units else np.zeros((0, 6)))
+	representative = np.zeros(units, dtype=bool)
+	representative[first] = True
+	kept_entries = representative[entry_units]
+	category_entries = inverse[entry_units[kept_entries]]
+	bins, true_units, false_units, submitted, counted = bins[first], true_units[first], false_units[first], submitted[first], counted[first]
+	true_categories = np.flatnonzero(true_units)
+	false_categories = np.flatnonzero(false_units)
+	return sizes, (len(cutoffs) + 1, true_categories, bins[true_categories], false_categories, bins[false_categories],
+		np.flatnonzero(submitted) if level != "strain" else None, category_entries, entry_bins[kept_entries], np.flatnonzero(counted))
+
+def confusion_replicates(weights, size, tp_categories, tp_bins, fp_categories, fp_bins, submitted, entry_categories, entry_bins, truth_categories):
+	# (replicates, 3, cutoffs) TP, FP and FN counts at every cutoff, for each replicate's weights
+	TP = bootstrap.count_above(weights, tp_categories, tp_bins, size)
+	if submitted is None:
+		FP = bootstrap.count_above(weights, fp_categories, fp_bins, size)
+	else:
+		removed = bootstrap.bin_sums(weights, entry_categories, entry_bins, size).cumsum(axis=1)[:, :-1]
+		FP = np.maximum(weights[:, submitted].sum(axis=1)[:, None] - TP - removed, 0)
+	FN = weights[:, truth_categories].sum(axis=1)[:, None] - TP
+	return np.stack((TP, FP, FN), axis=1)
+
+def curve_scores(TP, FP, FN, sweep_start):
+	# (replicates, 5): precision, recall and F1 at the first cutoff (0), then the best F1 and the
+	# AUPRC over the cutoffs from sweep_start on, stopping where the true positives run out as
+	# iterate_loop and exact_loop do (NaN where the curve has fewer than 2 points)
+	precision, recall, F1 = curve_metrics(TP, FP, FN)
+	on_curve = np.cumprod(TP[:, sweep_start:] > 0, axis=1).astype(bool)
+	precision, recall, F1 = precision[:, sweep_start:], recall[:, sweep_start:], F1[:, sweep_start:]
+	improved_F1 = np.where(on_curve, F1, 0.0).max(axis=1)
+	# recall only goes down as the cutoff goes up, so each step adds (r_k - r_k+1) * (p_k + p_k+1) / 2
+	steps = (recall[:, :-1] - recall[:, 1:]) * (precision[:, :-1] + precision[:, 1:]) / 2
+	auprc = np.where(on_curve[:, 1:], steps, 0.0).sum(axis=1)
+	auprc[on_curve.sum(axis=1) < 2] = np.nan
+	first_precision, first_recall, first_F1 = curve_metrics(TP[:, 0], FP[:, 0], FN[:, 0])
+	return np.stack((first_precision, first_recall, first_F1, improved_F1, auprc), axis=1)
+
+def score_replicates(weights, sweep_start, *data):
+	counts = confusion_replicates(weights, *data)
+	return curve_scores(counts[:, 0], counts[:, 1], counts[:, 2], sweep_start)
+
+def bootstrap_scores(dataset, truth_tab, submission_tab, replicates, exact_mode=False, seed=0):
+	# writes the scores with bootstrap intervals to the working directory, and returns its name
+	ci_outfile = open("profiling_" + dataset + "_scores_ci.tsv", "w")
+	ci_outfile.write("tax_ranking\tdataset\tmetric\testimate\tlower\tupper\treplicates\n")
+	for level in ["strain", "species", "genus"]:
+		# the first cutoff is 0, where the scores are taken; the curve is the usual sweep (which
+		# already starts at 0 in exact mode)
+		if exact_mode:
+			cutoffs, sweep_start = np.unique(np.concatenate(([0.0], submission_tab.abundances.max(axis=1)))), 0
+		else:
+			cutoffs, sweep_start = np.array([0.0] + iterate_cutoffs()), 1
+		sizes, data = bootstrap_units(truth_tab, submission_tab, level, cutoffs)
+		estimate = score_replicates(sizes[None].astype(float), sweep_start, *data)[0]
+		samples = bootstrap.replicate(score_replicates, sizes, (sweep_start,) + data, replicates, entries=max(len(data[6]), 8 * len(cutoffs)), seed=seed)
+		lower, upper = bootstrap.interval(samples)
+		for metric, values in zip(["Precision", "Recall", "F1", "improved_F1", "AUC"], zip(estimate, lower, upper)):
+			ci_outfile.write("\t".join([level, dataset, metric] + [str(value) for value in values] + [str(replicates)]) + "\n")
+	ci_outfile.close()
+	return ["profiling_" + dataset + "_scores_ci.tsv"]
+
+if __name__ == "__main__":
+	# starting files
+	print "profiling input type should be ARGV1 (sim_low, sim_med, sim_high, or biological), truth file should be ARGV2, submission file should be ARGV3."
+	print "optionally, ARGV4 set to \"exact\" scores the precision-recall curve at every distinct abundance in the submission."
+	# besides the pooled files (an entry is called if any of its samples is above the cutoff), each sample is
+	# scored on its own, against the truth entries with an abundance in that sample, over the usual cutoffs:
+	# its curve goes to profiling_<dataset>_PRC_samples.tsv and its scores to profiling_<dataset>_sample_scores.tsv
+	# --out-of-core (or --out-of-core=MB, or MOSAIC_OUT_OF_CORE=MB) scores files too big to read in whole,
+	# sorting them on disk within that much memory (256 MB by default); not with "exact" or --bootstrap, and
+	# only the pooled files are written
+	budget_mb = external_sort.budget_from_argv()
+	# with MOSAIC_RESULT_CACHE set to a directory, results are cached there (see challenges/common/result_cache.py)
+	# --profile anywhere on the command line (or MOSAIC_PROFILE=1) writes per-stage timings to profiling_<dataset>_scores.profile.json
+	stage_timer.enable_from_argv()
+	# --bootstrap=N (or MOSAIC_BOOTSTRAP=N) also writes the scores with 95% intervals from N resamples to profiling_<dataset>_scores_ci.tsv
+	replicates = bootstrap.replicates_from_argv()
+	# --format=parquet or --format=arrow (or MOSAIC_RESULT_FORMAT) also writes the PRC and scores files in that format (see challenges/common/result_writer.py)
+	result_format = result_writer.format_from_argv()
+	truth_file = sys.argv[2]
+	results_file = sys.argv[3]
+	exact_mode = len(sys.argv) > 4 and sys.argv[4] == "exact"
+	result_writer.submission = os.path.basename(results_file)
+
+	cache = None
+	if not budget_mb:
+		cache = result_cache.open_cache("compare_results", [sys.argv[1], exact_mode, replicates, result_format], truth_file, results_file,
+			[sys.modules[__name__], lineage, metric_kernels, bootstrap, table_loader, result_writer])
+	if cache and cache.restore() is not None:
+		print "Scores taken from the result cache."
+	elif budget_mb:
+		if exact_mode or replicates:
+			sys.exit("Warning: --out-of-core can't be used with exact mode or --bootstrap.")
+		# sorting the input files on disk, and counting at every cutoff in one pass over them
+		with stage_timer.stage("join") as join:
+			stats, submission_rows = streamed_stats(truth_file, results_file, [0] + iterate_cutoffs(), budget_mb)
+			join.rows = submission_rows
+		score_submission(sys.argv[1], None, None, stats=stats, submission_rows=submission_rows)
+	else:
+		# reading in the input files
+		with stage_timer.stage("parse") as parse:
+			truth_tab = read_answer_key(truth_file)
+			submission_tab = read_submission(results_file)
+			parse.rows = len(truth_tab) + len(submission_tab)
+		outputs = []
+		if replicates:
+			with stage_timer.stage("bootstrap", rows=replicates):
+				outputs = bootstrap_scores(sys.argv[1], truth_tab, submission_tab, replicates, exact_mode)
+		if cache:
+			score_cached(cache, sys.argv[1], truth_tab, submission_tab, exact_mode, outputs)
+		else:
+			score_submission(sys.argv[1], truth_tab, submission_tab, exact_mode)
+
+	print "Run successful."		# success!
@@ -0,0 +1,52 @@
+#!/usr/env Python
+# export_taxonomy_snapshot.py
+# usage: export_taxonomy_snapshot.py snapshot_file [table ...]
+# Writes the NCBI names, ranks and parents from the local ete3 database to a snapshot file that
+# parse_NCBI_ids.py loads instead of opening NCBITaxa (run it with NCBI_TAXONOMY_SNAPSHOT=snapshot_file).
+# If abundance tables are given, only their taxids and everything above them are kept, which
+# keeps the snapshot small; otherwise the whole taxonomy is exported.
+
+# imports
+import sys, time
+import numpy as np
+from ete3 import NCBITaxa			# note: ete3 is best installed with Anaconda/Miniconda
+import ncbi_taxonomy, table_loader
+
+snapshot_file=sys.argv[1]
+tables=sys.argv[2:]
+
+# updating the taxonomy, will take a couple minutes if running for the first time
+ncbi=NCBITaxa()
+rows=ncbi.db.execute("SELECT taxid, parent, spname, rank FROM species").fetchall()
+merged=ncbi.db.execute("SELECT taxid_old, taxid_new FROM merged").fetchall()
+taxids=np.array([row[0] for row in rows], dtype=np.int64)
+parents=np.array([row[1] for row in rows], dtype=np.int64)
+merged_old=np.array([row[0] for row in merged], dtype=np.int64)
+merged_new=np.array([row[1] for row in merged], dtype=np.int64)
+
+if tables:
+	wanted=set()
+	for table in tables:
+		with table_loader.open_table(table) as infile:
+			wanted.update(ncbi_taxonomy.table_taxids(line.split("\t", 1)[0] for line in infile if line.strip()))
+	# renumbered taxids are kept along with the taxid they now point to
+	keep_merged=np.in1d(merged_old, list(wanted))
+	wanted.update(merged_new[keep_merged].tolist())
+	# then walk up from every wanted taxid to the root, one level per step
+	order=np.argsort(taxids)
+	keep=np.zeros(len(taxids), dtype=bool)
+	frontier=np.array(sorted(wanted), dtype=np.int64)
+	while len(frontier):
+		index=np.minimum(np.searchsorted(taxids[order], frontier), len(taxids) - 1)
+		index=order[index[taxids[order][index] == frontier]]
+		index=index[~keep[index]]
+		keep[index]=True
+		frontier=np.unique(parents[index])
+	rows=[row for row, kept in zip(rows, keep) if kept]
+	taxids, parents=taxids[keep], parents[keep]
+	merged_old, merged_new=merged_old[keep_merged], merged_new[keep_merged]
+
+source="%s, exported %s" % (ncbi.dbfile, time.strftime("%Y-%m-%d"))
+ncbi_taxonomy.write_snapshot(snapshot_file, taxids, parents, [row[2] for row in rows], [row[3] for row in rows],
+	merged_old, merged_new, source=source)
+print "Wrote %d taxa and %d merged taxids to %s" % (len(taxids), len(merged_old), snapshot_file)
@@ -0,0 +1,129 @@
+# external_sort.py
+# Out-of-core join of a truth and a submission profiling table, for tables too big to read in whole.
+# Each file is read a run at a time (as many rows as fit in the memory budget), each run sorted by
+# lineage and spilled to a temporary array file. The runs of both files are then merged together,
+# a block at a time, and handed back as pairs of small LineageTables (truth rows, submission rows)
+# in lineage order. Rows sharing a genus always come back in the same block, so anything that
+# compares the two tables by strain, species or genus can be worked out block by block and added up.
+#
+# Memory is bounded by the budget (MB), plus the rows of the largest single genus in the two files.
+# Only what compare_results.py's counts need is kept of each row: its lineage and its largest
+# abundance over the samples.
+
+# imports
+import sys, os
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, os.pardir, "common"))
+import table_loader, lineage
+
+DEFAULT_BUDGET_MB = 256
+ROW_BYTES = 256					# rough memory per row while a run is parsed and sorted
+RUN_MAGIC = b"MOSAICRN"
+GENUS_COLUMNS = lineage.RANKS.index("genus") + 1
+
+def budget_from_argv():
+	# takes --out-of-core (or --out-of-core=MB) out of sys.argv (so positional arguments stay where
+	# the scripts expect them); returns the budget in MB, or MOSAIC_OUT_OF_CORE, or 0 to read in whole
+	budget = float(os.environ.get("MOSAIC_OUT_OF_CORE", 0))
+	for arg in list(sys.argv):
+		if arg == "--out-of-core" or arg.startswith("--out-of-core="):
+			sys.argv.remove(arg)
+			budget = float(arg.split("=", 1)[1]) if "=" in arg else DEFAULT_BUDGET_MB
+	return budget
+
+def budget_rows(budget_mb):
+	return max(1, int(budget_mb * 1024 * 1024 / ROW_BYTES))
+
+def lineage_order(taxids, *ties):
+	# row order by lineage, with ties broken by the given arrays in turn
+	return np.lexsort(ties[::-1] + tuple(taxids[:, column] for column in range(taxids.shape[1] - 1, -1, -1)))
+
+def write_run(file, chunks):
+	taxids, values, order = [np.concatenate(arrays) for arrays in zip(*chunks)]
+	index = lineage_order(taxids, order)
+	table_loader.write_arrays(file, RUN_MAGIC, [("taxids", taxids[index]), ("values", values[index]), ("order", order[index])])
+	return file
+
+def sort_runs(file, temp_dir, budget_mb, columns=None):
+	# sorts a profiling table into runs in temp_dir, and returns their file names. Raises ValueError
+	# if the rows don't all have the same number of columns (or not columns of them, if given).
+	run_rows = max(1, budget_rows(budget_mb) // table_loader.CHUNK_LINES) * table_loader.CHUNK_LINES
+	runs = []
+	chunks = []
+	rows = 0
+	for keys, chunk_values in table_loader.read_chunks(file):
+		chunk_values = table_loader.parse_values(chunk_values, columns, np.float64)
+		columns = chunk_values.shape[1]
+		chunks.append((table_loader.parse_lineages(keys)[0], chunk_values.max(axis=1), np.arange(rows, rows + len(keys))))
+		rows += len(keys)
+		if sum(len(chunk[2]) for chunk in chunks) >= run_rows:
+			runs.append(write_run(os.path.join(temp_dir, "%s.%d.run" % (os.path.basename(file), len(runs))), chunks))
+			chunks = []
+	if chunks:
+		runs.append(write_run(os.path.join(temp_dir, "%s.%d.run" % (os.path.basename(file), len(runs))), chunks))
+	return runs
+
+def rows_at_most(taxids, bound):
+	# how many rows of a sorted taxid matrix come at or before the lineage bound
+	before = np.zeros(len(taxids), dtype=bool)
+	equal = np.ones(len(taxids), dtype=bool)
+	for column in range(taxids.shape[1]):
+		before |= equal & (taxids[:, column] < bound[column])
+		equal &= taxids[:, column] == bound[column]
+	return np.count_nonzero(before | equal)
+
+def merge_runs(runs, budget_mb):
+	# k-way merge of sorted runs: yields (taxids, values, source, order) blocks, where source is the
+	# index of the run list a row came from. Blocks are not sorted within, but every row in a block
+	# comes before the next block's, except that repeats of its last lineage can spill over into it.
+	mapped = [(source, table_loader.map_arrays(run, RUN_MAGIC)[1]) for source, files in enumerate(runs) for run in files]
+	positions = [0] * len(mapped)
+	slice_rows = max(1, budget_rows(budget_mb) // max(1, len(mapped)))
+	while True:
+		active = [index for index, (source, arrays) in enumerate(mapped) if positions[index] < len(arrays["order"])]
+		if not active:
+			return
+		# every row up to the smallest last lineage among the slices that don't finish their run can go
+		bounds = [tuple(mapped[index][1]["taxids"][positions[index] + slice_rows - 1].tolist()) for index in active
+			if positions[index] + slice_rows < len(mapped[index][1]["order"])]
+		bound = min(bounds) if bounds else None
+		block = []
+		for index in active:
+			source, arrays = mapped[index]
+			start = positions[index]
+			taxids = arrays["taxids"][start:start + slice_rows]
+			stop = start + (len(taxids) if bound is None else rows_at_most(taxids, bound))
+			if stop > start:
+				block.append((np.array(arrays["taxids"][start:stop]), np.array(arrays["values"][start:stop]),
+					np.full(stop - start, source, dtype=np.int8), np.array(arrays["order"][start:stop])))
+			positions[index] = stop
+		yield tuple(np.concatenate(arrays) for arrays in zip(*block))
+
+def split_block(taxids, values, source):
+	# (truth, submission) LineageTables of a sorted block, each lineage keeping its last row in its
+	# file, as lineage.drop_duplicate_rows does
+	last = np.ones(len(taxids), dtype=bool)
+	last[:-1] = np.any(taxids[1:] != taxids[:-1], axis=1) | (source[1:] != source[:-1])
+	tables = []
+	for side in [0, 1]:
+		rows = last & (source == side)
+		tables.append(lineage.LineageTable(taxids[rows], values[rows][:, None]))
+	return tuple(tables)
+
+def joined_blocks(truth_runs, submission_runs, budget_mb):
+	# yields (truth, submission) LineageTables, a few whole genera at a time, in lineage order
+	carry = None
+	for block in merge_runs([truth_runs, submission_runs], budget_mb):
+		if carry is not None:
+			block = tuple(np.concatenate(arrays) for arrays in zip(carry, block))
+		# by lineage, then file, then position in the file
+		index = lineage_order(block[0], block[2], block[3])
+		block = tuple(array[index] for array in block)
+		# the last genus in the block may go on into the next one, so it waits for it
+		genus = block[0][:, :GENUS_COLUMNS]
+		cut = int(np.argmax(np.all(genus == genus[-1], axis=1)))
+		carry = tuple(array[cut:] for array in block)
+		if cut:
+			yield split_block(*[array[:cut] for array in block[:3]])
+	if carry is not None and len(carry[0]):
+		yield split_block(*carry[:3])
@@ -0,0 +1,86 @@
+# krona.py
+# Builds a Krona chart directly from annotated rows, in place of writing one TSV per dataset and
+# running KronaTools' ktImportText over them. Rows are added as they are annotated; only the
+# per-dataset magnitude of each distinct lineage is kept, and the tree above the lineages is
+# summed up when the chart is written. The page loads the Krona viewer from KRONA_URL, as
+# ktImportText's own output does.
+
+# imports
+import io
+import numpy as np
+from xml.sax.saxutils import escape, quoteattr
+
+KRONA_URL = "https://marbl.github.io/Krona"
+
+class KronaTree(object):
+	def __init__(self, datasets):
+		self.datasets = datasets
+		self.leaves = {}			# tab-joined lineage labels -> magnitude in each dataset
+
+	def add(self, lineages, magnitudes, dataset):
+		# lineages: tab-joined labels for each row; rows with no positive magnitude are left out
+		magnitudes = np.asarray(magnitudes, dtype=float)
+		present = np.flatnonzero(magnitudes > 0.0)
+		if not len(present):
+			return
+		keys, inverse = np.unique(np.array(lineages, dtype=object)[present], return_inverse=True)
+		totals = np.bincount(inverse, weights=magnitudes[present], minlength=len(keys))
+		for key, total in zip(keys.tolist(), totals.tolist()):
+			if key not in self.leaves:
+				self.leaves[key] = np.zeros(len(self.datasets))
+			self.leaves[key][dataset] += total
+
+	def tree(self):
+		# nested {name: [magnitudes, children]} built from the leaves, with every node's magnitude
+		# the sum of the lineages below it
+		root = [np.zeros(len(self.datasets)), {}]
+		for key, magnitudes in self.leaves.items():
+			node = root
+			node[0] += magnitudes
+			for name in key.split("\t"):
+				if name not in node[1]:
+					node[1][name] = [np.zeros(len(self.datasets)), {}]
+				node = node[1][name]
+				node[0] += magnitudes
+		return root
+
+	def write_html(self, filename):
+		lines = []
+		def write_node(name, node, depth):
+			indent = " " * depth
+			lines.append(u"%s<node name=%s>" % (indent, quoteattr(name)))
+			lines.append(u"%s <magnitude>%s</magnitude>" % (indent, u"".join(u"<val>%s</val>" % str(value) for value in node[0].tolist())))
+			for child in sorted(node[1]):
+				write_node(child, node[1][child], depth + 1)
+			lines.append(u"%s</node>" % indent)
+		write_node(u"all", self.tree(), 0)
+		with io.open(filename, 'w', encoding='utf-8') as outfile:
+			outfile.write(HTML_HEAD % {"url": KRONA_URL, "datasets": u"\n".join(u"    <dataset>%s</dataset>" % escape(dataset) for dataset in self.datasets)})
+			outfile.write(u"\n".join(lines) + u"\n")
+			outfile.write(HTML_TAIL)
+
+HTML_HEAD = u"""<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
+ <head>
+  <meta charset="utf-8"/>
+  <link rel="shortcut icon" href="%(url)s/img/favicon.ico"/>
+  <script id="notfound">window.onload=function(){document.body.innerHTML="Could not get resources from \\"%(url)s\\"."}</script>
+  <script src="%(url)s/src/krona-2.0.js"></script>
+ </head>
+ <body>
+  <img id="hiddenImage" src="%(url)s/img/hidden.png" style="display:none"/>
+  <img id="loadingImage" src="%(url)s/img/loading.gif" style="display:none"/>
+  <noscript>Javascript must be enabled to view this page.</noscript>
+  <div style="display:none">
+  <krona collapse="true" key="true">
+   <attributes magnitude="magnitude">
+    <attribute display="Total">magnitude</attribute>
+   </attributes>
+   <datasets>
+%(datasets)s
+   </datasets>
+"""
+
+HTML_TAIL = u"""  </krona>
+</div></body></html>
+"""
@@ -0,0 +1,96 @@
+# lineage.py
+# Profiling abundance tables as used by compare_results.py, calculate_BC.py and parse_NCBI_ids.py.
+# Files are parsed (and optionally cached) by challenges/common/table_loader.py.
+# Each row is kept as a fixed-width integer taxid lineage (kingdom ... strain) in one matrix, with
+# the per-sample abundances in a float matrix of the same length, so rolling up to any rank is a
+# column slice plus a grouped reduction instead of splitting comma-joined strings.
+
+# imports
+import sys, os
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, os.pardir, "common"))
+import table_loader
+
+RANKS = ["kingdom", "phylum", "class", "order", "family", "genus", "species", "strain"]
+
+class LineageTable(object):
+	def __init__(self, taxids, abundances, depths=None):
+		self.taxids = taxids					# (rows, 8) integer matrix, 0 means no call at that rank
+		self.abundances = abundances			# (rows, samples) float matrix
+		self.depths = depths					# ranks actually given in the file for each row
+
+	def __len__(self):
+		return self.taxids.shape[0]
+
+	def column(self, rank):
+		# taxid at a single rank, e.g. every row's genus
+		return self.taxids[:, RANKS.index(rank)]
+
+	def prefix(self, rank):
+		# the lineage down to (and including) a rank, e.g. kingdom..species for "species"
+		return self.taxids[:, :RANKS.index(rank) + 1]
+
+	def collapse(self, rank):
+		# unique lineages down to a rank, plus the group each row falls into
+		return unique_rows(self.prefix(rank))
+
+def read_lineage_table(file, drop_duplicates=False):
+	# raises ValueError if the rows don't all have the same number of columns
+	arrays = table_loader.load(file, "lineage")
+	table = LineageTable(arrays["taxids"], arrays["values"], arrays["depths"])
+	if drop_duplicates:
+		table = drop_duplicate_rows(table)
+	return table
+
+def drop_duplicate_rows(table):
+	# a repeated lineage keeps its last row, as it would when read into a dictionary
+	flipped = _row_view(table.taxids[::-1])
+	index = np.unique(flipped, return_index=True)[1]
+	keep = np.sort(len(table) - 1 - index)
+	return LineageTable(table.taxids[keep], table.abundances[keep], table.depths[keep])
+
+def _row_view(matrix):
+	# views each row of an integer matrix as one opaque value, so rows can be sorted and compared whole
+	matrix = np.ascontiguousarray(matrix)
+	return matrix.view(np.dtype((np.void, matrix.dtype.itemsize * matrix.shape[1]))).ravel()
+
+def unique_rows(matrix):
+	keys, inverse = np.unique(_row_view(matrix), return_inverse=True)
+	return keys.view(matrix.dtype).reshape(-1, matrix.shape[1]), inverse
+
+def isin_rows(matrix, other):
+	# which rows of matrix also appear as a row of other
+	dtype = np.promote_types(matrix.dtype, other.dtype)
+	return np.in1d(_row_view(matrix.astype(dtype)), _row_view(other.astype(dtype)))
+
+def row_index(matrix, other):
+	# where each row of matrix is among the (distinct) rows of other, or -1 if it isn't one of them,
+	# from one sort of the two together
+	dtype = np.promote_types(matrix.dtype, other.dtype)
+	inverse = np.unique(np.concatenate((_row_view(other.astype(dtype)), _row_view(matrix.astype(dtype)))), return_inverse=True)[1]
+	position = np.full(inverse.max() + 1 if len(inverse) else 0, -1, dtype=np.int64)
+	position[inverse[:len(other)]] = np.arange(len(other))
+	return position[inverse[len(other):]]
+
+def _group_reduce(function, values, inverse, groups, empty):
+	# function (fmin or fmax, which skip NaNs) over the values (rows, or rows of a matrix) within each
+	# group, by sorting once on the group (in any order within it)
+	values = np.asarray(values, dtype=float)
+	result = np.full((groups,) + values.shape[1:], empty)
+	if len(values) == 0:
+		return result
+	order = np.argsort(inverse)
+	sorted_groups = inverse[order]
+	starts = np.flatnonzero(np.concatenate(([True], sorted_groups[1:] != sorted_groups[:-1])))
+	result[sorted_groups[starts]] = function.reduceat(values[order], starts, axis=0)
+	return result
+
+def group_min(values, inverse, groups):
+	# smallest value within each group (per column, for a matrix)
+	return _group_reduce(np.fmin, values, inverse, groups, np.inf)
+
+def group_max(values, inverse, groups):
+	return _group_reduce(np.fmax, values, inverse, groups, -np.inf)
+
+def group_sum(values, inverse, groups):
+	return np.bincount(inverse, weights=values, minlength=groups)
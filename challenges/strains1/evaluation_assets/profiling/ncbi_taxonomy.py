@@ -0,0 +1,148 @@
+# ncbi_taxonomy.py
+# Name and rank lookups for NCBI taxids, used by parse_NCBI_ids.py.
+# Every taxid a run needs is gathered up front and resolved in a few bulk queries against the
+# ete3 database, instead of one query per taxid per row. Results stay in a bounded in-process
+# cache, and can optionally be saved to a tab-separated cache file so reruns skip the lookups.
+# For workers without the ete3 database (or network access), a snapshot file written by
+# export_taxonomy_snapshot.py answers the same lookups; see TaxonomySnapshot below.
+
+# imports
+import sys, os, io
+from collections import OrderedDict
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, os.pardir, "common"))
+import table_loader
+
+BATCH_SIZE = 5000				# taxids per bulk query
+CACHE_SIZE = 500000				# taxids kept in memory, least recently used dropped first
+
+class TaxonomyResolver(object):
+	def __init__(self, ncbi, cache_size=CACHE_SIZE, cache_file=None):
+		self.ncbi = ncbi
+		self.cache_size = cache_size
+		self.cache_file = cache_file
+		self.cache = OrderedDict()			# taxid -> (name, rank), oldest first
+		self.changed = False
+		if cache_file and os.path.exists(cache_file):
+			self.load(cache_file)
+
+	def remember(self, taxid, entry):
+		self.cache.pop(taxid, None)
+		self.cache[taxid] = entry
+		if len(self.cache) > self.cache_size:
+			self.cache.popitem(last=False)
+
+	def resolve(self, taxids):
+		# returns {taxid: (name, rank)} for each of the taxids NCBI knows; 0 (no call) is skipped
+		wanted = set(int(taxid) for taxid in taxids)
+		wanted.discard(0)
+		found = {}
+		missing = []
+		for taxid in wanted:
+			if taxid in self.cache:
+				found[taxid] = self.cache[taxid]
+				self.remember(taxid, found[taxid])
+			else:
+				missing.append(taxid)
+		for start in range(0, len(missing), BATCH_SIZE):
+			batch = missing[start:start + BATCH_SIZE]
+			names = self.ncbi.get_taxid_translator(batch)
+			ranks = self.ncbi.get_rank(batch)
+			for taxid in batch:
+				if taxid in names and taxid in ranks:
+					found[taxid] = (names[taxid], ranks[taxid])
+					self.remember(taxid, found[taxid])
+					self.changed = True
+		return found
+
+	def load(self, cache_file):
+		with io.open(cache_file, 'r', encoding='utf-8') as infile:
+			for line in infile:
+				line = line.rstrip("\n").split("\t")
+				if len(line) == 3:
+					self.remember(int(line[0]), (line[1], line[2]))
+
+	def save(self):
+		if not self.cache_file or not self.changed:
+			return
+		# written next to the target and renamed over it, so a crash never leaves a half-written cache
+		temp_file = self.cache_file + ".tmp"
+		with io.open(temp_file, 'w', encoding='utf-8') as outfile:
+			outfile.write(u"".join(u"%d\t%s\t%s\n" % (taxid, name, rank) for taxid, (name, rank) in self.cache.items()))
+		os.rename(temp_file, self.cache_file)
+		self.changed = False
+
+def table_taxids(lineages):
+	# every taxid named in a column of comma-joined lineages, down to species
+	taxids = set()
+	for lineage in lineages:
+		taxids.update(lineage.split(",")[:7])
+	return set(int(taxid) for taxid in taxids)
+
+# Offline snapshots: a pinned copy of the names, ranks and parents NCBITaxa would give, in one
+# flat file that is memory-mapped rather than parsed. The file is in table_loader's array format:
+# sorted taxids, their parents and rank codes, offsets into a UTF-8 blob of names, and the
+# merged (old -> new) taxid table NCBI keeps for renumbered taxa.
+
+SNAPSHOT_MAGIC = b"MOSAICTX"
+
+def write_snapshot(snapshot_file, taxids, parents, names, ranks, merged_old=(), merged_new=(), source=""):
+	order = np.argsort(np.asarray(taxids, dtype=np.int64), kind='mergesort')
+	rank_names = sorted(set(ranks))
+	encoded = [names[i].encode('utf-8') for i in order]
+	name_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+	name_offsets[1:] = np.cumsum([len(name) for name in encoded])
+	merged_order = np.argsort(np.asarray(merged_old, dtype=np.int64), kind='mergesort')
+	arrays = [
+		("taxids", np.asarray(taxids, dtype=np.int32)[order]),
+		("parents", np.asarray(parents, dtype=np.int32)[order]),
+		("ranks", np.array([rank_names.index(ranks[i]) for i in order], dtype=np.uint8)),
+		("name_offsets", name_offsets),
+		("names", np.frombuffer(b"".join(encoded), dtype=np.uint8)),
+		("merged_old", np.asarray(merged_old, dtype=np.int32)[merged_order]),
+		("merged_new", np.asarray(merged_new, dtype=np.int32)[merged_order])]
+	table_loader.write_arrays(snapshot_file, SNAPSHOT_MAGIC, arrays, {"source": source, "rank_names": rank_names})
+
+class TaxonomySnapshot(object):
+	# answers the same get_taxid_translator/get_rank calls as ete3's NCBITaxa, from a snapshot file
+	def __init__(self, snapshot_file):
+		header, arrays = table_loader.map_arrays(snapshot_file, SNAPSHOT_MAGIC)
+		self.source = header["source"]
+		self.rank_names = header["rank_names"]
+		# the whole file is mapped once; each array is a view into it, so nothing is read until used
+		for name, array in arrays.items():
+			setattr(self, name, array)
+
+	def _find(self, sorted_ids, taxids):
+		# positions of taxids in a sorted id array, and which of them are really there
+		taxids = np.asarray(taxids, dtype=np.int64)
+		index = np.minimum(np.searchsorted(sorted_ids, taxids), max(len(sorted_ids) - 1, 0))
+		found = (sorted_ids[index] == taxids) if len(sorted_ids) else np.zeros(len(taxids), dtype=bool)
+		return index, found
+
+	def _name(self, index):
+		return self.names[self.name_offsets[index]:self.name_offsets[index + 1]].tobytes().decode('utf-8')
+
+	def get_taxid_translator(self, taxids, try_synonyms=True):
+		taxids = [int(taxid) for taxid in taxids]
+		index, found = self._find(self.taxids, taxids)
+		id2name = dict((taxid, self._name(i)) for taxid, i, hit in zip(taxids, index, found) if hit)
+		if try_synonyms and len(id2name) != len(set(taxids)):
+			# renumbered taxa are looked up under their new taxid, but reported under the one asked for
+			old = [taxid for taxid in taxids if taxid not in id2name]
+			merged_index, merged_found = self._find(self.merged_old, old)
+			new = [int(self.merged_new[i]) for i, hit in zip(merged_index, merged_found) if hit]
+			old = [taxid for taxid, hit in zip(old, merged_found) if hit]
+			index, found = self._find(self.taxids, new)
+			id2name.update((taxid, self._name(i)) for taxid, i, hit in zip(old, index, found) if hit)
+		return id2name
+
+	def get_rank(self, taxids):
+		taxids = [int(taxid) for taxid in taxids]
+		index, found = self._find(self.taxids, taxids)
+		return dict((taxid, self.rank_names[self.ranks[i]]) for taxid, i, hit in zip(taxids, index, found) if hit)
+
+	def get_parent(self, taxids):
+		taxids = [int(taxid) for taxid in taxids]
+		index, found = self._find(self.taxids, taxids)
+		return dict((taxid, int(self.parents[i])) for taxid, i, hit in zip(taxids, index, found) if hit)
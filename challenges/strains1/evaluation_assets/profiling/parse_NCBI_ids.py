@@ -4,11 +4,20 @@
 
 # imports
 import sys, os, csv
-from ete3 import NCBITaxa			# note: ete3 is best installed with Anaconda/Miniconda
-import pandas as p
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, os.pardir, "common"))
+import lineage, ncbi_taxonomy, krona, stage_timer, table_loader
 
-# updating the taxonomy, will take a couple minutes if running for the first time
-ncbi = NCBITaxa()
+def open_resolver():
+	if os.environ.get("NCBI_TAXONOMY_SNAPSHOT"):
+		# a snapshot written by export_taxonomy_snapshot.py, no ete3 database or network needed
+		ncbi = ncbi_taxonomy.TaxonomySnapshot(os.environ["NCBI_TAXONOMY_SNAPSHOT"])
+	else:
+		from ete3 import NCBITaxa			# note: ete3 is best installed with Anaconda/Miniconda
+		# updating the taxonomy, will take a couple minutes if running for the first time
+		ncbi = NCBITaxa()
+	# names and ranks are looked up in bulk; set NCBI_TAXID_CACHE to a file path to keep them between runs
+	return ncbi_taxonomy.TaxonomyResolver(ncbi, cache_file=os.environ.get("NCBI_TAXID_CACHE"))
 
 # setting up definitions and labels
 dsets={ 'bio': 'Mouse',
@@ -33,77 +42,116 @@ abbr={ 'superkingdom': 'k__',
 		'species': 's__',
 		'strain': 'str__' }
 
-dataset=sys.argv[1]
-if dataset not in dsets:
-	print 'Dataset name "%s" is not valid' % dataset
-	exit()
-truth_file=sys.argv[2]
-subm_file=sys.argv[3]
+# tables are read and annotated this many rows at a time, so memory stays flat however big they are
+CHUNK_ROWS=table_loader.CHUNK_LINES
 
-truth_table=p.read_csv(truth_file, delimiter="\t", header=None)
-table=p.read_csv(subm_file, delimiter="\t", header=None)
+def label(key, name):
+	if '__unknown' not in name:
+		return abbr[key]+name
+	return name
 
-def parse_table(table,dset_type):
+def annotate_chunk(ids, depths, resolver):
+	# the 8 taxonomy labels of every row in the chunk, filled in one lineage position at a time
+	ids=np.asarray(ids, dtype=np.int64)
+	present=np.arange(ids.shape[1]) < depths[:, None]	# lineages can be shorter than 8 ranks
+	unique_ids, inverse=np.unique(ids, return_inverse=True)
+	inverse=inverse.reshape(ids.shape)
+	# taxids in the strain position are not NCBI taxids, so they are never looked up
+	looked_up=ids[:, [n for n in range(ids.shape[1]) if n != 7]]
+	taxa=resolver.resolve(np.unique(looked_up[looked_up != 0]))
+	names=np.array([taxa[taxid][0] if taxid in taxa else None for taxid in unique_ids.tolist()], dtype=object)
+	slots=np.array([taxonomy.index(taxa[taxid][1]) if taxid in taxa and taxa[taxid][1] in taxonomy else -1 for taxid in unique_ids.tolist()])
+	labels=np.array([label(taxonomy[slot], name) if slot >= 0 else None for name, slot in zip(names, slots)], dtype=object)
+
+	rows=np.arange(len(ids))
+	annotation=np.empty((len(ids), len(taxonomy)), dtype=object)
+	annotation[:]=[default[key] for key in taxonomy]
+	for position in range(ids.shape[1]):
+		column=inverse[:, position]
+		if position == 7:
+			# strains are named after their species: "<species name> strain <strain id>"
+			named=present[:, 7] & (ids[:, 6] != 0)
+			for row in np.flatnonzero(named):
+				species=unique_ids[inverse[row, 6]]
+				if names[inverse[row, 6]] is None:
+					raise KeyError(species)
+				annotation[row, 7]=label('strain', names[inverse[row, 6]] + " strain " + str(ids[row, 7]))
+			continue
+		called=present[:, position] & (ids[:, position] != 0)
+		missing=called & np.equal(names[column], None)
+		if missing.any():
+			raise KeyError(ids[np.flatnonzero(missing)[0], position])
+		# later positions win when two taxids in a lineage share a rank
+		named=called & (slots[column] >= 0)
+		annotation[rows[named], slots[column[named]]]=labels[column[named]]
+	return annotation
+
+def table_chunks(table):
+	# (taxids, depths, abundances) a chunk of rows at a time: a LineageTable already loaded (as the
+	# evaluation server keeps its truth sets) is sliced, a file is read and parsed a chunk at a time
+	if isinstance(table, lineage.LineageTable):
+		for start in range(0, len(table), CHUNK_ROWS):
+			yield table.taxids[start:start+CHUNK_ROWS], table.depths[start:start+CHUNK_ROWS], table.abundances[start:start+CHUNK_ROWS]
+		return
+	columns=None
+	for keys, values in table_loader.read_chunks(table):
+		# raises ValueError if the rows don't all have the same number of columns
+		values=table_loader.parse_values(values, columns, np.float64)
+		columns=values.shape[1]
+		taxids, depths=table_loader.parse_lineages(keys)
+		yield taxids, depths, values
+
+def parse_table(table,dataset,dset_type,chart,first_dataset,resolver):
+	# table is a LineageTable or a file name; each sample column goes into the chart as dataset
+	# first_dataset + 2*n. Returns the number of rows annotated.
 	print "Parsing %s file" % (dset_type)
-	outlist=[]
 	out=open("profiling_%s_%s_abundances.tsv" % (dataset,dset_type), 'w')
-	fileout_names=[]
-	for x in range(1,5):
-		filename = "%s_%x.tsv" % (dset_type,x)
-		outhandle=open(filename,'w')
-		fileout_names.append(filename)
-		outlist.append(outhandle)
 
-	for i,row in table.iterrows():
-		annotation = dict(default)
-		tax=row[0].split(",")
-		full=[]
-		fullname=[]
-		for i,id in enumerate(map(int,tax)):
-			if i == 7 and int(tax[6]) != 0:
-				strain= ncbi.get_taxid_translator([int(tax[6])])[int(tax[6])] + " strain " + str(id)
-				full.append("strain")
-				fullname.append(strain)
-				annotation['strain']=[strain][0]
-			elif i == 7 and int(tax[6]) == 0:
-				strain= 'str__unknown'
-				full.append("strain")
-				fullname.append(strain)
-				annotation['strain']=[strain][0]
-			elif id != 0:
-				name=ncbi.get_taxid_translator([id])[id]
-				rank=ncbi.get_rank([id])[id]
-				full.append(rank)
-				fullname.append(name)
-				annotation[rank]=[name][0]
-		line=[]
-		for key in taxonomy:
-			if '__unknown' not in annotation[key]:
-				line.append(abbr[key]+annotation[key])
-			else:
-				line.append(annotation[key])
-
-		line.extend(map(str,row)[1:5])
-		out.write("\t".join(line)+"\n")
-		for n,value in enumerate(row[1:5]):
-			if value > 0.0:
-				outlist[n].write(str(value)+"\t"+"\t".join(line[0:8])+"\n")
+	rows=0
+	for taxids, depths, abundances in table_chunks(table):
+		annotation=["\t".join(row) for row in annotate_chunk(taxids, depths, resolver).tolist()]
+		abundances=abundances[:, :4]
+		rows+=len(annotation)
+		out.write("".join(line+"\t"+"\t".join(str(value) for value in row)+"\n" for line, row in zip(annotation, abundances.tolist())))
+		for n in range(abundances.shape[1]):
+			chart.add(annotation, abundances[:, n], first_dataset + 2*n)
 	out.close()
-	for outhandle in outlist:
-		outhandle.close()
 	print "Parsing of %s table complete" % (dset_type)
-	return fileout_names
+	return rows
+
+def annotate_tables(dataset, truth_tab, subm_tab, resolver):
+	# the tables are LineageTables or file names (read a chunk at a time); writes the annotated abundance tables and the Krona chart to the working directory, and returns their names
+	# the Krona chart interleaves the two tables: truth sample 1, submission sample 1, truth sample 2, ...
+	datasets=[]
+	for series in range(1,5):
+		datasets.append("%s Truth Sample %s" % (dsets[dataset],series))
+		datasets.append("%s Submission Sample %s" % (dsets[dataset],series))
+	chart=krona.KronaTree(datasets)
 
-truthfn=parse_table(truth_table,'truth')
-subfn=parse_table(table,'submission')
+	# the taxid lookups are most of the annotate stages
+	with stage_timer.stage("annotate:truth") as annotate:
+		annotate.rows=truth_rows=parse_table(truth_tab,dataset,'truth',chart,0,resolver)
+	with stage_timer.stage("annotate:submission") as annotate:
+		annotate.rows=subm_rows=parse_table(subm_tab,dataset,'submission',chart,1,resolver)
+	resolver.save()
 
-argument=[]
-for series in range(1,5):
-	idx=series-1
-	argument.append('%s,"%s Truth Sample %s"' %  (truthfn[idx],dsets[dataset],series))
-	argument.append('%s,"%s Submission Sample %s"' %  (subfn[idx],dsets[dataset],series))
-argument_text=" ".join(argument)
-cmd="ktImportText %s -o profiling_%s_krona.html" % (argument_text,dataset)
-print cmd
+	with stage_timer.stage("krona", rows=truth_rows+subm_rows):
+		chart.write_html("profiling_%s_krona.html" % dataset)
+	print "Krona chart written to profiling_%s_krona.html" % dataset
+	outputs=["profiling_%s_%s_abundances.tsv" % (dataset,dset_type) for dset_type in ['truth','submission']] + ["profiling_%s_krona.html" % dataset]
+	# with profiling on, the stage timings go next to the chart
+	return outputs + filter(None, [stage_timer.write_report(outputs[-1])])
 
-os.system(cmd)
+if __name__ == "__main__":
+	# --profile (or MOSAIC_PROFILE=1) also writes per-stage timings to profiling_<dataset>_krona.profile.json
+	stage_timer.enable_from_argv()
+	dataset=sys.argv[1]
+	if dataset not in dsets:
+		print 'Dataset name "%s" is not valid' % dataset
+		exit()
+	truth_file=sys.argv[2]
+	subm_file=sys.argv[3]
+	with stage_timer.stage("taxonomy"):
+		resolver=open_resolver()
+	# the tables are streamed, so their parsing is timed as part of the annotate stages
+	annotate_tables(dataset, truth_file, subm_file, resolver)
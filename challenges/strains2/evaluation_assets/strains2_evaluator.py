@@ -7,95 +7,69 @@
 #	1. Read in truth file, submission file
 #	2. Compare and calculate accuracy, precision, F1, misclass, ARI
 #	3. Calculate matrix distance
-#	4. Loop of:
-#		1. Remove lowest confidence prediction
-#		2. Recalculate accuracy, precision, F1, misclass, ARI
-#		3. Save ARI and removed confidence level if ARI > maximum
-#		4. Go to 1 (x39)
+#	4. Sweep over the confidence levels, lowest first:
+#		1. Remove every prediction at that confidence
+#		2. Update TP/FP/TN/FN and the ARI contingency table for just the removed rows
+#		3. Recalculate accuracy, precision, F1, misclass, ARI
 #	5. Return #2 as file output 1, return #4 results as file output 2
 
 # Imports
 import sys, os, math
-import sklearn
-from sklearn import metrics
-from sklearn.metrics import f1_score
-from sklearn.metrics.cluster import adjusted_rand_score
 import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, "common"))
+import table_loader, metric_kernels, stage_timer, bootstrap, result_cache, result_writer
 
-# starting files
-truth_file=sys.argv[1]
-results_file=sys.argv[2]
+def read_matrix(file, kind):
+	# strain name, then one tab-separated value per sample, parsed into a float32 matrix
+	try:
+		arrays = table_loader.load(file, "matrix")
+	except ValueError as error:
+		sys.exit("Warning: %s in %s file." % (error, kind))
+	if len(arrays["values"]) == 0:
+		sys.exit("Warning: " + kind + " file is empty.")
+	return arrays["values"], arrays["keys"]
 
 def read_answer_key(file):
-	answer_matrix = []
-	strains_list = []
-	with open(file, 'r') as infile:
-		for line in infile:
-			line = line.strip().split("\t", 1)
-			strains_list.append(line[0])
-			matrix_entry = map(float, line[1].split("\t"))
-
-			answer_matrix.append(matrix_entry)
-
-	return answer_matrix, strains_list
-
-def read_submission(file):
-	submission_matrix = []
-	line_count = 0
-	with open(file, 'r') as infile:
-		for line in infile:
-			line_count += 1
-			line = line.strip().split("\t", 1)
-			entry_matrix = map(float, line[1].split("\t"))
-			# some sanity checking
-			if len(entry_matrix) != 4:
-				sys.exit("Warning: wrong number of columns in submission file.")
-			test_sum = 0
-			for entry in entry_matrix:
-				test_sum += math.ceil(float(entry))
-			if test_sum > 1.0:
-				sys.exit("Warning: organism marked as present in more than 1 sample.")
-
-			submission_matrix.append(entry_matrix)
+	return read_matrix(file, "truth")
+
+def read_submission(file, answer_matrix):
+	submission_matrix = read_matrix(file, "submission")[0]
+	# some sanity checking
+	if submission_matrix.shape[1] != answer_matrix.shape[1]:
+		sys.exit("Warning: wrong number of columns in submission file.")
+	if (np.ceil(submission_matrix).sum(axis=1) > 1.0).any():
+		sys.exit("Warning: organism marked as present in more than 1 sample.")
 
 	# another sanity check
-	if line_count != 40:
+	if len(submission_matrix) != len(answer_matrix):
 		sys.exit("Warning: incorrect number of lines in submission file.")
 
 	return submission_matrix
 
+# row classes, as returned by classify_rows
+TP_ROW, FP_ROW, TN_ROW, FN_ROW = range(4)
+
+def classify_rows(truth_matrix, submission_matrix):
+	# a strain is called present in a sample wherever the submission is above 0
+	called = submission_matrix > 0
+	calls = called.sum(axis=1)
+	in_truth = truth_matrix != 0
+	# everything is a false positive unless shown otherwise: they got the wrong sample for this
+	# strain, or the submission thinks a strain is present where it isn't
+	classes = np.full(len(calls), FP_ROW)
+	# It was all 0s in both the answer key and the submission
+	no_calls = calls == 0
+	present = in_truth.any(axis=1)
+	classes[no_calls & ~present] = TN_ROW
+	# Entry in answer key but not in submission
+	classes[no_calls & present] = FN_ROW
+	# a single call, in a sample where the answer key has the strain, means that the answer is right!
+	classes[(calls == 1) & (called & in_truth).any(axis=1)] = TP_ROW
+	return classes
+
 def get_stats(truth_matrix, submission_matrix):
-	TP = 0.0	# there's a number where the truth is nonzero
-	FP = 0.0	# there's a number where the truth is zero
-	FN = 0.0	# there's no number where the truth is nonzero
-	TN = 0.0	# there's no number where the truth is zero
-
-	# we multiply the answer key by 10, to avoid some subtraction issues
-	truth_matrix = np.multiply(truth_matrix, 10.0)
-
-	# we subtract the answers from the answer key
-	difference_matrix = truth_matrix - submission_matrix
-
-	# we can now evaluate for TP, FP, FN, TN
-	for row in difference_matrix:
-		if sum(row) == 0.0:
-			# It was all 0s in both the answer key and the submission
-			TN += 1
-		elif sum(row) == 10.0:
-			# Entry in answer key but not in submission
-			FN += 1
-		elif 0.0 < sum(row) < 10.0:
-			if np.count_nonzero(row) == 1:
-				# Three 0s, one entry of less than ten means that the answer is right!
-				TP += 1
-			else:
-				# They got the wrong sample for this strain
-				FP += 1
-		else:
-			# row sum is less than 0, the submission thinks a strain is present where it isn't
-			FP += 1
-
-	return TP, FP, TN, FN
+	TP, FP, TN, FN = np.bincount(classify_rows(truth_matrix, submission_matrix), minlength=4).tolist()
+	return float(TP), float(FP), float(TN), float(FN)
 
 def compute_metrics(metrics_list):
 	# this part is totally taken from Keng's data, thanks Keng
@@ -112,93 +86,152 @@ def compute_metrics(metrics_list):
 
 	return [accuracy,precision,recall,F1,misclass]
 
-def adjusted_rand(answers_matrix, submission_matrix):
-	# the adjusted_rand_score option just takes a 1D array, so we've got to flatten these 2D arrays.
-	answers_list = []
-	submission_list = []
-	for sublist in answers_matrix:
-		for entry in sublist:
-			answers_list.append(entry)
-	for sublist in submission_matrix:
-		for entry in sublist:
-			submission_list.append(entry)
+def rand_labels(answers_matrix, submission_matrix):
+	# the adjusted Rand index works on 1D label arrays, so we flatten both matrices.
+	answers_list = np.ravel(answers_matrix)
+	submission_list = np.ravel(submission_matrix)
 	#Set to 1 any values above 0 so that ARI calculation is correct
-	submission_list_binary = [1 if i > 0 else i for i in submission_list]
-
-	# now we calculate rand score
-	return adjusted_rand_score(answers_list, submission_list_binary)
-
-truth_matrix = read_answer_key(truth_file)[0]
-submission_matrix = read_submission(results_file)
-
-# creating the first output file
-stats_outfile = open("strains2_submission_scores.tsv", "w")
-
-# header
-stats_outfile.write("TP\tFP\tTN\tFN\tAccuracy\tPrecision\tRecall\tF1\tmisclassification_rate\tadjusted_rand_index\n")
-# data
-init_metrics = compute_metrics(get_stats(truth_matrix, submission_matrix))
-stats_outfile.write("\t".join(str(int(item)) for item in get_stats(truth_matrix, submission_matrix)) + "\t")
-stats_outfile.write("\t".join(str(item) for item in init_metrics))
-stats_outfile.write("\t" + str(adjusted_rand(truth_matrix, submission_matrix)))
-stats_outfile.close()
-
-# Now, we need to generate the second output file...
-
-# sanity check - is this file binary?
-flat_submission_list = [item for sublist in submission_matrix for item in sublist]
-if list(set(flat_submission_list)) == [0,1]:
-	binary_report = open("strains2_binary", "w")
-	binary_report.write("binary == true")
-	binary_report.close()
-	sys.exit()
-
-# This one will require an iteration of removing the lowest confidence score, over and over.
-iter_outfile = open("strains2_submission_PRC_strains2.tsv", "w")
-iter_outfile.write("cutoff\tTP\tFP\tTN\tFN\tAccuracy\tPrecision\tRecall\tF1\tmisclassification\tadj_rand_index\n")
-iter_outfile.write("0.0\t" + "\t".join(str(int(item)) for item in get_stats(truth_matrix, submission_matrix)) + "\t")
-iter_outfile.write("\t".join(str(item) for item in init_metrics))
-iter_outfile.write("\t" + str(adjusted_rand(truth_matrix, submission_matrix)) + "\n")
-
-
-for iteration in range(0,39):
-	# first, we get the lowest number in the submission
-	masked_submission_matrix = []
-	for row in submission_matrix:
-		if sum(row) == 0:
-			continue
-		else:
-			masked_submission_matrix.append(row)
-	masked_list = [sum(row) for row in masked_submission_matrix]
-	lowest = min(i for i in masked_list if i > 0)
-
-	#Stop once value of 1 is reached
-	if lowest == 1:
-		break
-
-	# second, we replace the row with this lowest confidence value with zeroes
-	row_counter = 0
-	for row in submission_matrix:
-		if lowest in row:
-			submission_matrix[row_counter] = [0., 0., 0., 0.]
-			# this turns it off if nothing is left but 0s
-			if lowest == 0.0:
+	submission_list_binary = np.where(submission_list > 0, np.float32(1), submission_list)
+	return answers_list, submission_list_binary
+
+def contingency_cells(answers_list, submission_list, answer_labels, submission_labels):
+	# position of each (truth label, submission label) pair in a flattened contingency table
+	return np.searchsorted(answer_labels, answers_list) * len(submission_labels) + np.searchsorted(submission_labels, submission_list)
+
+def rand_table(answers_matrix, submission_matrix):
+	# the contingency table, plus where each matrix entry falls in it (flattened). A submission
+	# label of 0 is always included so that removed predictions have somewhere to go.
+	answers_list, submission_list = rand_labels(answers_matrix, submission_matrix)
+	answer_labels = np.unique(answers_list)
+	submission_labels = np.unique(np.append(submission_list, np.float32(0)))
+	cells = contingency_cells(answers_list, submission_list, answer_labels, submission_labels)
+	contingency = np.bincount(cells, minlength=len(answer_labels) * len(submission_labels))
+	return contingency.reshape(len(answer_labels), len(submission_labels)), cells.reshape(np.shape(submission_matrix)), submission_labels
+
+def adjusted_rand(answers_matrix, submission_matrix):
+	return metric_kernels.adjusted_rand_from_contingency(rand_table(answers_matrix, submission_matrix)[0])
+
+def score_submission(truth_matrix, submission_matrix):
+	# writes the scores (and PRC or binary) files for one submission to the working directory, and returns their names
+	# creating the first output file
+	stats_table = result_writer.ResultTable("strains2_submission_scores.tsv", ["TP", "FP", "TN", "FN", "Accuracy", "Precision", "Recall", "F1", "misclassification_rate", "adjusted_rand_index"],
+		fixed={"dataset": "strains2", "rank": "strain", "sample": "all"})
+	# data
+	with stage_timer.stage("metrics", rows=len(submission_matrix)):
+		init_stats = get_stats(truth_matrix, submission_matrix)
+		init_metrics = compute_metrics(init_stats)
+		contingency, cells, submission_labels = rand_table(truth_matrix, submission_matrix)
+		init_rand = metric_kernels.adjusted_rand_from_contingency(contingency)
+	stats_table.add_row(*[int(item) for item in init_stats] + list(init_metrics) + [init_rand])
+	written = [stats_table.write()]
+
+	# Now, we need to generate the second output file...
+
+	# sanity check - is this file binary?
+	if set(np.unique(submission_matrix).tolist()) == set([0.0, 1.0]):
+		binary_report = open("strains2_binary", "w")
+		binary_report.write("binary == true")
+		binary_report.close()
+		return ["strains2_submission_scores.tsv", "strains2_binary"] + written[0][1:] + filter(None, [stage_timer.write_report("strains2_submission_scores.tsv")])
+
+	# This one removes predictions in order of confidence, lowest first, and rescores after each confidence level.
+	with stage_timer.stage("sweep", rows=len(submission_matrix)):
+		iter_table = result_writer.ResultTable("strains2_submission_PRC_strains2.tsv", ["cutoff", "TP", "FP", "TN", "FN", "Accuracy", "Precision", "Recall", "F1", "misclassification", "adj_rand_index"],
+			keys={"cutoff": "cutoff"}, fixed={"dataset": "strains2", "rank": "strain", "sample": "all"})
+		iter_table.add_row(*[0.0] + [int(item) for item in init_stats] + list(init_metrics) + [init_rand])
+
+		# each row is removed at its own confidence level; we stop before removing anything with a confidence of 1
+		confidence = submission_matrix.sum(axis=1)
+		removed_rows = np.flatnonzero((confidence > 0) & (confidence < 1))
+		levels, row_levels = np.unique(confidence[removed_rows], return_inverse=True)
+
+		# a removed row moves from its class in the submission to its class once zeroed out...
+		before = classify_rows(truth_matrix, submission_matrix)[removed_rows]
+		after = classify_rows(truth_matrix, np.zeros_like(submission_matrix))[removed_rows]
+		stat_changes = np.bincount(row_levels * 4 + after, minlength=len(levels) * 4) - np.bincount(row_levels * 4 + before, minlength=len(levels) * 4)
+
+		# ...and each of its cells moves from its submission label to 0 in the ARI contingency table
+		table_size = contingency.size
+		removed_cells = cells[removed_rows]
+		zeroed_cells = removed_cells - removed_cells % len(submission_labels) + np.searchsorted(submission_labels, 0)
+		cell_levels = np.repeat(row_levels, submission_matrix.shape[1]) * table_size
+		contingency_changes = np.bincount((cell_levels + zeroed_cells.ravel()), minlength=len(levels) * table_size) - np.bincount((cell_levels + removed_cells.ravel()), minlength=len(levels) * table_size)
+
+		# running totals over the levels give the state after each confidence level is removed
+		level_stats = np.array(init_stats, dtype=np.int64) + np.cumsum(stat_changes.reshape(len(levels), 4), axis=0)
+		level_contingency = contingency.ravel() + np.cumsum(contingency_changes.reshape(len(levels), table_size), axis=0)
+
+		for lowest, stats, level_table in zip(levels, level_stats.tolist(), level_contingency):
+			try:
+				stats = tuple(float(item) for item in stats)
+				metrics = compute_metrics(stats)
+				iter_table.add_row(*[lowest] + [int(item) for item in stats] + list(metrics) + [metric_kernels.adjusted_rand_from_contingency(level_table.reshape(contingency.shape))])
+			except ZeroDivisionError:
+				# this occurs when trying to divide by 0, obviously
+				# At this point, we're out of positive values to subtract.
 				break
-		else:
-			# we need to continue in case there are multiple instances of the same cutoff
-			row_counter += 1
-	# At this point, if the lowest value is 0 confidence, we skip it (go to next loop iteration)
-	if lowest == 0.0:
-		continue
-	# third, we recalculate our stats
-	try:
-		stats = get_stats(truth_matrix, submission_matrix)
-		metrics = compute_metrics(get_stats(truth_matrix, submission_matrix))
-		iter_outfile.write(str(lowest) + "\t" + "\t".join(str(int(item)) for item in stats) + "\t")
-		iter_outfile.write("\t".join(str(item) for item in metrics) + "\t" + str(adjusted_rand(truth_matrix, submission_matrix)) + "\n")
-	except ZeroDivisionError:
-		# this occurs when trying to divide by 0, obviously
-		# At this point, we're out of positive values to subtract.
-		break
-
-iter_outfile.close()
+
+		written.append(iter_table.write())
+	# with profiling on, the stage timings go next to the scores; any columnar copies come after the text files
+	return [files[0] for files in written] + [file for files in written for file in files[1:]] + filter(None, [stage_timer.write_report("strains2_submission_scores.tsv")])
+
+# Bootstrap: each strain (row) is a unit, counting towards its row class and, for every sample, one
+# cell of the ARI contingency table (see challenges/common/bootstrap.py).
+
+def score_replicates(weights, classes, cell_categories, cells, table_shape):
+	# (replicates, 6): accuracy, precision, recall, F1, misclassification rate and adjusted Rand index
+	TP, FP, TN, FN = bootstrap.bin_sums(weights, np.arange(len(classes)), classes, 4).T
+	contingencies = bootstrap.bin_sums(weights, cell_categories, cells, table_shape[0] * table_shape[1])
+	total = TP + TN + FP + FN
+	with np.errstate(divide='ignore', invalid='ignore'):
+		precision = TP / (TP + FP)
+		recall = TP / (TP + FN)
+		F1 = 2 * (precision * recall) / (precision + recall)
+		return np.stack(((TP + TN) / total, precision, recall, F1, (FP + FN) / total,
+			metric_kernels.adjusted_rand_from_contingencies(contingencies.reshape((-1,) + tuple(table_shape)))), axis=1)
+
+def bootstrap_scores(truth_matrix, submission_matrix, replicates, seed=0):
+	# writes the scores with bootstrap intervals to the working directory, and returns its name
+	classes = classify_rows(truth_matrix, submission_matrix)
+	contingency, cells, submission_labels = rand_table(truth_matrix, submission_matrix)
+	# rows in the same class with the same cells are interchangeable
+	first, inverse, sizes = bootstrap.collapse(np.column_stack((classes, cells)))
+	data = (classes[first], np.repeat(np.arange(len(first)), cells.shape[1]), cells[first].ravel(), contingency.shape)
+	estimate = score_replicates(sizes[None].astype(float), *data)[0]
+	samples = bootstrap.replicate(score_replicates, sizes, data, replicates, entries=max(len(data[1]), contingency.size), seed=seed)
+	lower, upper = bootstrap.interval(samples)
+	ci_outfile = open("strains2_submission_scores_ci.tsv", "w")
+	ci_outfile.write("metric\testimate\tlower\tupper\treplicates\n")
+	for metric, values in zip(["Accuracy", "Precision", "Recall", "F1", "misclassification_rate", "adjusted_rand_index"], zip(estimate, lower, upper)):
+		ci_outfile.write("\t".join([metric] + [str(value) for value in values] + [str(replicates)]) + "\n")
+	ci_outfile.close()
+	return ["strains2_submission_scores_ci.tsv"]
+
+if __name__ == "__main__":
+	# --profile (or MOSAIC_PROFILE=1) also writes per-stage timings to strains2_submission_scores.profile.json
+	stage_timer.enable_from_argv()
+	# --bootstrap=N (or MOSAIC_BOOTSTRAP=N) also writes the scores with 95% intervals from N resamples to strains2_submission_scores_ci.tsv
+	replicates = bootstrap.replicates_from_argv()
+	# --format=parquet or --format=arrow (or MOSAIC_RESULT_FORMAT) also writes the scores and PRC files in that format (see challenges/common/result_writer.py)
+	result_format = result_writer.format_from_argv()
+	# starting files
+	truth_file=sys.argv[1]
+	results_file=sys.argv[2]
+	result_writer.submission = os.path.basename(results_file)
+
+	# with MOSAIC_RESULT_CACHE set to a directory, results are cached there (see challenges/common/result_cache.py)
+	cache = result_cache.open_cache("strains2", [replicates, result_format], truth_file, results_file, [sys.modules[__name__], table_loader, metric_kernels, bootstrap, result_writer])
+	if cache and cache.restore() is not None:
+		print "Scores taken from the result cache."
+	else:
+		with stage_timer.stage("parse") as parse:
+			truth_matrix = read_answer_key(truth_file)[0]
+			submission_matrix = read_submission(results_file, truth_matrix)
+			parse.rows = len(truth_matrix) + len(submission_matrix)
+		outputs = []
+		if replicates:
+			with stage_timer.stage("bootstrap", rows=replicates):
+				outputs = bootstrap_scores(truth_matrix, submission_matrix, replicates)
+		outputs += score_submission(truth_matrix, submission_matrix)
+		if cache:
+			cache.store(outputs)